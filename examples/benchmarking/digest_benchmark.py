@@ -0,0 +1,50 @@
+"""
+Microbenchmark for summing up LtHash row digests on the client (used when the engine can't
+aggregate the digests itself): compares folding one Digest object per row with the batched
+`Digest.sum_memoryviews` (with and without NumPy).
+
+Doesn't need a Splitgraph engine. Run with `python digest_benchmark.py [number of digests...]`
+"""
+import operator
+import os
+import sys
+import time
+from functools import reduce
+from unittest import mock
+
+from splitgraph.core.fragment_manager import Digest
+
+
+def _time(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def benchmark(no_digests: int) -> None:
+    digests = [os.urandom(32) for _ in range(no_digests)]
+
+    fold, fold_time = _time(
+        lambda: reduce(operator.add, map(Digest.from_memoryview, digests), Digest.empty())
+    )
+    with mock.patch("splitgraph.core.fragment_manager._NUMPY_AVAILABLE", False):
+        batched, batched_time = _time(lambda: Digest.sum_memoryviews(digests))
+    vectorized, vectorized_time = _time(lambda: Digest.sum_memoryviews(digests))
+
+    assert fold.hex() == batched.hex() == vectorized.hex()
+    print(
+        "%d digests: fold %.2fs, batched %.2fs (%.1fx), vectorized %.2fs (%.1fx)"
+        % (
+            no_digests,
+            fold_time,
+            batched_time,
+            fold_time / batched_time,
+            vectorized_time,
+            fold_time / vectorized_time,
+        )
+    )
+
+
+if __name__ == "__main__":
+    for size in [int(s) for s in sys.argv[1:]] or [1000000, 10000000]:
+        benchmark(size)
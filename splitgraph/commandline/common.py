@@ -2,6 +2,7 @@
 Various common functions used by the command line interface.
 """
 import io
+import itertools
 import json
 import os
 from functools import wraps
@@ -197,16 +198,50 @@ def sql_results_to_str(results: List[Tuple[Any]], use_json: bool = False) -> str
     return tabulate(results, tablefmt="plain")
 
 
-def emit_sql_results(results, use_json=False, show_all=False):
+def emit_sql_results(results, use_json=False, show_all=False, batch_size=10000):
+    """
+    Print out results of an SQL query.
+
+    :param results: List or iterator of result rows (e.g. from `engine.run_sql_stream`). Only
+        the first 10 rows are consumed unless `show_all` is True.
+    :param use_json: Output rows as JSON
+    :param show_all: Output all rows. Results are printed in batches of `batch_size`
+        rows, so that the whole result doesn't have to be held in memory. Columns are
+        as wide as in the first batch, unless a later batch has wider values.
+    :param batch_size: Number of rows in each batch
+    """
     if results is None:
         return
 
-    if len(results) > 10 and not show_all:
-        click.echo(sql_results_to_str(results[:10], use_json))
-        if not json:
+    results = iter(results)
+    if not show_all:
+        head = list(itertools.islice(results, 11))
+        click.echo(sql_results_to_str(head[:10], use_json))
+        if len(head) > 10 and not use_json:
             click.echo("...")
-    else:
-        click.echo(sql_results_to_str(results, use_json))
+        return
+
+    if use_json:
+        # Stream a JSON array out row by row
+        from splitgraph.core.common import coerce_val_to_json
+
+        click.echo("[", nl=False)
+        for i, row in enumerate(results):
+            click.echo((", " if i else "") + json.dumps(coerce_val_to_json(row)), nl=False)
+        click.echo("]")
+        return
+
+    # Tabulate later batches together with the first one, so that their columns line up
+    # with it, and skip the first batch's lines in the output.
+    first_batch = list(itertools.islice(results, batch_size))
+    output = sql_results_to_str(first_batch)
+    click.echo(output)
+    first_lines = len(output.split("\n"))
+    while True:
+        batch = list(itertools.islice(results, batch_size))
+        if not batch:
+            break
+        click.echo("\n".join(sql_results_to_str(first_batch + batch).split("\n")[first_lines:]))
 
 
 class ResettableStream(io.RawIOBase):
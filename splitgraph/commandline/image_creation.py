@@ -77,6 +77,20 @@ def checkout_c(image_spec, force, uncheckout, layered):
     help="Split new tables into chunks of this many rows (by primary key). The default "
     "value is governed by the SG_COMMIT_CHUNK_SIZE configuration parameter.",
 )
+@click.option(
+    "-w",
+    "--chunk-workers",
+    default=None,
+    type=int,
+    help="Use this many engine connections to store chunks of new tables in parallel.",
+)
+@click.option(
+    "-j",
+    "--table-workers",
+    default=None,
+    type=int,
+    help="Use this many engine connections to store different tables in parallel.",
+)
 @click.option(
     "-k",
     "--chunk-sort-keys",
@@ -105,6 +119,8 @@ def commit_c(
     repository,
     snap,
     chunk_size,
+    chunk_workers,
+    table_workers,
     chunk_sort_keys,
     split_changesets,
     index_options,
@@ -122,6 +138,13 @@ def commit_c(
     that the table will be split into (default is no splitting). The splitting is done by the
     table's primary key.
 
+    If `--chunk-workers` is passed, chunks of tables stored as full snapshots are hashed, stored and
+    indexed in parallel using this many connections to the engine (capped by the engine's
+    SG_ENGINE_POOL setting). The resulting objects are the same as when committing with one worker.
+
+    If `--table-workers` is passed, different tables are stored in parallel using this many connections
+    to the engine. The new image only becomes visible once all of its tables have been stored.
+
     If `--split-changesets` is passed, delta-compressed changes will also be split up according to the original
     table chunk boundaries. For example, if there's a change to the first and the 20000th row of a table that was
     originally committed with `--chunk-size=10000`, this will create 2 fragments: one based on the first chunk
@@ -138,6 +161,15 @@ def commit_c(
     Bloom filtering allows to trade off between the space overhead of the index and the probability of a false
     positive (claiming that an object contains a record when it actually doesn't, leading to extra scans).
 
+    For columns with few distinct values, the set index stores all of them, which lets queries with equalities
+    or `IN` skip all chunks that don't contain the values they're looking for. If a chunk has more than
+    `max_values` distinct values in the column (100 by default), a bloom filter is built for it instead
+    (with the same options as the bloom index).
+
+    The trigram index is a bloom filter on all 3-character substrings of the values in a text column. It's used
+    to skip chunks for `LIKE` and `ILIKE` queries (e.g. `LIKE '%error%'` or `LIKE 'prefix%'`). It takes the same
+    options as the bloom index.
+
     An example `index-options` dictionary:
 
     \b
@@ -148,8 +180,20 @@ def commit_c(
                 "column_1": {
                     "probability": 0.01,   # Only one of probability
                     "size": 10000          # or size can be specified.
+                },
+                "column_4": {
+                    "probability": 0.01,
+                    # Use the faster XXH3 hash instead of SHA256
+                    # (requires the xxhash package).
+                    "hash_function": "xxh3"
                 }
             },
+            "set": {
+                "column_5": {"max_values": 50, "probability": 0.01}
+            },
+            "trigram": {
+                "column_6": {"probability": 0.01}
+            },
             # Only compute the range index on these columns. By default,
             # it's computed on all columns and is always computed on the
             # primary key no matter what.
@@ -166,6 +210,8 @@ def commit_c(
         extra_indexes=index_options,
         in_fragment_order=chunk_sort_keys,
         overwrite=overwrite,
+        chunk_workers=chunk_workers,
+        table_workers=table_workers,
     ).image_hash
     click.echo("Committed %s as %s." % (str(repository), new_hash[:12]))
 
@@ -333,7 +379,7 @@ def import_c(image_spec, table_or_query, target_repository, target_table):
     type=JsonType(),
     required=True,
     help="JSON dictionary of extra indexes to calculate, e.g. "
-    '\'{"bloom": {"column_1": {"probability": 0.01}}}\'',
+    '\'{"bloom": {"column_1": {"probability": 0.01}}, "set": {"column_2": {"max_values": 50}}}\'',
 )
 @click.option(
     "-o",
@@ -1,7 +1,7 @@
 """
 sgr commands related to getting information out of / about images
 """
-
+import re
 from collections import Counter, defaultdict
 from typing import List, Optional, Tuple, Union, Dict, cast, TYPE_CHECKING
 
@@ -268,7 +268,7 @@ def object_c(object_id):
     """
     from splitgraph.core.object_manager import ObjectManager
     from splitgraph.engine import get_engine, ResultShape
-    from ..core.output import pretty_size
+    from ..core.output import pretty_size, pluralise
     from ..core.sql import select
     from splitgraph.core.indexing.bloom import describe
 
@@ -295,6 +295,14 @@ def object_c(object_id):
         click.echo("Bloom index: ")
         for col_name, col_bloom in sg_object.object_index["bloom"].items():
             click.echo("  %s: %s" % (col_name, describe(col_bloom)))
+    if "set" in sg_object.object_index:
+        click.echo("Set index: ")
+        for col_name, col_values in sg_object.object_index["set"].items():
+            click.echo("  %s: %s" % (col_name, pluralise("value", len(col_values))))
+    if "trigram" in sg_object.object_index:
+        click.echo("Trigram index: ")
+        for col_name, col_trigram in sg_object.object_index["trigram"].items():
+            click.echo("  %s: %s" % (col_name, describe(col_trigram)))
 
     if object_manager.object_engine.registry:
         # Don't try to figure out the object's location if we're talking
@@ -392,16 +400,34 @@ def sql_c(sql, schema, image, show_all, json, no_transaction):
     if no_transaction:
         engine.autocommit = True
 
+    # Stream the results of queries through a server-side cursor instead of loading them into
+    # memory. Other statements (or multiple statements) can't be run in a cursor.
+    run_sql = engine.run_sql_stream if _is_single_query(sql) else engine.run_sql
+
     if not image:
         if schema:
             engine.run_sql("SET search_path TO %s", (schema,))
-        results = engine.run_sql(sql)
+        emit_sql_results(run_sql(sql), use_json=json, show_all=show_all)
     else:
         repo, image = image
         with image.query_schema() as s:
-            results = engine.run_sql_in(s, sql)
+            # Consume the results before the temporary schema gets deleted.
+            engine.run_sql("SET search_path TO %s,public", (s,))
+            emit_sql_results(run_sql(sql), use_json=json, show_all=show_all)
+            engine.run_sql("SET search_path TO public")
+
 
-    emit_sql_results(results, use_json=json, show_all=show_all)
+_QUERY_RE = re.compile(r"^\s*(SELECT|VALUES|TABLE)\b", re.IGNORECASE)
+
+
+def _is_single_query(sql: str) -> bool:
+    """Best-effort check for whether the SQL is a single statement that returns rows and can be
+    used to declare a cursor."""
+    return (
+        bool(_QUERY_RE.match(sql))
+        and ";" not in sql.strip().rstrip(";")
+        and not re.search(r"\bINTO\b", sql, re.IGNORECASE)
+    )
 
 
 def _emit_repository_data(repositories, engine):
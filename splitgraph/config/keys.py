@@ -12,6 +12,7 @@ DEFAULTS: ConfigDict = {
     "SG_NAMESPACE": "",
     "SG_IS_REGISTRY": "",
     "SG_CHECK_VERSION": "true",
+    "SG_CHANGE_CAPTURE": "trigger",
     "SG_ENGINE_FDW_HOST": "localhost",
     "SG_ENGINE_FDW_PORT": "5432",
     "SG_ENGINE_HOST": "localhost",
@@ -29,8 +30,15 @@ DEFAULTS: ConfigDict = {
     # US election dataset build by about 30% (82s -> 56s) for the version that uses FROM IMPORT and
     # by about 50% (101s -> 53s) for the version that runs a single big join against multiple images.
     "SG_LQ_TUNING": "SET enable_sort=off; SET enable_hashagg=on;",
+    "SG_LQ_PREFETCH_WINDOW": "",
+    "SG_MERGE_ON_READ": "false",
+    "SG_LQ_PARALLEL_SCANS": "",
+    "SG_LQ_PLAN_CACHE_SIZE": "",
     "SG_COMMIT_CHUNK_SIZE": "10000",
+    "SG_COMMIT_CHUNK_TOLERANCE": "0",
+    "SG_COMMIT_CHUNK_MODE": "rows",
     "SG_ENGINE_POOL": "16",
+    "SG_ENGINE_ITERSIZE": "10000",
     "SG_CONFIG_FILE": "",
     "SG_META_SCHEMA": "splitgraph_meta",
     "SG_CONFIG_DIRS": "",
@@ -44,6 +52,7 @@ DEFAULTS: ConfigDict = {
     "SG_S3_KEY": "",
     "SG_S3_PWD": "",
     "SG_OBJECT_CACHE_SIZE": "10240",
+    "SG_INDEX_CACHE_SIZE": "64",
     "SG_EVICTION_DECAY": "0.002",
     "SG_EVICTION_FLOOR": "1",
     "SG_EVICTION_MIN_FRACTION": "0.05",
@@ -131,6 +140,7 @@ This can also be changed by passing `--verbosity` to `sgr`, e.g. `sgr --verbosit
     "SG_NAMESPACE": "Namespace used by default when pushing to this engine, if not explicitly specified. Normally this is set to the user's username on the registry.",
     "SG_IS_REGISTRY": "Whether this engine is a registry (access only via the SQL API) or an actual Splitgraph engine that supports checkouts.",
     "SG_CHECK_VERSION": "Whether to check the version of the Splitgraph library installed on this engine when a connection to it is first made.",
+    "SG_CHANGE_CAPTURE": "How the engine tracks changes to checked out tables. `trigger` (default) uses an audit trigger that records every change as it's made. `logical` decodes changes from the engine's write-ahead log instead (using a logical replication slot that's created by `sgr init`), which makes writes to checked out tables faster but requires the engine to be started with `wal_level = logical` (not enabled by default, see the engine's `postgresql.conf`).",
     "SG_ENGINE_FDW_HOST": "Hostname to use for this engine when it's connecting to itself (during layered querying).",
     "SG_ENGINE_FDW_PORT": "Port to use for this engine when it's connecting to itself (during layered querying).",
     "SG_ENGINE_HOST": "Hostname to use for sgr to connect to the engine.",
@@ -143,8 +153,15 @@ This can also be changed by passing `--verbosity` to `sgr`, e.g. `sgr --verbosit
     "SG_ENGINE_POSTGRES_DB_NAME": "Name of the default database that the superuser connects to to initialize Splitgraph.",
     "SG_ENGINE_OBJECT_PATH": "Path on the engine's filesystem where Splitgraph physical object files are stored.",
     "SG_LQ_TUNING": "Postgres query planner configuration for Splitfile execution and table imports. This is run before a layered query is executed and allows to tune query planning in case of LQ performance issues. For possible values, see the [PostgreSQL documentation](https://www.postgresql.org/docs/12/runtime-config-query.html).",
+    "SG_LQ_PREFETCH_WINDOW": "If set, layered querying downloads objects lazily, as the scan reaches them, keeping up to this many objects downloaded ahead of the one that's being read. This speeds up queries that don't need to read the whole table (e.g. with a `LIMIT`). By default, all objects that a query might need are downloaded before it starts.",
+    "SG_MERGE_ON_READ": "Set to `true` to resolve overlapping fragments with a single `SELECT DISTINCT ON` query when querying or checking out tables, instead of applying them one by one to a staging table. This avoids writing the table out an extra time but requires the engine to sort the fragments' rows by primary key. Tables without a primary key always use the staging table, since merging them would collapse duplicate rows.",
+    "SG_LQ_PARALLEL_SCANS": "Number of fragments that layered querying reads at the same time, each on a separate connection to the engine (capped by `SG_ENGINE_POOL`). Only fragments that don't overlap with other fragments are read in parallel. By default, fragments are read one by one. Can be overridden for a single layered querying table with the `parallel_scans` foreign table option.",
+    "SG_LQ_PLAN_CACHE_SIZE": "If set, layered querying stores up to this many query plans (which fragments a query has to scan) in the metadata engine, so that they can be reused by other sessions, evicting the least recently used plans when the cache is full. Plans are cached per image, table, qualifiers and columns. By default, plans are only cached in memory for the lifetime of a table object.",
     "SG_COMMIT_CHUNK_SIZE": "Default chunk size when `sgr commit` is run. Can be overriden in the command line client by passing `--chunk-size`",
+    "SG_COMMIT_CHUNK_TOLERANCE": "Allowed relative deviation of the number of rows in each chunk from the chunk size (e.g. 0.1 for 10%) when committing tables with a primary key. If 0, chunk boundaries are found exactly by walking the primary key. Otherwise, they're estimated from a random sample of the table's rows, which avoids fetching every primary key in order on very large tables.",
+    "SG_COMMIT_CHUNK_MODE": "How to split tables with a primary key into chunks when they're stored as full snapshots. `rows` (default) makes every chunk have the same number of rows. `content` picks chunk boundaries based on a hash of the primary key, with chunks having `SG_COMMIT_CHUNK_SIZE` rows on average. This means that reloading a table with a few changed rows and committing it as a snapshot will mostly produce the same objects as before, which won't need to be stored or pushed again.",
     "SG_ENGINE_POOL": "Size of the connection pool used to download/upload objects. Note that in the case of layered querying with joins on multiple tables, each table will use this many parallel threads to download objects, which can overwhelm the engine. Decrease this value in that case.",
+    "SG_ENGINE_ITERSIZE": "Number of rows to fetch from the engine at a time when streaming query results through a server-side cursor (used by layered querying and `sgr sql`).",
     "SG_CONFIG_FILE": "Location of the Splitgraph configuration file. By default, Splitgraph looks for the configuration in `~/.splitgraph/.sgconfig` and then the current directory.",
     "SG_META_SCHEMA": "Name of the metadata schema. Note that whilst this can be changed, it hasn't been tested and won't be taken into account by engines connecting to this one.",
     "SG_CONFIG_DIRS": "List of directories used to look up the configuration file.",
@@ -158,6 +175,7 @@ This can also be changed by passing `--verbosity` to `sgr`, e.g. `sgr --verbosit
     "SG_S3_KEY": "S3 access key.",
     "SG_S3_PWD": "S3 secure key.",
     "SG_OBJECT_CACHE_SIZE": "Object cache size, in megabytes. This only concerns objects downloaded from an external location or a remote engine. When there is no space in the object cache, an eviction is run and objects that haven't been used recently or that are small enough to be easily redownloaded are deleted to free up space.",
+    "SG_INDEX_CACHE_SIZE": "Size of the in-memory cache of decoded object indexes used to filter fragments during layered querying, in megabytes. Set to 0 to disable it and always query the metadata engine.",
     "SG_EVICTION_DECAY": "Significance of recent usage time and object size in cache eviction. See documentation for splitgraph.core.object_manager for an explanation.",
     "SG_EVICTION_FLOOR": "Significance of recent usage time and object size in cache eviction. See documentation for splitgraph.core.object_manager for an explanation.",
     "SG_EVICTION_MIN_FRACTION": "Minimum fraction of the total cache size that has to get freed when an eviction is run. This is to avoid frequent evictions.",
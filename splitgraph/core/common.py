@@ -39,6 +39,8 @@ META_TABLES = [
     "object_cache_occupancy",
     "info",
     "version",
+    "query_plan_cache",
+    "object_ranges",
 ]
 OBJECT_MANAGER_TABLES = ["object_cache_status", "object_cache_occupancy"]
 _SPLITGRAPH_META_DIR = "resources/splitgraph_meta"
@@ -197,15 +199,30 @@ def slow_diff(
                 SQL("SELECT * FROM {}.{}").format(Identifier(mp_2), Identifier(table_2))
             )
 
+    left_lookup = _make_row_lookup(left)
+    right_lookup = _make_row_lookup(right)
+
     if aggregate:
-        return sum(1 for r in right if r not in left), sum(1 for r in left if r not in right), 0
+        return (
+            sum(1 for r in right if r not in left_lookup),
+            sum(1 for r in left if r not in right_lookup),
+            0,
+        )
 
     # Return format: list of [(False for deleted/True for inserted, full row)]
-    return [(False, r) for r in left if r not in right] + [
-        (True, r) for r in right if r not in left
+    return [(False, r) for r in left if r not in right_lookup] + [
+        (True, r) for r in right if r not in left_lookup
     ]
 
 
+def _make_row_lookup(rows: List[Tuple]) -> Union[Set[Tuple], List[Tuple]]:
+    # Rows with unhashable values (e.g. arrays or JSON) have to be looked up in the list.
+    try:
+        return set(rows)
+    except TypeError:
+        return rows
+
+
 def gather_sync_metadata(
     target: "Repository",
     source: "Repository",
@@ -0,0 +1,267 @@
+"""
+Routines for diffing versions of a table by looking only at the fragments that differ between them.
+"""
+import logging
+from typing import Dict, List, Optional, Sequence, Set, Tuple, Union, TYPE_CHECKING, cast
+
+from psycopg2.sql import SQL, Identifier, Composed
+
+from splitgraph.config import SPLITGRAPH_META_SCHEMA
+from splitgraph.core.fragment_manager import get_chunk_groups
+from splitgraph.core.indexing.range import _strip_type_mod
+from splitgraph.core.types import TableSchema
+from splitgraph.engine import ResultShape
+from splitgraph.engine.postgres.engine import get_change_key
+from splitgraph.exceptions import SplitGraphError
+
+if TYPE_CHECKING:
+    from splitgraph.core.table import Table
+
+# Types without an equality operator: rows containing them can't be compared by the engine.
+_INCOMPARABLE_TYPES = ["json", "xml", "point", "line", "lseg", "box", "path", "polygon", "circle"]
+
+DiffResult = Union[Tuple[int, int, int], List[Tuple[bool, Tuple]]]
+
+
+def _is_diffable(table_1: "Table", table_2: "Table") -> bool:
+    schema_1 = [(c.name, c.pg_type, c.is_pk) for c in table_1.table_schema]
+    schema_2 = [(c.name, c.pg_type, c.is_pk) for c in table_2.table_schema]
+    return (
+        schema_1 == schema_2
+        and any(c.is_pk for c in table_1.table_schema)
+        and all(_strip_type_mod(c.pg_type) not in _INCOMPARABLE_TYPES for c in table_1.table_schema)
+    )
+
+
+def split_fragments(
+    objects_1: List[str], objects_2: List[str]
+) -> Optional[Tuple[List[str], List[str]]]:
+    """
+    Find fragments that are unique to each of two versions of a table. Rows that are only
+    in the shared fragments are the same in both versions.
+
+    :return: Lists of fragments unique to the first and the second version or None if the
+        shared fragments are applied in a different order (and so can't be ignored, since the
+        latest version of a row is the one in the last fragment containing it).
+    """
+    shared = set(objects_1).intersection(objects_2)
+    if [o for o in objects_1 if o in shared] != [o for o in objects_2 if o in shared]:
+        return None
+    return [o for o in objects_1 if o not in shared], [o for o in objects_2 if o not in shared]
+
+
+def get_fragment_ranges(
+    table: "Table", objects: List[str]
+) -> Optional[Dict[str, Tuple[Tuple, Tuple]]]:
+    """
+    :return: Dictionary of fragment -> (min PK, max PK) or None if some fragments don't have
+        the PK range in their index.
+    """
+    try:
+        return dict(
+            zip(
+                objects,
+                table.repository.objects.get_min_max_pks(
+                    objects, get_change_key(table.table_schema)
+                ),
+            )
+        )
+    except SplitGraphError:
+        return None
+
+
+def get_overlapping_fragments(
+    object_ranges: Dict[str, Tuple[Tuple, Tuple]], unique: Sequence[str]
+) -> Set[str]:
+    """
+    :return: Fragments that overlap any of the `unique` fragments (including them).
+        Other fragments can't contain rows that changed.
+    """
+    unique_set = set(unique)
+    result: Set[str] = set()
+    for group in get_chunk_groups([(o, r[0], r[1]) for o, r in object_ranges.items()]):
+        group_objects = [o for o, _, _ in group]
+        if any(o in unique_set for o in group_objects):
+            result.update(group_objects)
+    return result
+
+
+def generate_changed_keys_query(table_schema: TableSchema, unique: Sequence[str]) -> Composed:
+    """
+    :return: Query returning all PKs that appear in the given fragments (including
+        deleted rows).
+    """
+    pk_list = SQL(",").join(Identifier(c.name) for c in table_schema if c.is_pk)
+    return SQL(" UNION ").join(
+        SQL("SELECT ")
+        + pk_list
+        + SQL(" FROM {}.{}").format(Identifier(SPLITGRAPH_META_SCHEMA), Identifier(o))
+        for o in unique
+    )
+
+
+def _get_appended_patch_stats(
+    objects: List[str],
+    unique: List[str],
+    object_ranges: Dict[str, Tuple[Tuple, Tuple]],
+    table: "Table",
+) -> Optional[Tuple[int, int]]:
+    """If the fragments unique to a table are patches applied on top of all of the other
+    table's fragments and don't overlap each other, every row they change is counted exactly
+    once in their metadata and the diff is just the sum of their inserted/deleted rows."""
+    if objects[len(objects) - len(unique) :] != unique:
+        return None
+    groups = get_chunk_groups([(o, object_ranges[o][0], object_ranges[o][1]) for o in unique])
+    if any(len(group) > 1 for group in groups):
+        return None
+    object_meta = table.repository.objects.get_object_meta(unique)
+    return (
+        sum(object_meta[o].rows_inserted for o in unique),
+        sum(object_meta[o].rows_deleted for o in unique),
+    )
+
+
+def _generate_diff_query(
+    table: "Table",
+    objects_1: List[str],
+    objects_2: List[str],
+    unique: Sequence[str],
+    aggregate: bool,
+) -> Composed:
+    engine = table.repository.object_engine
+    table_schema = table.table_schema
+    columns = [c.name for c in table_schema]
+    pk_cols = [c.name for c in table_schema if c.is_pk]
+    col_list = SQL(",").join(Identifier(c) for c in columns)
+    pk_list = SQL(",").join(Identifier(c) for c in pk_cols)
+
+    def _fragments_query(objects: List[str]) -> Composed:
+        # Only rows with PKs that appear in one of the fragments unique to either table can
+        # be different, since all other rows come from the same fragments in both tables.
+        key_qual = SQL("(") + pk_list + SQL(") IN (SELECT ") + pk_list + SQL(" FROM sg_diff_keys)")
+        if not objects:
+            return (
+                SQL("SELECT ")
+                + col_list
+                + SQL(" FROM {}.{} WHERE false").format(
+                    Identifier(SPLITGRAPH_META_SCHEMA), Identifier(unique[0])
+                )
+            )
+        return engine.generate_merge_query(
+            [(SPLITGRAPH_META_SCHEMA, o) for o in objects], table_schema, key_qual
+        )
+
+    # WITH sg_diff_keys AS (SELECT pk FROM unique_1 UNION SELECT pk FROM unique_2...),
+    #   sg_diff_left AS (latest versions of the keys in table 1),
+    #   sg_diff_right AS (latest versions of the keys in table 2)
+    # SELECT false, * FROM (left EXCEPT right) UNION ALL SELECT true, * FROM (right EXCEPT left)
+    query = (
+        SQL("WITH sg_diff_keys AS (")
+        + generate_changed_keys_query(table_schema, unique)
+        + SQL("), sg_diff_left AS (")
+        + _fragments_query(objects_1)
+        + SQL("), sg_diff_right AS (")
+        + _fragments_query(objects_2)
+        + SQL(") ")
+    )
+    changes = SQL(" UNION ALL ").join(
+        SQL("SELECT {} AS sg_added, ").format(SQL(added))
+        + col_list
+        + SQL(" FROM (SELECT ")
+        + col_list
+        + SQL(" FROM {} EXCEPT SELECT ").format(Identifier(source))
+        + col_list
+        + SQL(" FROM {}) {}").format(Identifier(other), Identifier(source + "_changes"))
+        for added, source, other in [
+            ("false", "sg_diff_left", "sg_diff_right"),
+            ("true", "sg_diff_right", "sg_diff_left"),
+        ]
+    )
+
+    if aggregate:
+        return (
+            query
+            + SQL(
+                "SELECT COUNT(*) FILTER (WHERE sg_added), COUNT(*) FILTER (WHERE NOT sg_added), 0 "
+                "FROM ("
+            )
+            + changes
+            + SQL(") c")
+        )
+
+    # Return removed rows first, ordered by the PK.
+    return (
+        query
+        + changes
+        + SQL(" ORDER BY sg_added, ")
+        + SQL(",").join(SQL(str(columns.index(c) + 2)) for c in pk_cols)
+    )
+
+
+def fragment_diff(table_1: "Table", table_2: "Table", aggregate: bool) -> Optional[DiffResult]:
+    """
+    Diff two versions of a table without materializing them. Fragments that are shared by
+    the two tables cancel out and only rows with primary keys that appear in fragments
+    unique to either table are compared by the engine.
+
+    If the only difference between the tables is a set of non-overlapping patches applied
+    on top of one of them, aggregate counts are calculated from the patches' metadata
+    without reading them at all.
+
+    :param table_1: First version of the table
+    :param table_2: Second version of the table
+    :param aggregate: If True, return a tuple of (added, removed, 0) rows.
+    :return: Diff in the same format as `Repository.diff` or None if the tables can't be diffed
+        this way (e.g. if the schema has changed or the table has no primary key).
+    """
+    if not _is_diffable(table_1, table_2):
+        return None
+
+    objects_1 = table_1.objects
+    objects_2 = table_2.objects
+    split = split_fragments(objects_1, objects_2)
+    if split is None:
+        return None
+    unique_1, unique_2 = split
+    if not unique_1 and not unique_2:
+        return (0, 0, 0) if aggregate else []
+
+    all_objects = objects_1 + unique_2
+    object_ranges = get_fragment_ranges(table_1, all_objects)
+    if object_ranges is None:
+        # No PK index: we can't prune the shared fragments.
+        relevant = set(all_objects)
+    else:
+        if aggregate:
+            stats = None
+            if not unique_1:
+                stats = _get_appended_patch_stats(objects_2, unique_2, object_ranges, table_2)
+            elif not unique_2:
+                reverse_stats = _get_appended_patch_stats(
+                    objects_1, unique_1, object_ranges, table_1
+                )
+                stats = (reverse_stats[1], reverse_stats[0]) if reverse_stats else None
+            if stats:
+                return stats[0], stats[1], 0
+        relevant = get_overlapping_fragments(object_ranges, unique_1 + unique_2)
+
+    relevant_1 = [o for o in objects_1 if o in relevant]
+    relevant_2 = [o for o in objects_2 if o in relevant]
+    logging.info(
+        "Diffing table %s using %d/%d and %d/%d fragments",
+        table_1.table_name,
+        len(relevant_1),
+        len(objects_1),
+        len(relevant_2),
+        len(objects_2),
+    )
+
+    engine = table_1.repository.object_engine
+    query = _generate_diff_query(table_1, relevant_1, relevant_2, unique_1 + unique_2, aggregate)
+    with table_2.repository.objects.ensure_objects(
+        table_2, objects=list(set(relevant_1 + relevant_2))
+    ):
+        if aggregate:
+            added, removed, updated = engine.run_sql(query, return_shape=ResultShape.ONE_MANY)
+            return int(added), int(removed), int(updated)
+        return [(r[0], tuple(r[1:])) for r in cast(List[Tuple], engine.run_sql(query))]
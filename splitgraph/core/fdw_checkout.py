@@ -1,5 +1,7 @@
 """Module imported by Multicorn on the Splitgraph engine server: a foreign data wrapper that implements
 layered querying (read-only queries to Splitgraph tables without materialization)."""
+
+import itertools
 import logging
 from typing import Optional
 
@@ -7,7 +9,7 @@ import splitgraph.config
 from splitgraph.core.output import pretty_size
 from splitgraph.core.object_manager import ObjectManager
 from splitgraph.core.repository import Repository, get_engine
-from splitgraph.core.table import QueryPlan
+from splitgraph.core.table import QueryPlan, scan_tables, scan_tables_parallel
 
 try:
     from multicorn import ForeignDataWrapper, ANY
@@ -43,6 +45,8 @@ class QueryingForeignDataWrapper(ForeignDataWrapper):
 
             if qual.value is None:
                 return [[]]
+            # Operators are passed through as they are (e.g. ~~ for LIKE and ~~* for ILIKE):
+            # fragment filtering decides which ones it can use.
             return [[(qual.field_name, qual.operator, qual.value)]]
 
         return [q for qual in quals for q in _qual_to_cnf(qual) if q != []]
@@ -96,6 +100,22 @@ class QueryingForeignDataWrapper(ForeignDataWrapper):
             pks = [k[1] for k in self.table.table_schema]
         return [(tuple(pks), 1)]
 
+    def can_sort(self, sortkeys):
+        """
+        Method called from the planner to ask which sorts we can enforce: we can return results
+        sorted by (a prefix of) the primary key in the ascending order by querying fragments in
+        the order of their primary key ranges and sorting every one of them separately.
+        """
+        sort_key = self.table.get_sort_key()
+        if not sort_key:
+            return []
+        result = []
+        for sortkey, column in zip(sortkeys, sort_key):
+            if sortkey.attname != column or sortkey.is_reversed or sortkey.nulls_first:
+                break
+            result.append(sortkey)
+        return result
+
     def execute(self, quals, columns, sortkeys=None):
         """Main Multicorn entry point."""
         # We assume that columns here is a list of columns (rather than a set)
@@ -110,7 +130,49 @@ class QueryingForeignDataWrapper(ForeignDataWrapper):
             self.end_scan_callback(from_fdw=True)
             self.end_scan_callback = None
 
-        queries, self.end_scan_callback, self.plan = self.table.query_indirect(columns, cnf_quals)
+        prefetch = splitgraph.config.get_singleton(
+            splitgraph.config.CONFIG, "SG_LQ_PREFETCH_WINDOW"
+        )
+        queries, self.end_scan_callback, self.plan = self.table.query_indirect(
+            columns, cnf_quals, prefetch=int(prefetch) if prefetch else None, sort=bool(sortkeys)
+        )
+        queries = iter(queries)
+
+        if sortkeys:
+            # We can't ask Multicorn to sort the tables it scans, so run the sorted
+            # queries ourselves instead.
+            for row in scan_tables(
+                self.object_engine,
+                queries,
+                self.plan.columns,
+                self.plan.sql_quals,
+                self.plan.sql_qual_vals,
+                order_by=self.table.get_sort_key(),
+            ):
+                yield dict(zip(self.plan.columns, row))
+            return
+
+        # If enabled, read directly-queryable fragments in parallel ourselves and return the
+        # rows to Multicorn instead of letting it scan them one by one. This doesn't work with
+        # lazy downloads, since those release each fragment as soon as we move on to the next one.
+        workers = int(
+            self.fdw_options.get("parallel_scans")
+            or splitgraph.config.get_singleton(splitgraph.config.CONFIG, "SG_LQ_PARALLEL_SCANS")
+            or 1
+        )
+        singletons = len(self.plan.singleton_queries)
+        if workers > 1 and singletons > 1 and not prefetch:
+            for result in scan_tables_parallel(
+                self.object_engine,
+                list(itertools.islice(queries, singletons)),
+                self.plan.columns,
+                workers,
+                self.plan.sql_quals,
+                self.plan.sql_qual_vals,
+                ordered=False,
+            ):
+                for row in result:
+                    yield dict(zip(self.plan.columns, row))
         yield from queries
 
     def end_scan(self):
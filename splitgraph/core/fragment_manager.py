@@ -7,37 +7,94 @@ import itertools
 import json
 import logging
 import math
-import operator
 import struct
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
-from functools import reduce
 from hashlib import sha256
-from typing import Any, Dict, List, Optional, Set, Tuple, Union, TYPE_CHECKING, cast, TypeVar
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+    TYPE_CHECKING,
+    cast,
+    TypeVar,
+    Sequence,
+)
 
 from psycopg2._json import Json
-from psycopg2.errors import UniqueViolation
-from psycopg2.sql import SQL, Identifier
+from psycopg2.errors import UniqueViolation, UndefinedFunction
+from psycopg2.sql import SQL, Identifier, Composed, Composable
 from tqdm import tqdm
 
-from splitgraph.config import SPLITGRAPH_API_SCHEMA, SG_CMD_ASCII
-from splitgraph.core.indexing.bloom import generate_bloom_index, filter_bloom_index
+from splitgraph.config import CONFIG, SPLITGRAPH_API_SCHEMA, SG_CMD_ASCII, get_singleton
+from splitgraph.core.indexing.bloom import (
+    bloom_digest_aggregate,
+    generate_bloom_index,
+    filter_bloom_index,
+    filter_bloom_index_in_memory,
+)
+from splitgraph.core.indexing.cache import get_index_cache, invalidate_index_cache
 from splitgraph.core.indexing.range import (
     generate_range_index,
     filter_range_index,
+    filter_range_index_in_memory,
+    get_range_store_bounds,
+    _strip_type_mod,
+    get_range_index_columns,
+    range_index_aggregates,
+)
+from splitgraph.core.indexing.set import (
+    generate_set_index,
+    filter_set_index,
+    filter_set_index_in_memory,
+    get_set_index_columns,
+    set_index_aggregates,
+)
+from splitgraph.core.indexing.trigram import (
+    generate_trigram_index,
+    filter_trigram_index,
+    filter_trigram_index_in_memory,
+    get_trigram_index_columns,
+    trigram_index_aggregate,
 )
 from splitgraph.core.metadata_manager import MetadataManager, Object
 from splitgraph.core.types import Changeset, TableSchema, Comparable
 from splitgraph.engine import ResultShape
-from splitgraph.engine.postgres.engine import SG_UD_FLAG, add_ud_flag_column, get_change_key
+from splitgraph.engine.postgres.engine import (
+    SG_UD_FLAG,
+    add_ud_flag_column,
+    get_change_key,
+    select_changed_keys,
+    select_old_rows,
+)
 from splitgraph.exceptions import SplitGraphError
 from .common import adapt, SPLITGRAPH_META_SCHEMA, get_temporary_table_id
 from .sql import select
 
+try:
+    import numpy as np
+
+    _NUMPY_AVAILABLE = True
+except ImportError:
+    _NUMPY_AVAILABLE = False
+
 if TYPE_CHECKING:
     from splitgraph.core.repository import Repository
     from splitgraph.core.table import Table
     from splitgraph.engine.postgres.engine import PostgresEngine
 
+T = TypeVar("T")
+
+# Index types that can be passed in extra_indexes apart from "range"
+_EXTRA_INDEX_TYPES = ("bloom", "set", "trigram")
+
 
 def _split_changeset(
     changeset: Changeset, min_max: List[Tuple[Any, Any]], table_pks: List[Tuple[str, str]]
@@ -180,6 +237,30 @@ class Digest:
         assert len(hex_string) == 64
         return cls(tuple(int(hex_string[i : i + 4], base=16) for i in range(0, 64, 4)))
 
+    @classmethod
+    def sum_memoryviews(cls, memories: Sequence[Union[bytes, memoryview]]) -> "Digest":
+        """
+        Sum up a batch of 256-bit digests. This gives the same result as adding up
+        `Digest.from_memoryview` of every item but doesn't create a Digest object per item.
+
+        If NumPy is available, the digests are treated as an (n, 16) array of big-endian
+        unsigned shorts and summed up column-wise. Otherwise, all shorts are unpacked in one go
+        and summed up lane by lane.
+        """
+        if not memories:
+            return cls.empty()
+        buffer = b"".join(memories)
+        if len(buffer) != 32 * len(memories):
+            raise ValueError("All digests must be 256 bits long!")
+
+        if _NUMPY_AVAILABLE:
+            lanes = np.frombuffer(buffer, dtype=">u2").reshape(-1, 16)
+            # Accumulate in uint64 (can't overflow unless we have 2^48 rows) and wrap at the end.
+            return cls(tuple(int(v) & 0xFFFF for v in lanes.sum(axis=0, dtype=np.uint64)))
+
+        shorts = struct.unpack(">%dH" % (len(memories) * 16), buffer)
+        return cls(tuple(sum(shorts[i::16]) & 0xFFFF for i in range(16)))
+
     # In these routines, we treat each hash as a vector of 16 2-byte integers and do component-wise addition.
     # To simulate the wraparound behaviour of C shorts, throw away all remaining bits after the action.
     def __add__(self, other: "Digest") -> "Digest":
@@ -196,6 +277,76 @@ class Digest:
         return struct.pack(">16H", *self.shorts).hex()
 
 
+def _lthash_aggregate_query(
+    digest_query: Union[SQL, Composed], extra_aggregates: Optional[List[Composed]] = None
+) -> Composed:
+    """
+    Wrap a query returning one SHA-256 digest per row into a query that folds the digests
+    on the engine and returns the row count and the 16 per-lane sums of the LtHash.
+
+    Each digest is treated as 16 big-endian 2-byte lanes (same as `Digest`). Postgres sums every
+    lane separately in a bigint and the client only has to throw away everything apart from the
+    bottom 16 bits of each sum to get the wraparound behaviour of `Digest.__add__`.
+
+    :param digest_query: Query returning the digest as the first column. The rest of its columns
+        can be referenced by name in `extra_aggregates`.
+    :param extra_aggregates: Other aggregates to compute in the same scan, returned after the sums.
+    """
+    lanes = SQL(",").join(
+        SQL("SUM((get_byte(sg_digest, %d) << 8) | get_byte(sg_digest, %d))" % (i * 2, i * 2 + 1))
+        for i in range(16)
+    )
+    query = SQL("SELECT COUNT(1), ") + lanes
+    if extra_aggregates:
+        query += SQL(",") + SQL(",").join(extra_aggregates)
+    return query + SQL(" FROM (") + digest_query + SQL(") h(sg_digest)")
+
+
+def _lthash_from_aggregate(result: Sequence[Any]) -> Tuple[Digest, int]:
+    """Turn the result of the query generated by `_lthash_aggregate_query` into a Digest and a row count."""
+    row_count = result[0]
+    if not row_count:
+        return Digest.empty(), 0
+    return Digest(tuple(int(s) & 0xFFFF for s in result[1:17])), row_count
+
+
+"""Range of PK values a table chunk spans: (PK columns, exclusive lower bound, inclusive upper bound).
+A bound of None means the range is unbounded from that side."""
+PKRange = Tuple[List[str], Optional[Tuple], Optional[Tuple]]
+
+
+def _get_chunk_filter(
+    chunk_id_col: Optional[str] = None,
+    chunk_id: Optional[int] = None,
+    pk_range: Optional[PKRange] = None,
+) -> Tuple[Composed, List[Any]]:
+    """
+    Build a WHERE clause that only selects rows from a given table chunk, either by the
+    value of the chunk ID column or by a range of primary key values.
+
+    :return: WHERE clause (empty if the whole table is selected) and arguments to be mogrified into it.
+    """
+    if chunk_id_col:
+        return SQL(" WHERE {} = %s").format(Identifier(chunk_id_col)), [chunk_id]
+
+    if not pk_range:
+        return Composed([]), []
+
+    pk_cols, lower, upper = pk_range
+    pk_sql = SQL("(") + SQL(",").join(Identifier(p) for p in pk_cols) + SQL(")")
+    clauses = []
+    args: List[Any] = []
+    if lower is not None:
+        clauses.append(pk_sql + SQL(" > (" + ",".join(itertools.repeat("%s", len(lower))) + ")"))
+        args.extend(lower)
+    if upper is not None:
+        clauses.append(pk_sql + SQL(" <= (" + ",".join(itertools.repeat("%s", len(upper))) + ")"))
+        args.extend(upper)
+    if not clauses:
+        return Composed([]), []
+    return SQL(" WHERE ") + SQL(" AND ").join(clauses), args
+
+
 """Dictionary of {index_type: [column: index_specific_kwargs or list of columns]}."""
 ExtraIndexInfo = Dict[str, Union[List[str], Dict[str, Dict[str, Any]]]]
 
@@ -220,12 +371,238 @@ class FragmentManager(MetadataManager):
         super().__init__(metadata_engine)
         self.object_engine = object_engine
 
+        # Whether to sum up row digests on the engine rather than fetching them (gets
+        # flipped off if the engine doesn't support that).
+        self.server_side_hashing = True
+
+        # Objects and tables registered while tables are being stored in parallel: these are
+        # only written to the metadata engine once all tables have been stored
+        # (see `record_tables_parallel`).
+        self._deferred_objects: Optional[List[Object]] = None
+        self._deferred_tables: Optional[
+            List[Tuple["Repository", List[Tuple[str, str, TableSchema, List[str]]]]]
+        ] = None
+
+        # Maximum number of connections that a single table can use to store its chunks while
+        # tables are being stored in parallel, so that the table and the chunk workers share
+        # the engine's connection pool.
+        self._chunk_worker_limit: Optional[int] = None
+
+    def register_objects(self, objects: List[Object], namespace: Optional[str] = None) -> None:
+        if self._deferred_objects is None:
+            super().register_objects(objects, namespace)
+            return
+        self._deferred_objects.extend(
+            o._replace(namespace=namespace) if namespace else o for o in objects
+        )
+
+    def register_tables(
+        self, repository: "Repository", table_meta: List[Tuple[str, str, TableSchema, List[str]]]
+    ) -> None:
+        if self._deferred_tables is None:
+            super().register_tables(repository, table_meta)
+            return
+        self._deferred_tables.append((repository, table_meta))
+
+    @contextmanager
+    def _deferred_registration(self) -> Iterator[None]:
+        self._deferred_objects = []
+        self._deferred_tables = []
+        try:
+            yield
+            objects, tables = self._deferred_objects, self._deferred_tables
+        finally:
+            self._deferred_objects = None
+            self._deferred_tables = None
+
+        # Different tables can produce the same object, which could also already exist.
+        unique_objects = {o.object_id: o for o in objects}
+        if unique_objects:
+            new_objects = set(self.get_new_objects(list(unique_objects.keys())))
+            super().register_objects(
+                [o for object_id, o in unique_objects.items() if object_id in new_objects]
+            )
+        for repository, table_meta in tables:
+            super().register_tables(repository, table_meta)
+
+    def _run_in_worker(self, func: Callable[..., T], *args: Any) -> T:
+        """Run a function in a worker thread, committing or rolling back its connections."""
+        engines = {self.object_engine, self.metadata_engine}
+        try:
+            result = func(*args)
+            for engine in engines:
+                engine.commit()
+            return result
+        except Exception:
+            for engine in engines:
+                engine.rollback()
+            raise
+
+    def record_tables_parallel(self, tasks: List[Callable[[], Any]], workers: int) -> None:
+        """
+        Run multiple functions that store and register tables (`record_table_as_base` and
+        `record_table_as_patch`), each one using a separate connection to the engine.
+
+        Objects are stored and committed by the workers as they go, but the objects and the tables
+        are only registered in the metadata engine (in the caller's transaction) after all tables
+        have been stored, so that an image doesn't become visible with only some of its tables.
+        Pending changes aren't discarded by the workers: the caller has to do it at the end.
+
+        Every table worker can in turn store the table's chunks in parallel (see `_chunk_table`),
+        in which case the connections are split between the two levels: with N table workers,
+        each one can only use 1/N of the engine's connection pool for its chunks.
+
+        :param tasks: List of functions to run
+        :param workers: Number of workers
+        """
+        pool_size = int(get_singleton(CONFIG, "SG_ENGINE_POOL")) - 1
+        workers = max(1, min(workers, pool_size))
+        logging.info("Storing %d tables using %d workers", len(tasks), workers)
+        self._chunk_worker_limit = max(1, pool_size // workers)
+        try:
+            with self._deferred_registration():
+                with ThreadPoolExecutor(max_workers=workers) as tpe:
+                    futures = [tpe.submit(self._run_in_worker, task) for task in tasks]
+                    for future in futures:
+                        future.result()
+        finally:
+            self._chunk_worker_limit = None
+
+    def _sum_digests(
+        self, digest_query: Union[SQL, Composed], args: Optional[Sequence[Any]] = None
+    ) -> Tuple[Digest, int]:
+        """
+        Calculate the homomorphic hash of all rows returned by a digest query.
+
+        By default, the digests are summed up on the engine (see `_lthash_aggregate_query`) so that
+        only the final hash and the number of rows gets sent back to the client. If the engine
+        can't run the aggregation, this falls back to fetching every row digest and folding them
+        on the client.
+
+        :param digest_query: Query returning a single column with the SHA-256 digest of every row.
+        :param args: Arguments to be mogrified into the query.
+        :return: `Digest` object and the number of rows that were hashed.
+        """
+        content_hash, rows, _ = self._aggregate_digests(digest_query, args)
+        return content_hash, rows
+
+    def _aggregate_digests(
+        self,
+        digest_query: Union[SQL, Composed],
+        args: Optional[Sequence[Any]] = None,
+        extra_aggregates: Optional[List[Composed]] = None,
+    ) -> Tuple[Digest, int, Optional[Sequence[Any]]]:
+        """
+        Same as `_sum_digests`, but also computes other aggregates on the rows in the same scan.
+
+        :param digest_query: Query returning the SHA-256 digest of every row as its first column
+            and any other columns used by `extra_aggregates`.
+        :param args: Arguments to be mogrified into the query.
+        :param extra_aggregates: List of aggregate expressions.
+        :return: `Digest` object, the number of rows that were hashed and the values of
+            `extra_aggregates` (None if the hashing fell back to the client, in which case
+            the aggregates aren't computed).
+        """
+        if self.server_side_hashing:
+            try:
+                with self.object_engine.savepoint("lthash_aggregate"):
+                    result = self.object_engine.run_sql(
+                        _lthash_aggregate_query(digest_query, extra_aggregates),
+                        args,
+                        return_shape=ResultShape.ONE_MANY,
+                    )
+                content_hash, rows = _lthash_from_aggregate(result)
+                return content_hash, rows, result[17:]
+            except UndefinedFunction:
+                logging.warning(
+                    "Engine %s can't aggregate LtHash digests, falling back to client-side hashing",
+                    self.object_engine.name,
+                )
+                self.server_side_hashing = False
+
+        if extra_aggregates:
+            # Only fetch the digests from the query.
+            digest_query = SQL("SELECT sg_digest FROM (") + digest_query + SQL(") h(sg_digest)")
+        row_digests = self.object_engine.run_sql(
+            digest_query, args, return_shape=ResultShape.MANY_ONE
+        )
+        return Digest.sum_memoryviews(row_digests), len(row_digests), None
+
+    @staticmethod
+    def _get_index_columns(
+        extra_indexes: Optional[ExtraIndexInfo],
+    ) -> Tuple[Optional[List[str]], Dict[str, Dict[str, Dict[str, Any]]]]:
+        """
+        Validate the extra index options and return the columns to run the range index on
+        (None for all columns) and the options of other indexes that were asked for
+        ({index_type: column: index_specific_kwargs}).
+        """
+        extra_indexes = extra_indexes or {}
+
+        range_index_columns: Optional[List[str]]
+        try:
+            range_index_columns = list(extra_indexes["range"])
+        except KeyError:
+            range_index_columns = None
+
+        other_index_columns: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        for index_name, index_cols in extra_indexes.items():
+            if index_name == "range":
+                continue
+            if index_name not in _EXTRA_INDEX_TYPES:
+                raise ValueError("Unsupported index type %s!" % index_name)
+            if isinstance(index_cols, list):
+                if index_name == "bloom":
+                    raise ValueError(
+                        "Unexpected options for index 'bloom': "
+                        "got list, expected dictionary {column: {probability/size: ...}}!"
+                    )
+                # Allow a list of columns to use the default options.
+                index_cols = {c: {} for c in index_cols}
+            other_index_columns[index_name] = index_cols
+        return range_index_columns, other_index_columns
+
+    @staticmethod
+    def _get_other_index_aggregates(
+        table_schema: TableSchema,
+        other_index_columns: Dict[str, Dict[str, Dict[str, Any]]],
+        condition: Optional[Composable] = None,
+    ) -> List[Composed]:
+        """
+        Get the aggregates that the bloom, set and trigram indexes are built from
+        (in this order), optionally only computed on rows matching a condition.
+        """
+        result: List[Composed] = []
+        for c, o in other_index_columns.get("bloom", {}).items():
+            aggregate = bloom_digest_aggregate(c, o.get("hash_function", "sha256"))
+            if condition:
+                aggregate += SQL(" FILTER (WHERE ") + condition + SQL(")")
+            result.append(aggregate)
+        for c, o in get_set_index_columns(table_schema, other_index_columns.get("set", {})).items():
+            result.extend(set_index_aggregates(c, o, condition))
+        for c in get_trigram_index_columns(table_schema, other_index_columns.get("trigram", {})):
+            result.append(trigram_index_aggregate(c, condition))
+        return result
+
+    def _get_index_aggregates(
+        self, table_schema: TableSchema, extra_indexes: Optional[ExtraIndexInfo] = None
+    ) -> List[Composed]:
+        """
+        Get the aggregates that the object index is built from, to be computed in the same
+        scan as the object's content hash. Their values can be passed to `generate_object_index`.
+        """
+        range_index_columns, other_index_columns = self._get_index_columns(extra_indexes)
+        return range_index_aggregates(
+            table_schema, range_index_columns
+        ) + self._get_other_index_aggregates(table_schema, other_index_columns)
+
     def generate_object_index(
         self,
         object_id: str,
         table_schema: TableSchema,
         changeset: Optional[Changeset] = None,
         extra_indexes: Optional[ExtraIndexInfo] = None,
+        index_aggregates: Optional[Sequence[Any]] = None,
     ) -> Dict[str, Any]:
         """
         Queries the max/min values of a given fragment for each column, used to speed up querying.
@@ -234,48 +611,139 @@ class FragmentManager(MetadataManager):
         :param table_schema: Schema of the table the object belongs to.
         :param changeset: Optional, if specified, the old row values are included in the index.
         :param extra_indexes: Dictionary of {index_type: column: index_specific_kwargs}.
+        :param index_aggregates: Values of the aggregates from `_get_index_aggregates`, if they
+            have already been computed on the object's rows. If not passed, the object is queried.
         :return: Dict containing the object index.
         """
-        extra_indexes: ExtraIndexInfo = extra_indexes or {}
+        range_index_columns, other_index_columns = self._get_index_columns(extra_indexes)
+        bloom_index_columns = other_index_columns.get("bloom")
+        set_index_columns = other_index_columns.get("set")
+        if set_index_columns is not None:
+            set_index_columns = get_set_index_columns(table_schema, set_index_columns)
+        trigram_index_columns = other_index_columns.get("trigram")
+        if trigram_index_columns is not None:
+            trigram_index_columns = get_trigram_index_columns(table_schema, trigram_index_columns)
+
+        min_max: Optional[Sequence[Any]] = None
+        bloom_digests: Optional[Sequence[Any]] = None
+        set_aggregates: Optional[Sequence[Any]] = None
+        trigram_values: Optional[Sequence[Any]] = None
+        if index_aggregates is not None:
+            range_index_size = 2 * len(get_range_index_columns(table_schema, range_index_columns))
+            bloom_index_end = range_index_size + len(bloom_index_columns or {})
+            set_index_end = bloom_index_end + 2 * len(set_index_columns or {})
+            min_max = index_aggregates[:range_index_size]
+            bloom_digests = index_aggregates[range_index_size:bloom_index_end]
+            set_aggregates = index_aggregates[bloom_index_end:set_index_end]
+            trigram_values = index_aggregates[set_index_end:]
 
-        # Default None, meaning run range index on all columns.
-        range_index_columns: Optional[List[str]]
-        try:
-            range_index_columns = list(extra_indexes["range"])
-        except KeyError:
-            range_index_columns = None
         range_index: Dict[str, Any] = generate_range_index(
-            self.object_engine, object_id, table_schema, changeset, columns=range_index_columns
+            self.object_engine,
+            object_id,
+            table_schema,
+            changeset,
+            columns=range_index_columns,
+            min_max=min_max,
         )
         indexes = {"range": range_index}
 
         # Process extra indexes
-        for index_name, index_cols in extra_indexes.items():
-            if index_name == "range":
-                continue
-            if index_name != "bloom":
-                raise ValueError("Unsupported index type %s!" % index_name)
-            if isinstance(index_cols, list):
-                raise ValueError(
-                    "Unexpected options for index 'bloom': "
-                    "got list, expected dictionary {column: {probability/size: ...}}!"
+        if bloom_index_columns is not None:
+            index_dict = {}
+            for i, (index_col, index_kwargs) in enumerate(bloom_index_columns.items()):
+                logging.debug(
+                    "Running index bloom on column %s with parameters %r", index_col, index_kwargs
                 )
+                index_dict[index_col] = generate_bloom_index(
+                    self.object_engine,
+                    object_id,
+                    changeset,
+                    index_col,
+                    digests=(bloom_digests[i] or []) if bloom_digests is not None else None,
+                    **index_kwargs
+                )
+            indexes["bloom"] = index_dict
 
-            index_dict = {}
-            for index_col, index_kwargs in index_cols.items():
+        if set_index_columns is not None:
+            set_index_dict = {}
+            for i, (index_col, index_kwargs) in enumerate(set_index_columns.items()):
+                logging.debug(
+                    "Running index set on column %s with parameters %r", index_col, index_kwargs
+                )
+                index_type, index_data = generate_set_index(
+                    self.object_engine,
+                    object_id,
+                    changeset,
+                    index_col,
+                    values=set_aggregates[2 * i] if set_aggregates is not None else None,
+                    digests=(
+                        (set_aggregates[2 * i + 1] or []) if set_aggregates is not None else None
+                    ),
+                    **index_kwargs
+                )
+                if index_type == "set":
+                    set_index_dict[index_col] = index_data
+                elif index_col not in indexes.get("bloom", {}):
+                    # Too many distinct values: fall back to the bloom filter (unless the
+                    # column already has one).
+                    indexes.setdefault("bloom", {})[index_col] = index_data
+            indexes["set"] = set_index_dict
+
+        if trigram_index_columns is not None:
+            trigram_index_dict = {}
+            for i, (index_col, index_kwargs) in enumerate(trigram_index_columns.items()):
                 logging.debug(
-                    "Running index %s on column %s with parameters %r",
-                    index_name,
+                    "Running index trigram on column %s with parameters %r",
                     index_col,
                     index_kwargs,
                 )
-                index_dict[index_col] = generate_bloom_index(
-                    self.object_engine, object_id, changeset, index_col, **index_kwargs
+                trigram_index_dict[index_col] = generate_trigram_index(
+                    self.object_engine,
+                    object_id,
+                    changeset,
+                    index_col,
+                    values=(trigram_values[i] or []) if trigram_values is not None else None,
+                    **index_kwargs
                 )
-            indexes[index_name] = index_dict
+            indexes["trigram"] = trigram_index_dict
 
         return indexes
 
+    def _make_object(
+        self,
+        object_id: str,
+        namespace: str,
+        insertion_hash: str,
+        deletion_hash: str,
+        table_schema: TableSchema,
+        rows_inserted: int,
+        rows_deleted: int,
+        changeset: Optional[Changeset] = None,
+        extra_indexes: Optional[ExtraIndexInfo] = None,
+        index_aggregates: Optional[Sequence[Any]] = None,
+    ) -> Object:
+        """
+        Indexes a stored Splitgraph object and returns its metadata (without registering it).
+        See `_register_object` for the description of the parameters and `generate_object_index`
+        for `index_aggregates`.
+        """
+        object_size = self.object_engine.get_object_size(object_id)
+        object_index = self.generate_object_index(
+            object_id, table_schema, changeset, extra_indexes, index_aggregates
+        )
+        return Object(
+            object_id=object_id,
+            format="FRAG",
+            namespace=namespace,
+            size=object_size,
+            created=datetime.utcnow(),
+            insertion_hash=insertion_hash,
+            deletion_hash=deletion_hash,
+            object_index=object_index,
+            rows_inserted=rows_inserted,
+            rows_deleted=rows_deleted,
+        )
+
     def _register_object(
         self,
         object_id: str,
@@ -287,6 +755,7 @@ class FragmentManager(MetadataManager):
         rows_deleted: int,
         changeset: Optional[Changeset] = None,
         extra_indexes: Optional[ExtraIndexInfo] = None,
+        index_aggregates: Optional[Sequence[Any]] = None,
     ) -> None:
         """
         Registers a Splitgraph object in the object tree and indexes it
@@ -303,22 +772,21 @@ class FragmentManager(MetadataManager):
             are used to generate the min/max index for an object to know if it removes/updates some rows
             that might be pertinent to a query.
         :param extra_indexes: Dictionary of {index_type: column: index_specific_kwargs}.
+        :param index_aggregates: See `generate_object_index`.
         """
-        object_size = self.object_engine.get_object_size(object_id)
-        object_index = self.generate_object_index(object_id, table_schema, changeset, extra_indexes)
         self.register_objects(
             [
-                Object(
-                    object_id=object_id,
-                    format="FRAG",
-                    namespace=namespace,
-                    size=object_size,
-                    created=datetime.utcnow(),
-                    insertion_hash=insertion_hash,
-                    deletion_hash=deletion_hash,
-                    object_index=object_index,
-                    rows_inserted=rows_inserted,
-                    rows_deleted=rows_deleted,
+                self._make_object(
+                    object_id,
+                    namespace,
+                    insertion_hash,
+                    deletion_hash,
+                    table_schema,
+                    rows_inserted,
+                    rows_deleted,
+                    changeset,
+                    extra_indexes,
+                    index_aggregates,
                 )
             ]
         )
@@ -372,15 +840,8 @@ class FragmentManager(MetadataManager):
 
         # By default (e.g. for changesets where nothing was deleted) we use a 0 hash (since adding it to any other
         # hash has no effect).
-        digests = self.object_engine.run_sql(
-            query,
-            [o if not isinstance(o, dict) else Json(o) for row in rows for o in row],
-            return_shape=ResultShape.MANY_ONE,
-        )
-        return (
-            reduce(operator.add, map(Digest.from_memoryview, digests), Digest.empty()),
-            len(digests),
-        )
+        args = [o if not isinstance(o, dict) else Json(o) for row in rows for o in row]
+        return self._sum_digests(SQL(query), args)
 
     def _store_changesets(
         self,
@@ -426,65 +887,202 @@ class FragmentManager(MetadataManager):
             ) = self._get_patch_fragment_hashes_stats(sub_changeset, table, tmp_object_id)
 
             object_ids.append(object_id)
+            self._store_patch_fragment(
+                table,
+                tmp_object_id,
+                object_id,
+                insertion_hash,
+                deletion_hash,
+                rows_inserted,
+                rows_deleted,
+                changeset=sub_changeset,
+                extra_indexes=extra_indexes,
+                in_fragment_order=in_fragment_order,
+                overwrite=overwrite,
+            )
 
-            # Wrap this rename in a SAVEPOINT so that if the table already exists,
-            # the error doesn't roll back the whole transaction (us creating and registering all other objects).
-            with self.object_engine.savepoint("object_rename"):
-                source_query = SQL("SELECT * FROM {}.{}").format(
-                    Identifier("pg_temp"), Identifier(tmp_object_id)
-                )
+        return object_ids
 
-                if in_fragment_order:
-                    source_query += SQL(" ") + self._get_order_by_clause(
-                        in_fragment_order, table.table_schema
-                    )
+    def _store_changes_table(
+        self,
+        table: "Table",
+        changes_table: str,
+        schema: str,
+        extra_indexes: Optional[ExtraIndexInfo] = None,
+        in_fragment_order: Optional[List[str]] = None,
+        overwrite: bool = False,
+    ) -> str:
+        """
+        Store and register changes conflated on the engine (see
+        `PsycopgEngine.conflate_pending_changes`) as a fragment without loading them into memory.
 
-                try:
-                    self.object_engine.store_object(
-                        object_id=object_id,
-                        source_query=source_query,
-                        schema_spec=add_ud_flag_column(table.table_schema),
-                        overwrite=overwrite,
-                    )
-                except UniqueViolation:
-                    # Someone registered this object (perhaps a concurrent pull) already.
-                    logging.info(
-                        "Object %s for table %s/%s already exists, continuing...",
-                        object_id,
-                        table.repository,
-                        table.table_name,
-                    )
-                self.object_engine.delete_table("pg_temp", tmp_object_id)
-                # There are some cases where an object can already exist in the object engine (in the cache)
-                # but has been deleted from the metadata engine, so when it's recreated, we'll skip
-                # actually registering it. Hence, we still want to proceed trying to register
-                # it no matter what.
-
-            # Same here: if we are being called as part of a commit and an object
-            # already exists, we'll roll back everything that the caller has done
-            # (e.g. registering the new image) if we don't have a savepoint.
-            with self.metadata_engine.savepoint("object_register"):
-                try:
-                    self._register_object(
-                        object_id,
-                        namespace=table.repository.namespace,
-                        insertion_hash=insertion_hash.hex(),
-                        deletion_hash=deletion_hash.hex(),
-                        table_schema=table.table_schema,
-                        changeset=sub_changeset,
-                        extra_indexes=extra_indexes,
-                        rows_inserted=rows_inserted,
-                        rows_deleted=rows_deleted,
-                    )
-                except UniqueViolation:
-                    logging.info(
-                        "Object %s for table %s/%s already exists, continuing...",
-                        object_id,
-                        table.repository,
-                        table.table_name,
-                    )
+        :param table: Table object the changes belong to
+        :param changes_table: Temporary table with the conflated changes
+        :param schema: Schema the table is checked out into.
+        :param extra_indexes: Dictionary of {index_type: column: index_specific_kwargs}.
+        :param overwrite: Overwrite object if already exists.
+        :return: Created object ID.
+        """
+        logging.info("Storing and indexing table %s", table.table_name)
+        tmp_object_id = get_temporary_table_id()
+        self.object_engine.store_fragment(
+            select_changed_keys(changes_table, table.table_schema, upserted=True),
+            select_changed_keys(changes_table, table.table_schema, upserted=False),
+            "pg_temp",
+            tmp_object_id,
+            schema,
+            table.table_name,
+            table.table_schema,
+        )
 
-        return object_ids
+        # Hash the old values of deleted/updated rows on the engine too, see
+        # _hash_old_changeset_values for the client-side version.
+        old_rows = select_old_rows(changes_table, table.table_schema)
+        deletion_hash, rows_deleted = self._sum_digests(
+            SQL("SELECT digest(o::text, 'sha256') FROM (") + old_rows + SQL(") o")
+        )
+        insertion_hash, rows_inserted = self.calculate_fragment_insertion_hash_stats(
+            "pg_temp", tmp_object_id, table.table_schema
+        )
+        object_id = self._get_patch_object_id(insertion_hash, deletion_hash, table.table_schema)
+
+        self._store_patch_fragment(
+            table,
+            tmp_object_id,
+            object_id,
+            insertion_hash,
+            deletion_hash,
+            rows_inserted,
+            rows_deleted,
+            extra_indexes=extra_indexes,
+            in_fragment_order=in_fragment_order,
+            overwrite=overwrite,
+            index_aggregates=self._get_patch_index_aggregates(
+                tmp_object_id, old_rows, table.table_schema, extra_indexes
+            ),
+        )
+        return object_id
+
+    def _get_patch_index_aggregates(
+        self,
+        tmp_object_id: str,
+        old_rows: Composed,
+        table_schema: TableSchema,
+        extra_indexes: Optional[ExtraIndexInfo] = None,
+    ) -> Sequence[Any]:
+        """
+        Compute the aggregates that the index of a patch fragment is built from (see
+        `_get_index_aggregates`) over the fragment and the old values of the rows it changes
+        (see `generate_range_index` for why the index has to include them).
+
+        :param tmp_object_id: Temporary table the fragment is stored in
+        :param old_rows: Query returning the old values of updated and deleted rows.
+        :param table_schema: Schema of the table
+        :param extra_indexes: Dictionary of {index_type: column: index_specific_kwargs}.
+        :return: Values to be passed to `generate_object_index`.
+        """
+        range_index_columns, other_index_columns = self._get_index_columns(extra_indexes)
+        # The bloom, set and trigram indexes don't include the deleted rows in the fragment
+        # itself (they're all NULLs apart from the PK) but do include the old values.
+        aggregates = range_index_aggregates(
+            table_schema, range_index_columns
+        ) + self._get_other_index_aggregates(
+            table_schema, other_index_columns, Identifier(SG_UD_FLAG)
+        )
+        columns = SQL(",").join(Identifier(c.name) for c in table_schema)
+        query = (
+            SQL("SELECT ")
+            + SQL(",").join(aggregates)
+            + SQL(" FROM (SELECT ")
+            + columns
+            + SQL(", {} FROM pg_temp.{} UNION ALL SELECT ").format(
+                Identifier(SG_UD_FLAG), Identifier(tmp_object_id)
+            )
+            + columns
+            + SQL(", true FROM (")
+            + old_rows
+            + SQL(") r) o")
+        )
+        return cast(
+            Sequence[Any], self.object_engine.run_sql(query, return_shape=ResultShape.ONE_MANY)
+        )
+
+    def _store_patch_fragment(
+        self,
+        table: "Table",
+        tmp_object_id: str,
+        object_id: str,
+        insertion_hash: Digest,
+        deletion_hash: Digest,
+        rows_inserted: int,
+        rows_deleted: int,
+        changeset: Optional[Changeset] = None,
+        extra_indexes: Optional[ExtraIndexInfo] = None,
+        in_fragment_order: Optional[List[str]] = None,
+        overwrite: bool = False,
+        index_aggregates: Optional[Sequence[Any]] = None,
+    ) -> None:
+        """
+        Move a patch fragment from its temporary table into the object storage and register it.
+        See `_register_object` for the description of the parameters.
+        """
+        # Wrap this rename in a SAVEPOINT so that if the table already exists,
+        # the error doesn't roll back the whole transaction (us creating and registering all other objects).
+        with self.object_engine.savepoint("object_rename"):
+            source_query = SQL("SELECT * FROM {}.{}").format(
+                Identifier("pg_temp"), Identifier(tmp_object_id)
+            )
+
+            if in_fragment_order:
+                source_query += SQL(" ") + self._get_order_by_clause(
+                    in_fragment_order, table.table_schema
+                )
+
+            try:
+                self.object_engine.store_object(
+                    object_id=object_id,
+                    source_query=source_query,
+                    schema_spec=add_ud_flag_column(table.table_schema),
+                    overwrite=overwrite,
+                )
+            except UniqueViolation:
+                # Someone registered this object (perhaps a concurrent pull) already.
+                logging.info(
+                    "Object %s for table %s/%s already exists, continuing...",
+                    object_id,
+                    table.repository,
+                    table.table_name,
+                )
+            self.object_engine.delete_table("pg_temp", tmp_object_id)
+            # There are some cases where an object can already exist in the object engine (in the cache)
+            # but has been deleted from the metadata engine, so when it's recreated, we'll skip
+            # actually registering it. Hence, we still want to proceed trying to register
+            # it no matter what.
+
+        # Same here: if we are being called as part of a commit and an object
+        # already exists, we'll roll back everything that the caller has done
+        # (e.g. registering the new image) if we don't have a savepoint.
+        with self.metadata_engine.savepoint("object_register"):
+            try:
+                self._register_object(
+                    object_id,
+                    namespace=table.repository.namespace,
+                    insertion_hash=insertion_hash.hex(),
+                    deletion_hash=deletion_hash.hex(),
+                    table_schema=table.table_schema,
+                    changeset=changeset,
+                    extra_indexes=extra_indexes,
+                    rows_inserted=rows_inserted,
+                    rows_deleted=rows_deleted,
+                    index_aggregates=index_aggregates,
+                )
+            except UniqueViolation:
+                logging.info(
+                    "Object %s for table %s/%s already exists, continuing...",
+                    object_id,
+                    table.repository,
+                    table.table_name,
+                )
 
     def _get_patch_fragment_hashes_stats(
         self, sub_changeset: Any, table: "Table", tmp_object_id: str
@@ -496,11 +1094,16 @@ class FragmentManager(MetadataManager):
         insertion_hash, rows_inserted = self.calculate_fragment_insertion_hash_stats(
             "pg_temp", tmp_object_id, table.table_schema
         )
-        content_hash = (insertion_hash - deletion_hash).hex()
-        schema_hash = self._calculate_schema_hash(table.table_schema)
-        object_id = "o" + sha256((content_hash + schema_hash).encode("ascii")).hexdigest()[:-2]
+        object_id = self._get_patch_object_id(insertion_hash, deletion_hash, table.table_schema)
         return deletion_hash, insertion_hash, object_id, rows_inserted, rows_deleted
 
+    def _get_patch_object_id(
+        self, insertion_hash: Digest, deletion_hash: Digest, table_schema: TableSchema
+    ) -> str:
+        content_hash = (insertion_hash - deletion_hash).hex()
+        schema_hash = self._calculate_schema_hash(table_schema)
+        return "o" + sha256((content_hash + schema_hash).encode("ascii")).hexdigest()[:-2]
+
     def _store_changeset(
         self, sub_changeset: Any, table: str, schema: str, table_schema: TableSchema
     ) -> str:
@@ -508,7 +1111,13 @@ class FragmentManager(MetadataManager):
         upserted = [pk for pk, data in sub_changeset.items() if data[0]]
         deleted = [pk for pk, data in sub_changeset.items() if not data[0]]
         self.object_engine.store_fragment(
-            upserted, deleted, "pg_temp", tmp_object_id, schema, table, table_schema,
+            upserted,
+            deleted,
+            "pg_temp",
+            tmp_object_id,
+            schema,
+            table,
+            table_schema,
         )
         return tmp_object_id
 
@@ -533,11 +1142,7 @@ class FragmentManager(MetadataManager):
             )
             + SQL(" WHERE o.{} = true").format(Identifier(SG_UD_FLAG))
         )
-        row_digests = self.object_engine.run_sql(digest_query, return_shape=ResultShape.MANY_ONE)
-        insertion_hash = reduce(
-            operator.add, (Digest.from_memoryview(r) for r in row_digests), Digest.empty()
-        )
-        return insertion_hash, len(row_digests)
+        return self._sum_digests(digest_query)
 
     def record_table_as_patch(
         self,
@@ -568,25 +1173,28 @@ class FragmentManager(MetadataManager):
         # this will help (for a query pk=5000 we don't need to fetch a 2000-row fragment) but maybe at that point
         # it's time to rewrite the table altogether?
 
-        # Accumulate the diff in-memory. This might become a bottleneck in the future.
-        changeset: Changeset = {}
-        _conflate_changes(
-            changeset,
-            cast(
-                List[Tuple[Tuple[str, ...], bool, Dict[str, Any], Dict[str, Any]]],
-                self.object_engine.get_pending_changes(schema, old_table.table_name),
-            ),
+        # Conflate the diff on the engine rather than loading the whole audit log into memory.
+        changes_table = get_temporary_table_id()
+        changed_rows = self.object_engine.conflate_pending_changes(
+            schema, old_table.table_name, changes_table
         )
-        self.object_engine.discard_pending_changes(schema, old_table.table_name)
+        if self._deferred_tables is None:
+            # When storing tables in parallel, the caller discards the changes to all tables
+            # in its own transaction, so that they're kept if the commit fails.
+            self.object_engine.discard_pending_changes(schema, old_table.table_name)
         current_objects = old_table.objects
 
         new_schema_spec = new_schema_spec or old_table.table_schema
-        if changeset:
+        if changed_rows:
             if split_changeset:
                 logging.debug("Splitting changesets")
                 # Reorganize the current table's fragments into non-overlapping groups
                 # and split the changeset to make sure it doesn't span (and hence merge) them.
+                # This needs the (conflated) changeset in memory.
                 table_pks = self.object_engine.get_change_key(schema, old_table.table_name)
+                changeset = self.object_engine.get_conflated_changes(
+                    changes_table, [p for p, _ in table_pks]
+                )
                 min_max = self.get_min_max_pks(current_objects, table_pks)
 
                 groups = get_chunk_groups(
@@ -598,19 +1206,27 @@ class FragmentManager(MetadataManager):
                 ]
 
                 matched, before, after = _split_changeset(changeset, group_boundaries, table_pks)
-                changesets = [before] + matched + [after]
-            else:
-                changesets = [changeset]
 
-            # Store the changesets and find out their object IDs.
-            object_ids = self._store_changesets(
-                old_table,
-                changesets,
-                schema,
-                extra_indexes,
-                in_fragment_order=in_fragment_order,
-                overwrite=overwrite,
-            )
+                # Store the changesets and find out their object IDs.
+                object_ids = self._store_changesets(
+                    old_table,
+                    [before] + matched + [after],
+                    schema,
+                    extra_indexes,
+                    in_fragment_order=in_fragment_order,
+                    overwrite=overwrite,
+                )
+            else:
+                object_ids = [
+                    self._store_changes_table(
+                        old_table,
+                        changes_table,
+                        schema,
+                        extra_indexes,
+                        in_fragment_order=in_fragment_order,
+                        overwrite=overwrite,
+                    )
+                ]
             # Finally, link the table to the new set of objects.
             self.register_tables(
                 old_table.repository,
@@ -629,6 +1245,7 @@ class FragmentManager(MetadataManager):
                 old_table.repository,
                 [(image_hash, old_table.table_name, new_schema_spec, old_table.objects)],
             )
+        self.object_engine.delete_table("pg_temp", changes_table)
 
     def get_min_max_pks(
         self, fragments: List[str], table_pks: List[Tuple[str, str]]
@@ -645,23 +1262,34 @@ class FragmentManager(MetadataManager):
         # If the PK isn't composite, we can read the range for the corresponding column
         # from the index, otherwise, the indexer stored the min/max tuple under $pk.
         pk = table_pks[0][0] if len(table_pks) == 1 else "$pk"
-        fields = SQL("object_id, index #>> '{{range,{0},0}}', index #>> '{{range,{0},1}}'").format(
-            Identifier(pk)
-        )
 
-        result = {
-            r[0]: (r[1], r[2])
-            for r in self.metadata_engine.run_chunked_sql(
-                select(
-                    "get_object_meta",
-                    fields.as_string(self.metadata_engine.connection),
-                    table_args="(%s)",
-                    schema=SPLITGRAPH_API_SCHEMA,
-                ),
-                (fragments,),
-                chunk_position=0,
+        # Single-column PKs can be read from the typed range index.
+        result: Dict[str, Tuple[Any, Any]] = {}
+        if pk != "$pk":
+            result = (
+                get_range_store_bounds(self.metadata_engine, fragments, pk, table_pks[0][1]) or {}
+            )
+
+        missing = [f for f in fragments if f not in result]
+        if missing:
+            fields = SQL(
+                "object_id, index #>> '{{range,{0},0}}', index #>> '{{range,{0},1}}'"
+            ).format(Identifier(pk))
+            result.update(
+                {
+                    r[0]: (r[1], r[2])
+                    for r in self.metadata_engine.run_chunked_sql(
+                        select(
+                            "get_object_meta",
+                            fields.as_string(self.metadata_engine.connection),
+                            table_args="(%s)",
+                            schema=SPLITGRAPH_API_SCHEMA,
+                        ),
+                        (missing,),
+                        chunk_position=0,
+                    )
+                }
             )
-        }
 
         # Since the PK can't contain a NULL, if we do get one here, it's from the JSON query
         # (column doesn't exist in the index).
@@ -708,27 +1336,42 @@ class FragmentManager(MetadataManager):
         :return: A 64-character (256-bit) hexadecimal string with the content hash of the table
             and the number of rows in the hash.
         """
+        content_hash, rows, _ = self._calculate_content_hash_and_aggregates(
+            schema, table, table_schema, chunk_id_col, chunk_id
+        )
+        return content_hash, rows
+
+    def _calculate_content_hash_and_aggregates(
+        self,
+        schema: str,
+        table: str,
+        table_schema: Optional[TableSchema] = None,
+        chunk_id_col: Optional[str] = None,
+        chunk_id: Optional[int] = None,
+        extra_aggregates: Optional[List[Composed]] = None,
+        pk_range: Optional[PKRange] = None,
+    ) -> Tuple[str, int, Optional[Sequence[Any]]]:
+        """
+        Same as `calculate_content_hash`, but also computes a list of aggregates over the table's
+        columns in the same scan (see `_aggregate_digests`). The rows can also be selected
+        by a range of primary key values instead of the chunk ID column.
+        """
         table_schema = table_schema or self.object_engine.get_full_table_schema(schema, table)
         digest_query = (
             SQL("SELECT digest((")
             + SQL(",").join(Identifier(c.name) for c in table_schema)
-            + SQL(")::text, 'sha256'::text) FROM {}.{} o").format(
-                Identifier(schema), Identifier(table)
-            )
+            + SQL(")::text, 'sha256'::text)")
         )
-        args = None
-        if chunk_id_col:
-            digest_query += SQL(" WHERE {} = %s").format(Identifier(chunk_id_col))
-            args = [chunk_id]
-
-        row_digests = self.object_engine.run_sql(
-            digest_query, args, return_shape=ResultShape.MANY_ONE
-        )
-
-        return (
-            reduce(operator.add, (Digest.from_memoryview(r) for r in row_digests)).hex(),
-            len(row_digests),
+        if extra_aggregates:
+            digest_query += SQL(",") + SQL(",").join(Identifier(c.name) for c in table_schema)
+        digest_query += SQL(" FROM {}.{} o").format(Identifier(schema), Identifier(table))
+        chunk_filter, args = _get_chunk_filter(chunk_id_col, chunk_id, pk_range)
+        digest_query += chunk_filter
+
+        content_hash, rows, aggregates = self._aggregate_digests(
+            digest_query, args or None, extra_aggregates
         )
+        return content_hash.hex(), rows, aggregates
 
     def create_base_fragment(
         self,
@@ -742,6 +1385,40 @@ class FragmentManager(MetadataManager):
         overwrite: bool = False,
         table_schema: Optional[TableSchema] = None,
     ) -> str:
+        new_object = self._store_base_fragment(
+            source_schema,
+            source_table,
+            namespace,
+            chunk_id_col=chunk_id_col,
+            chunk_id=chunk_id,
+            extra_indexes=extra_indexes,
+            in_fragment_order=in_fragment_order,
+            overwrite=overwrite,
+            table_schema=table_schema,
+        )
+        self._register_base_fragments([new_object], source_schema, source_table)
+        return new_object.object_id
+
+    def _store_base_fragment(
+        self,
+        source_schema: str,
+        source_table: str,
+        namespace: str,
+        chunk_id_col: Optional[str] = None,
+        chunk_id: Optional[int] = None,
+        extra_indexes: Optional[ExtraIndexInfo] = None,
+        in_fragment_order: Optional[List[str]] = None,
+        overwrite: bool = False,
+        table_schema: Optional[TableSchema] = None,
+        pk_range: Optional[PKRange] = None,
+    ) -> Object:
+        """
+        Hashes, stores and indexes a base fragment without registering it.
+        See `create_base_fragment` for the parameters. Instead of `chunk_id_col`,
+        the rows in the fragment can be selected by a range of primary key values (`pk_range`).
+
+        :return: Object metadata to be passed to `register_objects`.
+        """
         if source_schema == "pg_temp" and not table_schema:
             raise ValueError(
                 "Cannot infer the schema of temporary tables, " "pass in table_schema!"
@@ -758,9 +1435,21 @@ class FragmentManager(MetadataManager):
         ]
 
         schema_hash = self._calculate_schema_hash(table_schema)
-        # Get content hash for this chunk.
-        content_hash, rows_inserted = self.calculate_content_hash(
-            source_schema, source_table, table_schema, chunk_id_col=chunk_id_col, chunk_id=chunk_id
+        # Get content hash for this chunk. The index is computed from the same rows that will
+        # go into the object, so gather the data for it (min/max values and bloom filter digests)
+        # in the same scan instead of querying the new object afterwards.
+        (
+            content_hash,
+            rows_inserted,
+            index_aggregates,
+        ) = self._calculate_content_hash_and_aggregates(
+            source_schema,
+            source_table,
+            table_schema,
+            chunk_id_col=chunk_id_col,
+            chunk_id=chunk_id,
+            extra_aggregates=self._get_index_aggregates(table_schema, extra_indexes),
+            pk_range=pk_range,
         )
 
         # Object IDs are also used to key tables in Postgres so they can't be more than 63 characters.
@@ -771,19 +1460,15 @@ class FragmentManager(MetadataManager):
         with self.object_engine.savepoint("object_rename"):
             # Store the object adding the extra update/delete column (always True in this case
             # since we don't overwrite any rows) and filtering on the chunk ID.
-
+            chunk_filter, source_query_args = _get_chunk_filter(chunk_id_col, chunk_id, pk_range)
             source_query = (
                 SQL("SELECT ")
                 + SQL(",").join(Identifier(c.name) for c in table_schema)
                 + SQL(",TRUE AS ")
                 + Identifier(SG_UD_FLAG)
                 + SQL("FROM {}.{}").format(Identifier(source_schema), Identifier(source_table))
+                + chunk_filter
             )
-            source_query_args = []
-
-            if chunk_id_col:
-                source_query += SQL("WHERE {} = %s").format(Identifier(chunk_id_col))
-                source_query_args = [chunk_id]
 
             if in_fragment_order:
                 source_query += SQL(" ") + self._get_order_by_clause(
@@ -805,28 +1490,38 @@ class FragmentManager(MetadataManager):
                     source_schema,
                     source_table,
                 )
-        with self.metadata_engine.savepoint("object_register"):
-            try:
-                self._register_object(
-                    object_id,
-                    namespace=namespace,
-                    insertion_hash=content_hash,
-                    deletion_hash="0" * 64,
-                    table_schema=table_schema,
-                    extra_indexes=extra_indexes,
-                    rows_inserted=rows_inserted,
-                    rows_deleted=0,
-                )
-            except UniqueViolation:
+
+        return self._make_object(
+            object_id,
+            namespace=namespace,
+            insertion_hash=content_hash,
+            deletion_hash="0" * 64,
+            table_schema=table_schema,
+            extra_indexes=extra_indexes,
+            rows_inserted=rows_inserted,
+            rows_deleted=0,
+            index_aggregates=index_aggregates,
+        )
+
+    def _register_base_fragments(
+        self, objects: List[Object], source_schema: str, source_table: str
+    ) -> None:
+        try:
+            with self.metadata_engine.savepoint("object_register"):
+                self.register_objects(objects)
+        except UniqueViolation:
+            if len(objects) == 1:
                 # Someone registered this object (perhaps a concurrent pull) already.
                 logging.info(
                     "Object %s for table %s/%s already exists, continuing...",
-                    object_id,
+                    objects[0].object_id,
                     source_schema,
                     source_table,
                 )
-
-        return object_id
+                return
+            # Find out which objects clashed by registering them one-by-one.
+            for obj in objects:
+                self._register_base_fragments([obj], source_schema, source_table)
 
     @staticmethod
     def _get_order_by_clause(in_fragment_order, table_schema):
@@ -855,6 +1550,7 @@ class FragmentManager(MetadataManager):
         extra_indexes: Optional[ExtraIndexInfo] = None,
         in_fragment_order: Optional[List[str]] = None,
         overwrite: bool = False,
+        chunk_workers: Optional[int] = None,
     ) -> List[str]:
         """
         Copies the full table verbatim into one or more new base fragments and registers them.
@@ -868,6 +1564,8 @@ class FragmentManager(MetadataManager):
         :param extra_indexes: Dictionary of {index_type: column: index_specific_kwargs}.
         :param in_fragment_order: Key to sort data inside each chunk by.
         :param overwrite: Overwrite physical objects that already exist.
+        :param chunk_workers: If specified, use multiple connections to the engine to store
+            chunks in parallel. The source table must be visible to other sessions.
         """
         source_schema = source_schema or repository.to_schema()
         source_table = source_table or table_name
@@ -890,6 +1588,7 @@ class FragmentManager(MetadataManager):
                 extra_indexes,
                 in_fragment_order=in_fragment_order,
                 overwrite=overwrite,
+                workers=chunk_workers,
             )
 
         elif table_size:
@@ -921,12 +1620,12 @@ class FragmentManager(MetadataManager):
         table_schema: Optional[TableSchema] = None,
         in_fragment_order: Optional[List[str]] = None,
         overwrite: bool = False,
+        workers: Optional[int] = None,
     ) -> List[str]:
         table_pk = [p[0] for p in self.object_engine.get_change_key(source_schema, source_table)]
         table_schema = table_schema or self.object_engine.get_full_table_schema(
             source_schema, source_table
         )
-        object_ids = []
 
         # We need to do multiple things here in a specific way to not tank the performance:
         #  * Chunk the table up ordering by PK (or potentially another chunk key in the future)
@@ -951,54 +1650,131 @@ class FragmentManager(MetadataManager):
         # scans which also took more than 15 minutes on a 8M row table, no matter whether the
         # table had indexes on the join key.
         #
-        # In the current setup, we compute the partition key and extract the table contents
-        # into a TEMPORARY table, then create an index on that partition key, then copy data
+        # After that, we computed the partition key and extracted the table contents
+        # into a TEMPORARY table, then created an index on that partition key, then copied data
         # out of it into CStore. The first part takes 50 seconds, the second takes 16 seconds
-        # and after that extracting a chunk takes a few seconds.
+        # and after that extracting a chunk takes a few seconds. However, this copies the whole
+        # table and the sort/index steps take minutes on tables with tens of millions of rows.
+        #
+        # In the current setup, if the table has a primary key, we first find the PK values
+        # that chunks end at, only reading the PK (see `_get_pk_chunk_boundaries`), and then
+        # copy each chunk straight from the source with a range predicate on the PK, which
+        # Postgres can satisfy with an index scan. Tables without a primary key (where the
+        # change key isn't unique and can have NULLs) still get partitioned through a
+        # temporary table.
 
-        temp_table = "sg_tmp_partition_" + source_table
-        chunk_id_col = "sg_tmp_partition_id"
+        no_chunks = int(math.ceil(table_size / chunk_size))
+
+        if workers and workers > 1 and no_chunks > 1:
+            if source_schema == "pg_temp":
+                logging.warning(
+                    "Can't chunk temporary table %s in parallel, falling back to a single worker",
+                    source_table,
+                )
+                workers = None
+            else:
+                workers = min(
+                    workers,
+                    self._chunk_worker_limit or int(get_singleton(CONFIG, "SG_ENGINE_POOL")) - 1,
+                )
+                if workers <= 1:
+                    workers = None
+        else:
+            workers = None
 
-        pk_sql = SQL(",").join(Identifier(p) for p in table_pk)
-        # Example query: CREATE TEMPORARY TABLE sg_tmp_partition_table AS SELECT *,
-        # RANK () OVER (ORDER BY pk) / chunk_size sg_tmp_partition_id FROM source_schema.table
         logging.info("Processing table %s", source_table)
-        no_chunks = int(math.ceil(table_size / chunk_size))
 
         log_progress = _log_commit_progress(table_size, no_chunks)
         log_func = logging.info if log_progress else logging.debug
 
-        log_func("Computing table partitions")
-        tmp_table_query = (
-            SQL("CREATE TEMPORARY TABLE {} AS SELECT *, (ROW_NUMBER() OVER (ORDER BY ").format(
-                Identifier(temp_table)
+        if any(c.is_pk for c in table_schema):
+            log_func("Computing chunk boundaries")
+            chunk_mode = get_singleton(CONFIG, "SG_COMMIT_CHUNK_MODE")
+            if chunk_mode == "rows":
+                boundaries = self._get_pk_chunk_boundaries(
+                    source_schema,
+                    source_table,
+                    table_pk,
+                    table_size,
+                    chunk_size,
+                    float(get_singleton(CONFIG, "SG_COMMIT_CHUNK_TOLERANCE")),
+                )
+            elif chunk_mode == "content":
+                boundaries = self._get_content_defined_boundaries(
+                    source_schema, source_table, table_pk, table_size, chunk_size
+                )
+            else:
+                raise ValueError("Unknown chunking mode %s!" % chunk_mode)
+            bounds: List[Optional[Tuple]] = [None, *boundaries, None]
+            pk_ranges: List[PKRange] = [
+                (table_pk, lower, upper) for lower, upper in zip(bounds, bounds[1:])
+            ]
+
+            def _store_pk_range(chunk_no: int) -> Object:
+                return self._store_base_fragment(
+                    source_schema,
+                    source_table,
+                    repository.namespace,
+                    extra_indexes=extra_indexes,
+                    table_schema=table_schema,
+                    in_fragment_order=in_fragment_order,
+                    overwrite=overwrite,
+                    pk_range=pk_ranges[chunk_no],
+                )
+
+            new_objects = self._store_chunks(
+                _store_pk_range, len(pk_ranges), workers, log_func, log_progress
+            )
+            self._register_base_fragments(new_objects, source_schema, source_table)
+            return [o.object_id for o in new_objects]
+
+        chunk_id_col = "sg_tmp_partition_id"
+
+        # In parallel mode, the worker connections need to be able to see the partition table,
+        # so it can't be a temporary table: instead, create it as an UNLOGGED table in the
+        # metadata schema, commit it from a separate connection and drop it at the end.
+        if workers:
+            partition_schema = SPLITGRAPH_META_SCHEMA
+            temp_table = get_temporary_table_id()
+        else:
+            partition_schema = "pg_temp"
+            temp_table = "sg_tmp_partition_" + source_table
+
+        pk_sql = SQL(",").join(Identifier(p) for p in table_pk)
+        # Example query: CREATE TEMPORARY TABLE sg_tmp_partition_table AS SELECT *,
+        # RANK () OVER (ORDER BY pk) / chunk_size sg_tmp_partition_id FROM source_schema.table
+        if partition_schema == "pg_temp":
+            create_sql = SQL("CREATE TEMPORARY TABLE {} ").format(Identifier(temp_table))
+        else:
+            create_sql = SQL("CREATE UNLOGGED TABLE {}.{} ").format(
+                Identifier(partition_schema), Identifier(temp_table)
             )
+        tmp_table_query = (
+            create_sql
+            + SQL("AS SELECT *, (ROW_NUMBER() OVER (ORDER BY ")
             + pk_sql
             + SQL(") - 1) / %s {} FROM {}.{}").format(
                 Identifier(chunk_id_col), Identifier(source_schema), Identifier(source_table)
             )
         )
-        self.object_engine.run_sql(tmp_table_query, (chunk_size,))
 
-        log_func("Indexing the partition key")
-        self.object_engine.run_sql(
-            SQL("CREATE INDEX {} ON {}({})").format(
-                Identifier("idx_" + temp_table), Identifier(temp_table), Identifier(chunk_id_col)
+        def _create_partitions() -> None:
+            log_func("Computing table partitions")
+            self.object_engine.run_sql(tmp_table_query, (chunk_size,))
+
+            log_func("Indexing the partition key")
+            self.object_engine.run_sql(
+                SQL("CREATE INDEX {} ON {}.{}({})").format(
+                    Identifier("idx_" + temp_table),
+                    Identifier(partition_schema),
+                    Identifier(temp_table),
+                    Identifier(chunk_id_col),
+                )
             )
-        )
 
-        log_func("Storing and indexing the table")
-        pbar = tqdm(
-            range(0, no_chunks),
-            unit="objs",
-            total=no_chunks,
-            ascii=SG_CMD_ASCII,
-            disable=not log_progress,
-        )
-
-        for chunk_id in pbar:
-            new_fragment = self.create_base_fragment(
-                "pg_temp",
+        def _store_partition(chunk_id: int) -> Object:
+            return self._store_base_fragment(
+                partition_schema,
                 temp_table,
                 repository.namespace,
                 chunk_id_col=chunk_id_col,
@@ -1008,12 +1784,241 @@ class FragmentManager(MetadataManager):
                 in_fragment_order=in_fragment_order,
                 overwrite=overwrite,
             )
-            object_ids.append(new_fragment)
 
         # Temporary tables get deleted at the end of tx but sometimes we might run
         # multiple sg operations in the same transaction and clash.
-        self.object_engine.delete_table("pg_temp", temp_table)
-        return object_ids
+        new_objects = self._store_chunks(
+            _store_partition,
+            no_chunks,
+            workers,
+            log_func,
+            log_progress,
+            setup=_create_partitions,
+            teardown=lambda: self.object_engine.delete_table(partition_schema, temp_table),
+        )
+        self._register_base_fragments(new_objects, source_schema, source_table)
+        return [o.object_id for o in new_objects]
+
+    def _get_pk_chunk_boundaries(
+        self,
+        schema: str,
+        table: str,
+        table_pk: List[str],
+        table_size: int,
+        chunk_size: int,
+        tolerance: float = 0.0,
+    ) -> List[Tuple]:
+        """
+        Find the PK values that the chunks of a table end at (inclusive), apart from the last chunk.
+
+        By default, this walks the PK in order, fetching every `chunk_size`-th value (which only
+        needs to read the PK index). If `tolerance` is set, the boundaries are instead estimated
+        from a random sample of the table, large enough for the chunk sizes to be within
+        `tolerance * chunk_size` of `chunk_size` (with the probability of about 99.7%).
+
+        :param schema: Schema the table belongs to
+        :param table: Name of the table
+        :param table_pk: Primary key of the table
+        :param table_size: Number of rows in the table
+        :param chunk_size: Number of rows in every chunk
+        :param tolerance: Allowed relative deviation of chunk sizes from `chunk_size`.
+        :return: List of PK tuples
+        """
+        no_chunks = int(math.ceil(table_size / chunk_size))
+        if no_chunks <= 1:
+            return []
+
+        pk_sql = SQL(",").join(Identifier(p) for p in table_pk)
+        pk_query = (
+            SQL("SELECT ")
+            + pk_sql
+            + SQL(" FROM {}.{}").format(Identifier(schema), Identifier(table))
+        )
+
+        boundaries: List[Tuple] = []
+        # The number of sampled rows in a chunk is binomially distributed, so to get the size of
+        # the chunk within the tolerance 3 sigmas out, we need (3 / tolerance) ** 2 rows per chunk.
+        sample_rate = (3 / tolerance) ** 2 / chunk_size if tolerance > 0 else 1.0
+        if sample_rate < 1:
+            # Use a fixed seed so that chunking (and hence object IDs) is reproducible.
+            sample = self.object_engine.run_sql(
+                pk_query + SQL(" TABLESAMPLE BERNOULLI (%s) REPEATABLE (0) ORDER BY ") + pk_sql,
+                (sample_rate * 100,),
+            )
+            if sample:
+                for i in range(1, no_chunks):
+                    position = min(int(len(sample) * i * chunk_size / table_size), len(sample)) - 1
+                    boundary = tuple(sample[max(position, 0)])
+                    if not boundaries or boundary != boundaries[-1]:
+                        boundaries.append(boundary)
+                return boundaries
+
+        for _ in range(no_chunks - 1):
+            boundary = self._probe_pk(
+                schema, table, table_pk, boundaries[-1] if boundaries else None, chunk_size
+            )
+            if not boundary:
+                break
+            boundaries.append(boundary)
+        return boundaries
+
+    def _probe_pk(
+        self, schema: str, table: str, table_pk: List[str], after: Optional[Tuple], rows: int
+    ) -> Optional[Tuple]:
+        """
+        Get the PK of the `rows`-th row of the table (in PK order) after a given PK value,
+        or None if there are fewer rows than that.
+        """
+        pk_sql = SQL(",").join(Identifier(p) for p in table_pk)
+        query = (
+            SQL("SELECT ")
+            + pk_sql
+            + SQL(" FROM {}.{}").format(Identifier(schema), Identifier(table))
+        )
+        args: List[Any] = []
+        if after is not None:
+            query += (
+                SQL(" WHERE (")
+                + pk_sql
+                + SQL(") > (" + ",".join(itertools.repeat("%s", len(table_pk))) + ")")
+            )
+            args.extend(after)
+        query += SQL(" ORDER BY ") + pk_sql + SQL(" OFFSET %s LIMIT 1")
+        args.append(rows - 1)
+        result = self.object_engine.run_sql(query, args, return_shape=ResultShape.ONE_MANY)
+        return tuple(result) if result else None
+
+    def _get_content_defined_boundaries(
+        self, schema: str, table: str, table_pk: List[str], table_size: int, chunk_size: int
+    ) -> List[Tuple]:
+        """
+        Find chunk boundaries (see `_get_pk_chunk_boundaries`) based on the contents of
+        the table rather than the number of rows, so that changing a few rows in a table
+        only changes the chunks these rows are in.
+
+        A row ends a chunk if a hash of its PK is divisible by a given number. To avoid
+        very small or very large chunks, boundaries closer than `chunk_size / 4` rows
+        to the previous one are ignored and chunks longer than `4 * chunk_size` rows
+        are split by the number of rows.
+
+        :param schema: Schema the table belongs to
+        :param table: Name of the table
+        :param table_pk: Primary key of the table
+        :param table_size: Number of rows in the table
+        :param chunk_size: Average number of rows in every chunk
+        :return: List of PK tuples
+        """
+        min_size = max(chunk_size // 4, 1)
+        max_size = chunk_size * 4
+        # Boundaries past the minimum chunk size are geometrically distributed, so
+        # this makes the chunks be `chunk_size` rows long on average.
+        modulus = max(chunk_size - min_size, 1)
+
+        pk_sql = SQL(",").join(Identifier(p) for p in table_pk)
+        candidates = self.object_engine.run_sql(
+            SQL("SELECT ")
+            + pk_sql
+            + SQL(", sg_row_number FROM (SELECT ")
+            + pk_sql
+            + SQL(", ROW_NUMBER() OVER (ORDER BY ")
+            + pk_sql
+            + SQL(") AS sg_row_number, digest(ROW(")
+            + pk_sql
+            + SQL(")::text, 'sha256') AS sg_pk_digest FROM {}.{}) r ").format(
+                Identifier(schema), Identifier(table)
+            )
+            + SQL(
+                "WHERE ((get_byte(sg_pk_digest, 0)::bigint << 24) "
+                "| (get_byte(sg_pk_digest, 1) << 16) "
+                "| (get_byte(sg_pk_digest, 2) << 8) "
+                "| get_byte(sg_pk_digest, 3)) %% %s = 0 ORDER BY sg_row_number"
+            ),
+            (modulus,),
+        )
+
+        boundaries: List[Tuple] = []
+        last_row = 0
+        # Use the end of the table as the last candidate to split up the last chunk if it's too long.
+        for candidate in candidates + [(None, table_size)]:
+            pk, row_number = candidate[:-1], candidate[-1]
+            while row_number - last_row > max_size:
+                boundary = self._probe_pk(
+                    schema, table, table_pk, boundaries[-1] if boundaries else None, max_size
+                )
+                if not boundary:
+                    break
+                boundaries.append(boundary)
+                last_row += max_size
+            if row_number - last_row >= min_size and row_number < table_size:
+                boundaries.append(tuple(pk))
+                last_row = row_number
+        return boundaries
+
+    def _store_chunks(
+        self,
+        store_chunk: Callable[[int], Object],
+        no_chunks: int,
+        workers: Optional[int],
+        log_func: Callable,
+        log_progress: bool,
+        setup: Optional[Callable[[], None]] = None,
+        teardown: Optional[Callable[[], None]] = None,
+    ) -> List[Object]:
+        """
+        Store all chunks of a table, either on the current connection or using multiple
+        worker connections to the engine.
+
+        :param store_chunk: Function that stores the chunk with a given number.
+        :param no_chunks: Number of chunks
+        :param workers: Number of workers. If None, chunks are stored on the current connection.
+        :param log_func: Logging function
+        :param log_progress: Whether to display the progress bar.
+        :param setup: Function to call before storing the chunks
+        :param teardown: Function to call after all chunks have been stored
+        :return: List of objects (not yet registered), in the order of chunks.
+        """
+        if not workers:
+            if setup:
+                setup()
+
+            log_func("Storing and indexing the table")
+            pbar = tqdm(
+                range(0, no_chunks),
+                unit="objs",
+                total=no_chunks,
+                ascii=SG_CMD_ASCII,
+                disable=not log_progress,
+            )
+            new_objects = [store_chunk(chunk_no) for chunk_no in pbar]
+
+            if teardown:
+                teardown()
+            return new_objects
+
+        # Parallel mode: every worker thread gets its own connection to the engine and
+        # commits the objects it stores as it goes. Objects are only registered in the
+        # metadata (in the caller's transaction) once all chunks have been stored.
+        _in_worker = self._run_in_worker
+
+        with ThreadPoolExecutor(max_workers=workers) as tpe:
+            if setup:
+                tpe.submit(_in_worker, setup).result()
+            try:
+                log_func("Storing and indexing the table using %d workers", workers)
+                # map() returns results in order, so the list of objects is the same
+                # as in the single-worker mode.
+                return list(
+                    tqdm(
+                        tpe.map(lambda c: _in_worker(store_chunk, c), range(0, no_chunks)),
+                        unit="objs",
+                        total=no_chunks,
+                        ascii=SG_CMD_ASCII,
+                        disable=not log_progress,
+                    )
+                )
+            finally:
+                if teardown:
+                    tpe.submit(_in_worker, teardown).result()
 
     def filter_fragments(self, object_ids: List[str], table: "Table", quals: Any) -> List[str]:
         """
@@ -1039,10 +2044,29 @@ class FragmentManager(MetadataManager):
 
         column_types = {c[1]: c[2] for c in table.table_schema}
 
+        # If enabled, use the indexes cached in memory instead of querying the metadata engine
+        # (which we still fall back to for qualifiers we can't evaluate in memory).
+        index_cache = get_index_cache()
+        indexes = (
+            index_cache.get(
+                self.metadata_engine,
+                object_ids,
+                {c: _strip_type_mod(t) for c, t in column_types.items()},
+            )
+            if index_cache
+            else None
+        )
+
         # Run the range filter
-        range_filter_result = filter_range_index(
-            self.metadata_engine, object_ids, quals, column_types
+        range_filter_result = (
+            filter_range_index_in_memory(indexes, object_ids, quals, column_types)
+            if indexes is not None
+            else None
         )
+        if range_filter_result is None:
+            range_filter_result = filter_range_index(
+                self.metadata_engine, object_ids, quals, column_types
+            )
         if len(range_filter_result) < len(object_ids):
             logging.info(
                 "Range filter discarded %d/%d fragment(s)",
@@ -1052,7 +2076,12 @@ class FragmentManager(MetadataManager):
 
         # Run other filters: currently we can attempt to run the bloom filter
         # if the fragment metadata has bloom fingerprints.
-        bloom_filter_result = filter_bloom_index(self.metadata_engine, range_filter_result, quals)
+        if indexes is not None:
+            bloom_filter_result = filter_bloom_index_in_memory(indexes, range_filter_result, quals)
+        else:
+            bloom_filter_result = filter_bloom_index(
+                self.metadata_engine, range_filter_result, quals
+            )
         if len(bloom_filter_result) < len(range_filter_result):
             logging.info(
                 "Bloom filter discarded %d/%d fragment(s)",
@@ -1060,8 +2089,40 @@ class FragmentManager(MetadataManager):
                 len(range_filter_result),
             )
 
+        # Run the set index (exact matches on low-cardinality columns)
+        if indexes is not None:
+            set_filter_result = filter_set_index_in_memory(
+                indexes, bloom_filter_result, quals, column_types
+            )
+        else:
+            set_filter_result = filter_set_index(
+                self.metadata_engine, bloom_filter_result, quals, column_types
+            )
+        if len(set_filter_result) < len(bloom_filter_result):
+            logging.info(
+                "Set index discarded %d/%d fragment(s)",
+                len(bloom_filter_result) - len(set_filter_result),
+                len(bloom_filter_result),
+            )
+
+        # Run the trigram index (LIKE/ILIKE)
+        if indexes is not None:
+            trigram_filter_result = filter_trigram_index_in_memory(
+                indexes, set_filter_result, quals, column_types
+            )
+        else:
+            trigram_filter_result = filter_trigram_index(
+                self.metadata_engine, set_filter_result, quals, column_types
+            )
+        if len(trigram_filter_result) < len(set_filter_result):
+            logging.info(
+                "Trigram index discarded %d/%d fragment(s)",
+                len(set_filter_result) - len(trigram_filter_result),
+                len(set_filter_result),
+            )
+
         # Preserve original object order.
-        return [r for r in object_ids if r in bloom_filter_result]
+        return [r for r in object_ids if r in trigram_filter_result]
 
     def delete_objects(self, objects: Union[Set[str], List[str]]) -> None:
         """
@@ -1070,6 +2131,7 @@ class FragmentManager(MetadataManager):
         :param objects: A sequence of objects to be deleted
         """
         objects = list(objects)
+        invalidate_index_cache(objects)
         for i in range(0, len(objects), 100):
             to_delete = objects[i : i + 100]
             table_types = self.object_engine.run_sql(
@@ -141,6 +141,7 @@ class Image(NamedTuple):
                 POSTGRES_MAX_IDENTIFIER,
             )
 
+        current_head = self.repository.head
         if self.repository.has_pending_changes():
             if not force:
                 raise SplitGraphError(
@@ -150,19 +151,56 @@ class Image(NamedTuple):
                 )
             logging.warning("%s has pending changes, discarding...", target_schema)
             self.object_engine.discard_pending_changes(target_schema)
+            # Discarding changes doesn't revert schema changes, so don't reuse the tables.
+            current_head = None
 
-        # Drop all current tables in staging
+        # If the staging area has the current HEAD checked out, update tables that are
+        # in both images instead of materializing them from scratch.
         self.object_engine.create_schema(target_schema)
+        updated = self._checkout_incremental(current_head) if current_head and not layered else []
+
+        # Drop all other current tables in staging
         for table in self.object_engine.get_all_tables(target_schema):
-            self.object_engine.delete_table(target_schema, table)
+            if table not in updated:
+                self.object_engine.delete_table(target_schema, table)
 
         if layered:
             self._lq_checkout()
         else:
             for table in self.get_tables():
-                self.get_table(table).materialize(table)
+                if table not in updated:
+                    self.get_table(table).materialize(table)
         set_head(self.repository, self.image_hash)
 
+    def _checkout_incremental(self, current_head: "Image") -> List[str]:
+        """
+        Update tables in the staging area that has `current_head` checked out to their versions
+        in this image by applying only the fragments that differ between them.
+
+        :return: List of tables that were updated.
+        """
+        target_schema = self.repository.to_schema()
+        staging_tables = self.object_engine.get_all_tables(target_schema)
+        current_tables = current_head.get_tables()
+        tables = [
+            t
+            for t in self.get_tables()
+            if t in staging_tables
+            and t in current_tables
+            and self.object_engine.get_table_type(target_schema, t) == "BASE TABLE"
+        ]
+        if not tables:
+            return []
+
+        # Stop tracking changes to the tables while we're updating them (set_head starts
+        # tracking them again).
+        self.object_engine.untrack_tables([(target_schema, t) for t in tables])
+        return [
+            t
+            for t in tables
+            if self.get_table(t).materialize_incremental(t, current_head.get_table(t))
+        ]
+
     def _lq_checkout(
         self, target_schema: Optional[str] = None, wrapper: Optional[str] = FDW_CLASS
     ) -> None:
@@ -5,18 +5,40 @@ import struct
 from datetime import datetime
 from hashlib import sha256
 from math import ceil, log, exp
-from typing import Any, Dict, List, Optional, Tuple, Union, cast, TYPE_CHECKING
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union, cast, TYPE_CHECKING
 
-from psycopg2.sql import SQL, Identifier
+from psycopg2.sql import Composed, SQL, Identifier
 
 from splitgraph.config import SPLITGRAPH_META_SCHEMA
 from splitgraph.core.output import pretty_size
 from splitgraph.core.types import Changeset
+from splitgraph.engine import ResultShape
 from splitgraph.engine.postgres.engine import SG_UD_FLAG
 
+try:
+    import numpy as np
+except ImportError:
+    # NumPy not installed: build filters in pure Python.
+    np = None  # type: ignore
+
+try:
+    import xxhash
+except ImportError:
+    # xxhash not installed: xxh3 filters can't be built or used for filtering.
+    xxhash = None  # type: ignore
+
 if TYPE_CHECKING:
+    from splitgraph.core.indexing.cache import ObjectIndex
     from splitgraph.engine.postgres.engine import PsycopgEngine
 
+# Versions of the bloom filter format, recorded in the index as a third element of the filter
+# (filters without it use SHA256, which was the only supported hash originally).
+#  * 1: SHA256 of the value and of the value + salt, computed by the engine.
+#  * 2: the two 64-bit halves of the 128-bit XXH3 hash of the value, computed by the client
+#    from the distinct values in the column. Much faster than SHA256, but requires the
+#    xxhash package.
+BLOOM_HASH_VERSIONS = {"sha256": 1, "xxh3": 2}
+
 
 def _hash_value(value: Union[datetime, int, str, None]) -> Tuple[bytes, bytes]:
     if value is None:
@@ -29,6 +51,90 @@ def _hash_value(value: Union[datetime, int, str, None]) -> Tuple[bytes, bytes]:
     )
 
 
+def _hash_value_xxh3(value: Union[datetime, int, str, None]) -> Tuple[int, int]:
+    assert xxhash is not None
+    digest = xxhash.xxh3_128_digest(("NULL" if value is None else str(value)).encode("utf-8"))
+    return int.from_bytes(digest[:8], byteorder="big"), int.from_bytes(digest[8:], byteorder="big")
+
+
+def _get_hash_version(hash_function: str) -> int:
+    try:
+        version = BLOOM_HASH_VERSIONS[hash_function]
+    except KeyError:
+        raise ValueError(
+            "Unsupported bloom filter hash function %s! Supported functions: %s"
+            % (hash_function, ", ".join(BLOOM_HASH_VERSIONS))
+        )
+    if version == 2 and xxhash is None:
+        raise ValueError("xxh3 bloom filters require the xxhash package to be installed!")
+    return version
+
+
+def bloom_digest_aggregate(column: str, hash_function: str = "sha256") -> Composed:
+    """
+    Get an aggregate that collects the distinct items of a column that the bloom filter
+    is built from (see `generate_bloom_index`), so that it can be computed in the same query
+    as other aggregates on the object's rows.
+
+    :param column: Column name
+    :param hash_function: Hash function the filter will use (sha256 or xxh3)
+    :return: SQL expression returning an array of 64-byte concatenated digest pairs
+        (for sha256) or of distinct values cast to text (for xxh3).
+    """
+    if _get_hash_version(hash_function) == 2:
+        return SQL("array_agg(DISTINCT coalesce({0}::text, 'NULL'))").format(Identifier(column))
+    return SQL(
+        "array_agg(DISTINCT digest(coalesce({0}::text, 'NULL'), 'sha256') "
+        "|| digest(coalesce({0}::text, 'NULL') || 'salt', 'sha256'))"
+    ).format(Identifier(column))
+
+
+def _digest_pairs_mod(digest_pairs: Sequence[bytes], modulus: int) -> Tuple[Any, Any]:
+    """Split concatenated pairs of big-endian digests and convert them into integers
+    modulo `modulus` (as arrays if NumPy is available)."""
+    half = len(digest_pairs[0]) // 2 if digest_pairs else 0
+    if np is None or modulus >= 2 ** 47 or not digest_pairs:
+        return (
+            [int.from_bytes(d[:half], byteorder="big") % modulus for d in digest_pairs],
+            [int.from_bytes(d[half:], byteorder="big") % modulus for d in digest_pairs],
+        )
+    if half == 8:
+        # Each hash fits into 64 bits already.
+        hashes = np.frombuffer(b"".join(digest_pairs), dtype=">u8").reshape(-1, 2)
+        result = hashes.astype(np.uint64) % np.uint64(modulus)
+    else:
+        # Go through the digests in 16-bit limbs, so that intermediate values fit into 64 bits.
+        limbs = np.frombuffer(b"".join(digest_pairs), dtype=">u2").reshape(-1, half)
+        limbs = limbs.astype(np.uint64)
+        result = np.zeros((len(digest_pairs), 2), dtype=np.uint64)
+        for i in range(half // 2):
+            result = (result * np.uint64(65536) + limbs[:, i :: half // 2]) % np.uint64(modulus)
+    return result[:, 0], result[:, 1]
+
+
+def _build_filter(hash_1: Any, hash_2: Any, no_funcs: int, size: int) -> bytes:
+    """Build a bloom filter of `size` bytes, setting bits (hash_1 + i * hash_2) % size_bits
+    for i in 0..no_funcs - 1 for every pair of hashes (already reduced modulo size_bits)."""
+    size_bits = size * 8
+    if np is not None and isinstance(hash_1, np.ndarray):
+        bits = np.zeros(size_bits, dtype=bool)
+        position = hash_1.astype(np.int64)
+        step = hash_2.astype(np.int64)
+        for _ in range(no_funcs):
+            bits[position] = True
+            # Both hashes are smaller than the modulus, so we only need to subtract it once.
+            position += step
+            position -= size_bits * (position >= size_bits)
+        return np.packbits(bits, bitorder="little").tobytes()
+
+    result = bytearray(size)
+    for h_1, h_2 in zip(hash_1, hash_2):
+        for i in range(no_funcs):
+            hash_i = (h_1 + i * h_2) % size_bits
+            result[hash_i // 8] |= 1 << hash_i % 8
+    return bytes(result)
+
+
 def generate_bloom_index(
     engine: "PsycopgEngine",
     object_id: str,
@@ -36,7 +142,9 @@ def generate_bloom_index(
     column: str,
     probability: Optional[float] = None,
     size: Optional[int] = None,
-) -> Tuple[int, str]:
+    digests: Optional[List[Any]] = None,
+    hash_function: str = "sha256",
+) -> Union[Tuple[int, str], Tuple[int, str, int]]:
     """
     Generates a bloom filter signature for a given column and a given fragment. Bloom filters
     can answer queries asking whether an item is definitely not in a given set or possibly can be.
@@ -55,16 +163,22 @@ def generate_bloom_index(
     :param probability: Probability of a false positive. Either this or the size of the filter must
         be specified, but not both.
     :param size: Size of the filter, in bytes.
+    :param digests: Result of `bloom_digest_aggregate` if it has already been computed
+        for the object's rows. If not passed, the digests are queried from the object.
+    :param hash_function: Hash function to use: sha256 (default) or xxh3 (faster, requires
+        the xxhash package). Filters that don't use sha256 are stored with their format version.
     :return: Dictionary to be inserted into the index.
     """
 
     if not (probability is None) ^ (size is None):
         raise ValueError("One of probability or size must be specified, but not both!")
+    version = _get_hash_version(hash_function)
 
     # We need k hash functions to generate a signature for every item, which we can construct
     # by taking a linear combination of two hash functions. The first hash function is a simple sha of the
-    # column, the second one is a sha of the column + a deterministic salt.
-    # First, we outsource the actual hashing to Postgres.
+    # column, the second one is a sha of the column + a deterministic salt (for xxh3, these are
+    # the two halves of the column's 128-bit hash).
+    # First, we outsource the actual hashing (or, for xxh3, deduplication) to Postgres.
 
     # NULLs are interesting since a sha of a NULL is a NULL again. Here, we
     # turn them into strings with "NULL". This does mean they will collide if
@@ -72,19 +186,26 @@ def generate_bloom_index(
     # it will only mean chunks with NULLs will be fetched for a query with "NULL"
     # and vice versa, which doesn't break anything (this is just a preflight optimisation).
 
-    digest_query = SQL(
-        "SELECT digest(coalesce({0}::text, 'NULL'), 'sha256'), "
-        "digest(coalesce({0}::text, 'NULL') || 'salt', 'sha256') "
-        "FROM {1}.{2} o WHERE o.{3} = true"
-    ).format(
-        Identifier(column),
-        Identifier(SPLITGRAPH_META_SCHEMA),
-        Identifier(object_id),
-        Identifier(SG_UD_FLAG),
+    if digests is None:
+        digests = (
+            engine.run_sql(
+                SQL("SELECT ")
+                + bloom_digest_aggregate(column, hash_function)
+                + SQL(" FROM {}.{} o WHERE o.{} = true").format(
+                    Identifier(SPLITGRAPH_META_SCHEMA),
+                    Identifier(object_id),
+                    Identifier(SG_UD_FLAG),
+                ),
+                return_shape=ResultShape.ONE_ONE,
+            )
+            or []
+        )
+    items: List[Any] = (
+        [d if isinstance(d, bytes) else bytes(d) for d in digests]
+        if version == 1
+        else list(digests)
     )
 
-    digests = engine.run_sql(digest_query)
-
     # Add digests of the old values in the changeset for this column.
     if changeset:
         for _, old_row, _ in changeset.values():
@@ -98,12 +219,28 @@ def generate_bloom_index(
                 # since we deduplicate our digests and the same digest
                 # will set the same bits in the filter to 1, but something
                 # to keep in mind.
-                digests.append(_hash_value(old_row[column]))
+                value = old_row[column]
+                if version == 1:
+                    items.append(b"".join(_hash_value(value)))
+                else:
+                    items.append("NULL" if value is None else str(value))
 
-    # Count the number of distinct items and determine the size (if needed) and optimal number
-    # of hash functions.
-    distinct_items = list(set(digests))
+    # Items from the object are already deduplicated by the engine.
+    distinct_items = list(set(items)) if changeset else items
+    return _make_bloom_filter(distinct_items, version, probability, size)
 
+
+def _make_bloom_filter(
+    distinct_items: List[Any],
+    version: int,
+    probability: Optional[float] = None,
+    size: Optional[int] = None,
+) -> Union[Tuple[int, str], Tuple[int, str, int]]:
+    """Build a bloom filter from distinct items: concatenated SHA256 digest pairs (for format
+    version 1) or strings (for version 2). See `generate_bloom_index` for the parameters."""
+
+    # Determine the size (if needed) and optimal number of hash functions from the number
+    # of distinct items.
     if probability:
         # The formula gives the number of bits in the array, but we divide it by
         # 8 since we'll be using a byte array for operations + to store the signature.
@@ -111,35 +248,80 @@ def generate_bloom_index(
 
     # For mypy: we've asserted previously that either probability or size are specified
     # and we calculate the size from the probability, so size is no longer Optional[int].
-    size = cast(int, size)
+    # An empty filter still has to have at least one byte.
+    size = max(cast(int, size), 1)
 
     size_bits = size * 8
-    no_funcs = int(ceil(log(2) * size_bits / len(distinct_items)))
+    no_funcs = int(ceil(log(2) * size_bits / max(len(distinct_items), 1)))
 
-    # Generate the filter
-    result = bytearray(size)
-    for hash_1, hash_2 in distinct_items:
-        hash_1 = int.from_bytes(hash_1, byteorder="big")
-        hash_2 = int.from_bytes(hash_2, byteorder="big")
-        for i in range(no_funcs):
-            hash_i = (hash_1 + i * hash_2) % size_bits
-            result[hash_i // 8] |= 1 << hash_i % 8
+    # Reduce the hashes modulo the filter size, since (h_1 + i * h_2) % m is the same as
+    # (h_1 % m + i * (h_2 % m)) % m. This lets us build the filter using 64-bit arithmetic.
+    if version == 2:
+        assert xxhash is not None
+        digest = xxhash.xxh3_128_digest
+        distinct_items = [digest(v.encode("utf-8")) for v in distinct_items]
+    hash_1, hash_2 = _digest_pairs_mod(distinct_items, size_bits)
+
+    result = base64.b64encode(_build_filter(hash_1, hash_2, no_funcs, size)).decode("ascii")
+    if version == 1:
+        return no_funcs, result
+    return no_funcs, result, version
+
+
+def build_bloom_filter(
+    items: Sequence[str],
+    probability: Optional[float] = None,
+    size: Optional[int] = None,
+    hash_function: str = "sha256",
+) -> Union[Tuple[int, str], Tuple[int, str, int]]:
+    """
+    Build a bloom filter from a set of strings hashed on the client, in the same format as
+    the filters built by `generate_bloom_index`.
+
+    :param items: Distinct items to add to the filter
+    :param probability: Probability of a false positive. Either this or the size of the filter must
+        be specified, but not both.
+    :param size: Size of the filter, in bytes.
+    :param hash_function: Hash function to use: sha256 (default) or xxh3.
+    :return: Filter to be inserted into the index.
+    """
+    if not (probability is None) ^ (size is None):
+        raise ValueError("One of probability or size must be specified, but not both!")
+    version = _get_hash_version(hash_function)
+    return _make_bloom_filter(
+        [b"".join(_hash_value(i)) for i in items] if version == 1 else list(items),
+        version,
+        probability,
+        size,
+    )
 
-    return no_funcs, base64.b64encode(result).decode("ascii")
 
+def decode_bloom_filter(index_tuple: List[Any]) -> Tuple[int, bytes, int]:
+    """
+    Decode a bloom filter stored in the index.
 
-def describe(index_tuple: Tuple[int, str]) -> str:
+    :param index_tuple: Filter returned by generate_bloom_index
+    :return: Tuple of (k, filter, format version)
+    """
+    return (
+        int(index_tuple[0]),
+        base64.b64decode(index_tuple[1]),
+        int(index_tuple[2]) if len(index_tuple) > 2 else 1,
+    )
+
+
+def describe(index_tuple: Union[Tuple[int, str], Tuple[int, str, int]]) -> str:
     """
     Returns a pretty-printed summary of the bloom filter
 
-    :param index_tuple: Tuple of (k, base64-encoded fingerprint)
+    :param index_tuple: Tuple of (k, base64-encoded fingerprint[, format version])
         returned by generate_bloom_index
     :return: String
     """
 
-    k, bloom_filter = index_tuple
+    k, bloom_filter = index_tuple[0], index_tuple[1]
     footprint = len(bloom_filter)
-    bloom_filter = base64.b64decode(bloom_filter)
+    k, bloom_filter, version = decode_bloom_filter(list(index_tuple))
 
     # Get filter size in bytes (this is not the in-db footprint of the base64 value)
     filter_size = len(bloom_filter)
@@ -154,23 +336,27 @@ def describe(index_tuple: Tuple[int, str]) -> str:
     # Calculate the rough false positive probability
     probability = (1 - exp(-k * approx_items / filter_size / 8)) ** k
 
-    return "k=%d, size %s, approx. %d item(s), false positive probability %.1f%%" % (
+    result = "k=%d, size %s, approx. %d item(s), false positive probability %.1f%%" % (
         k,
         pretty_size(footprint),
         int(approx_items),
         probability * 100,
     )
+    if version != 1:
+        result += ", hash %s" % next(h for h, v in BLOOM_HASH_VERSIONS.items() if v == version)
+    return result
 
 
-def _prepare_bloom_quals(quals: Any) -> List[List[Tuple[str, int, int]]]:
+def _prepare_bloom_quals(quals: Any) -> List[List[Tuple[str, Tuple[int, int], Any]]]:
     """
     Convert list of qualifiers in CNF (ANDed OR-clauses where each clause is "column, operator, value")
     to prepare it for querying the bloom filter:
 
     * Clauses where operator isn't equality are set to True (we can't make a judgement on anything
       but exact matches).
-    * Clauses with equality are converted to (column, hash_1, hash_2) so that the sought value
-      isn't re-hashed for every fragment
+    * Clauses with equality are converted to (column, SHA256 hashes, xxh3 hashes) so that the
+      sought value isn't re-hashed for every fragment (xxh3 hashes are None if xxhash
+      isn't installed).
     * OR-clauses where one operator is True are set to True completely (e.g. if we query
       a = 5 OR b > 6, the bloom filter can't say with certainty that there are no rows
       with b > 6 in the fragment and so we have to inspect it)
@@ -186,10 +372,12 @@ def _prepare_bloom_quals(quals: Any) -> List[List[Tuple[str, int, int]]]:
             return True
 
         hash_1, hash_2 = _hash_value(value)
-        hash_1 = int.from_bytes(hash_1, byteorder="big")
-        hash_2 = int.from_bytes(hash_2, byteorder="big")
+        sha256_hashes = (
+            int.from_bytes(hash_1, byteorder="big"),
+            int.from_bytes(hash_2, byteorder="big"),
+        )
 
-        return column, hash_1, hash_2
+        return column, sha256_hashes, _hash_value_xxh3(value) if xxhash else None
 
     def _process_or(quals):
         result = []
@@ -210,22 +398,31 @@ def _prepare_bloom_quals(quals: Any) -> List[List[Tuple[str, int, int]]]:
     return result
 
 
-def _match(qual: Tuple[str, int, int], bloom_index: Dict[str, Tuple[int, bytes]]) -> bool:
+def _match(
+    qual: Tuple[str, Tuple[int, int], Optional[Tuple[int, int]]],
+    bloom_index: Dict[str, Tuple[int, bytes, int]],
+) -> bool:
     """
-    Checks whether a processed qual (column, hash_1, hash_2) can match a fragment with
-    a given index.
+    Checks whether a processed qual (column, SHA256 hashes, xxh3 hashes) can match a fragment
+    with a given index.
 
     :param qual:
     :param bloom_index:
     """
 
-    column, hash_1, hash_2 = qual
+    column, sha256_hashes, xxh3_hashes = qual
     if column not in bloom_index:
         # No index info for this column -- might match
         return True
 
-    no_funcs, bloom_filter = bloom_index[column]
+    no_funcs, bloom_filter, version = bloom_index[column]
+    hashes = sha256_hashes if version == 1 else xxh3_hashes if version == 2 else None
+    if hashes is None:
+        # Filter format we can't read (or xxh3 with no xxhash) -- might match
+        return True
+
     size_bits = len(bloom_filter) * 8
+    hash_1, hash_2 = hashes[0] % size_bits, hashes[1] % size_bits
     for i in range(no_funcs):
         hash_i = (hash_1 + i * hash_2) % size_bits
         if not bloom_filter[hash_i // 8] & (1 << hash_i % 8):
@@ -268,11 +465,45 @@ def filter_bloom_index(engine: "PsycopgEngine", object_ids: List[str], quals: An
     )
 
     bloom_index = {
-        o: {col: (i[0], base64.b64decode(i[1])) for col, i in index.items()}
+        o: {col: decode_bloom_filter(i) for col, i in index.items()}
         for o, index in bloom_index
         if index
     }
+    return _filter_objects(object_ids, quals, bloom_index)
+
+
+def filter_bloom_index_in_memory(
+    indexes: Dict[str, "ObjectIndex"], object_ids: List[str], quals: Any
+) -> List[str]:
+    """
+    Same as `filter_bloom_index`, but uses decoded object indexes (see
+    `splitgraph.core.indexing.cache`) instead of loading them from the engine.
+
+    :param indexes: Dictionary of object ID -> decoded index
+    :param object_ids: Object IDs
+    :param quals: List of qualifiers
+    :return: List of object IDs that might match the qualifiers in `quals` (including
+        IDs that don't have a bloom index).
+    """
+    if not object_ids:
+        return object_ids
+
+    quals = _prepare_bloom_quals(quals)
+    if not quals:
+        return object_ids
+
+    return _filter_objects(
+        object_ids,
+        quals,
+        {o: indexes[o].bloom for o in object_ids if o in indexes and indexes[o].bloom},
+    )
+
 
+def _filter_objects(
+    object_ids: List[str],
+    quals: List[List[Tuple[str, Tuple[int, int], Any]]],
+    bloom_index: Dict[str, Dict[str, Tuple[int, bytes, int]]],
+) -> List[str]:
     dropped = []
 
     for object_id in object_ids:
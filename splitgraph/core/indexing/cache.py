@@ -0,0 +1,227 @@
+"""
+In-process cache of decoded object indexes, so that fragments can be filtered without
+querying the metadata engine every time.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, List, NamedTuple, Optional, Tuple, TYPE_CHECKING
+
+from splitgraph.config import CONFIG, SPLITGRAPH_API_SCHEMA, get_singleton
+from splitgraph.core.indexing.bloom import decode_bloom_filter
+from splitgraph.core.indexing.range import adapt_range_bound
+from splitgraph.core.indexing.set import decode_set_index
+from splitgraph.core.sql import select
+
+if TYPE_CHECKING:
+    from splitgraph.engine.postgres.engine import PsycopgEngine
+
+# Rough per-entry, per-column and per-value (in the set index) overheads (in bytes)
+# of the Python objects that store the index
+_ENTRY_OVERHEAD = 512
+_COLUMN_OVERHEAD = 256
+_VALUE_OVERHEAD = 64
+
+
+class ObjectIndex(NamedTuple):
+    """Decoded index of an object."""
+
+    # Column -> (min, max), coerced to the column's Python type
+    range: Dict[str, Tuple[Any, Any]]
+    # Column -> (number of hash functions, filter bitset, filter format version)
+    bloom: Dict[str, Tuple[int, bytes, int]]
+    # Column -> distinct values, coerced to the column's Python type
+    set: Dict[str, FrozenSet[Any]]
+    # Column -> trigram filter, same format as the bloom filter
+    trigram: Dict[str, Tuple[int, bytes, int]]
+    # Approximate size of the entry in memory, in bytes
+    size: int
+
+
+class IndexCacheStats(NamedTuple):
+    hits: int
+    misses: int
+    evictions: int
+    entries: int
+    size: int
+
+
+def decode_index(index: Optional[Dict[str, Any]], column_types: Dict[str, str]) -> ObjectIndex:
+    """
+    Decode an object's index as it's stored in the metadata engine.
+
+    :param index: Object index
+    :param column_types: Dictionary of column names and their types (without type modifiers)
+    """
+    index = index or {}
+    range_index = {
+        column: (
+            adapt_range_bound(bounds[0], column_types[column]),
+            adapt_range_bound(bounds[1], column_types[column]),
+        )
+        for column, bounds in index.get("range", {}).items()
+        if column in column_types
+    }
+    bloom_index = {
+        column: decode_bloom_filter(value) for column, value in index.get("bloom", {}).items()
+    }
+    set_index = decode_set_index(index.get("set", {}), column_types)
+    trigram_index = {
+        column: decode_bloom_filter(value) for column, value in index.get("trigram", {}).items()
+    }
+    size = (
+        _ENTRY_OVERHEAD
+        + _COLUMN_OVERHEAD
+        * (len(range_index) + len(bloom_index) + len(set_index) + len(trigram_index))
+        + sum(len(b) for _, b, _ in bloom_index.values())
+        + _VALUE_OVERHEAD * sum(len(v) for v in set_index.values())
+        + sum(len(b) for _, b, _ in trigram_index.values())
+    )
+    return ObjectIndex(
+        range=range_index, bloom=bloom_index, set=set_index, trigram=trigram_index, size=size
+    )
+
+
+class IndexCache:
+    """
+    LRU cache of decoded object indexes. Object indexes don't change after the object has been
+    registered (apart from when the object gets reindexed, in which case the caller is
+    supposed to invalidate it), so they can be kept in memory and used to filter fragments
+    for multiple queries.
+
+    Entries are keyed by the name of the engine that the index was loaded from and the object ID.
+    This is thread-safe.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        """
+        :param max_size: Maximum size of all entries in the cache, in bytes.
+        """
+        self.max_size = max_size
+        self._entries: "OrderedDict[Tuple[Optional[str], str], ObjectIndex]" = OrderedDict()
+        self._size = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    def get(
+        self, engine: "PsycopgEngine", object_ids: List[str], column_types: Dict[str, str]
+    ) -> Dict[str, ObjectIndex]:
+        """
+        Get decoded indexes of multiple objects, loading the ones that aren't in the cache
+        from the engine.
+
+        :param engine: Metadata engine the objects are registered on
+        :param object_ids: List of object IDs
+        :param column_types: Dictionary of column names and their types (without type
+            modifiers) in the table the objects belong to.
+        :return: Dictionary of object ID -> ObjectIndex. Objects that aren't registered on
+            the engine are omitted.
+        """
+        result: Dict[str, ObjectIndex] = {}
+        missing: List[str] = []
+        with self._lock:
+            for object_id in object_ids:
+                entry = self._entries.get((engine.name, object_id))
+                if entry is None:
+                    missing.append(object_id)
+                else:
+                    self._entries.move_to_end((engine.name, object_id))
+                    result[object_id] = entry
+            self._hits += len(result)
+            self._misses += len(missing)
+
+        if missing:
+            logging.debug("Loading indexes for %d object(s)", len(missing))
+            loaded = {
+                object_id: decode_index(index, column_types)
+                for object_id, index in engine.run_chunked_sql(
+                    select(
+                        "get_object_meta",
+                        "object_id, index",
+                        table_args="(%s)",
+                        schema=SPLITGRAPH_API_SCHEMA,
+                    ),
+                    (missing,),
+                    chunk_position=0,
+                )
+            }
+            result.update(loaded)
+            with self._lock:
+                for object_id, entry in loaded.items():
+                    self._put((engine.name, object_id), entry)
+        return result
+
+    def _put(self, key: Tuple[Optional[str], str], entry: ObjectIndex) -> None:
+        if entry.size > self.max_size:
+            return
+        old_entry = self._entries.pop(key, None)
+        if old_entry:
+            self._size -= old_entry.size
+        self._entries[key] = entry
+        self._size += entry.size
+        while self._size > self.max_size:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= evicted.size
+            self._evictions += 1
+
+    def invalidate(self, object_ids: List[str]) -> None:
+        """
+        Remove objects from the cache (on all engines), e.g. if they have been reindexed or deleted.
+
+        :param object_ids: List of object IDs
+        """
+        to_delete = set(object_ids)
+        with self._lock:
+            for key in [k for k in self._entries if k[1] in to_delete]:
+                self._size -= self._entries.pop(key).size
+
+    def clear(self) -> None:
+        """Remove all entries from the cache and reset its statistics."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self._hits = 0
+            self._misses = 0
+            self._evictions = 0
+
+    def get_stats(self) -> IndexCacheStats:
+        """
+        :return: Number of cache hits, misses and evictions (in objects), number of
+            objects in the cache and its approximate size in bytes.
+        """
+        with self._lock:
+            return IndexCacheStats(
+                hits=self._hits,
+                misses=self._misses,
+                evictions=self._evictions,
+                entries=len(self._entries),
+                size=self._size,
+            )
+
+
+_INDEX_CACHE: Optional[IndexCache] = None
+_INDEX_CACHE_LOCK = threading.Lock()
+
+
+def get_index_cache() -> Optional[IndexCache]:
+    """
+    :return: Index cache shared by the whole process or None if it's disabled
+        (SG_INDEX_CACHE_SIZE is 0).
+    """
+    global _INDEX_CACHE
+    size = int(get_singleton(CONFIG, "SG_INDEX_CACHE_SIZE") or 0) * 1024 * 1024
+    if size <= 0:
+        return None
+    with _INDEX_CACHE_LOCK:
+        if _INDEX_CACHE is None:
+            _INDEX_CACHE = IndexCache(size)
+        _INDEX_CACHE.max_size = size
+        return _INDEX_CACHE
+
+
+def invalidate_index_cache(object_ids: List[str]) -> None:
+    """Remove objects from the process-wide index cache (if it's been created)."""
+    if _INDEX_CACHE is not None:
+        _INDEX_CACHE.invalidate(object_ids)
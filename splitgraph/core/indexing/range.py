@@ -1,6 +1,24 @@
 import logging
-from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar, cast, TYPE_CHECKING
-
+import math
+import struct
+from datetime import date, datetime
+from decimal import Decimal
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    TypeVar,
+    cast,
+    TYPE_CHECKING,
+)
+
+from psycopg2.errors import UndefinedFunction
+from psycopg2.extras import Json
 from psycopg2.sql import Composed, SQL, Composable
 from psycopg2.sql import Identifier
 
@@ -12,10 +30,58 @@ from splitgraph.engine import ResultShape
 from splitgraph.engine.postgres.engine import PG_INDEXABLE_TYPES
 
 if TYPE_CHECKING:
+    from splitgraph.core.indexing.cache import ObjectIndex
     from splitgraph.engine.postgres.engine import PsycopgEngine
 
 T = TypeVar("T", bound=Comparable)
 
+# Types whose values (as coerced by `adapt`) compare the same way in Python as they do in
+# Postgres (strings are compared using the C collation, same as Python).
+_IN_MEMORY_RANGE_TYPES = [
+    "bigint",
+    "character varying",
+    "date",
+    "double precision",
+    "integer",
+    "numeric",
+    "real",
+    "smallint",
+    "text",
+    "timestamp",
+    "timestamp without time zone",
+]
+_RANGE_OPERATORS = (">", ">=", "<", "<=", "=")
+
+# Types that are stored in the typed range index (splitgraph_meta.object_ranges) and the range
+# types they're stored as. Must be kept in sync with splitgraph_meta.index_object_ranges.
+# Real columns aren't stored: their bounds are the shortest text representations of single
+# precision values, which can't be compared exactly with qualifier values as numerics.
+_RANGE_STORE_TYPES = {
+    "bigint": "numeric",
+    "character varying": "text",
+    "date": "timestamp",
+    "double precision": "numeric",
+    "integer": "numeric",
+    "numeric": "numeric",
+    "smallint": "numeric",
+    "text": "text",
+    "timestamp": "timestamp",
+    "timestamp without time zone": "timestamp",
+}
+
+# Range of values (lower bound, upper bound, range bounds) that an object has to intersect
+# to possibly match a qualifier.
+_OPERATOR_RANGES: Dict[str, Callable[[Any], Tuple[Any, Any, str]]] = {
+    ">": lambda v: (v, None, "()"),
+    ">=": lambda v: (v, None, "[)"),
+    "<": lambda v: (None, v, "()"),
+    "<=": lambda v: (None, v, "(]"),
+    "=": lambda v: (v, v, "[]"),
+}
+
+# Metadata engines that don't have the typed range index (registries running an older API).
+_NO_RANGE_STORE: Set[Optional[str]] = set()
+
 
 # Custom min/max functions that ignore Nones
 def _min(left: Optional[T], right: Optional[T]) -> Optional[T]:
@@ -93,8 +159,8 @@ def _qual_to_index_clause(qual: Tuple[str, str, Any], ctype: str) -> Tuple[SQL,
             )
         ).format((Identifier(column_name)))
         args.append(value)
-    # Currently, we ignore the LIKE (~~) qualifier since we can only make a judgement when the % pattern is at
-    # the end of a string.
+    # We ignore the LIKE (~~) qualifier here since we can only make a judgement when the % pattern is at
+    # the end of a string (LIKE/ILIKE are handled by the trigram index instead).
     # For inequality, we can't really say when an object is definitely not pertinent to a qual:
     #   * if a <> X and X is included in an object's range, the object still might have values that aren't X.
     #   * if X isn't included in an object's range, the object definitely has values that aren't X so we have
@@ -200,12 +266,54 @@ def extract_min_max_pks(
     return min_max
 
 
+def get_range_index_columns(
+    table_schema: "TableSchema", columns: Optional[List[str]] = None
+) -> List[str]:
+    """
+    Get the list of columns the range index will be computed on.
+
+    :param table_schema: Schema of the table
+    :param columns: Columns to run the index on (default all)
+    :return: List of column names (always includes the primary key).
+    """
+    columns = columns if columns is not None else [c.name for c in table_schema]
+    return [
+        c.name
+        for c in table_schema
+        if _strip_type_mod(c.pg_type) in PG_INDEXABLE_TYPES and (c.is_pk or c.name in columns)
+    ]
+
+
+def range_index_aggregates(
+    table_schema: "TableSchema", columns: Optional[List[str]] = None
+) -> List[Composed]:
+    """
+    Get the MIN/MAX aggregates the range index is computed from, so that they can be run
+    against the object itself or against the rows it's about to be built from.
+
+    :param table_schema: Schema of the table
+    :param columns: Columns to run the index on (default all)
+    :return: List of SQL expressions, producing two values (min, max) per indexed column.
+    """
+    column_types = {c.name: _strip_type_mod(c.pg_type) for c in table_schema}
+    return [
+        SQL(
+            _inject_collation("MIN({0}", column_types[c])
+            + "), "
+            + _inject_collation("MAX({0}", column_types[c])
+            + ")"
+        ).format(Identifier(c))
+        for c in get_range_index_columns(table_schema, columns)
+    ]
+
+
 def generate_range_index(
     object_engine: "PsycopgEngine",
     object_id: str,
     table_schema: "TableSchema",
     changeset: Optional[Changeset],
     columns: Optional[List[str]] = None,
+    min_max: Optional[Sequence[Any]] = None,
 ) -> Dict[str, Tuple[T, T]]:
     """
     Calculate the minimum/maximum values of every column in the object (including deleted values).
@@ -215,34 +323,25 @@ def generate_range_index(
     :param table_schema: Schema of the table
     :param changeset: Changeset (old values will be included in the index)
     :param columns: Columns to run the index on (default all)
+    :param min_max: Values of `range_index_aggregates` if they have already been computed
+        for the object's rows. If not passed, they are queried from the object.
     :return: Dictionary of {column: [min, max]}
     """
-    columns = columns if columns is not None else [c.name for c in table_schema]
-
     object_pk = [c.name for c in table_schema if c.is_pk]
     if not object_pk:
         object_pk = [c.name for c in table_schema if c.pg_type in PG_INDEXABLE_TYPES]
     column_types = {c.name: _strip_type_mod(c.pg_type) for c in table_schema}
-    columns_to_index = [
-        c.name
-        for c in table_schema
-        if _strip_type_mod(c.pg_type) in PG_INDEXABLE_TYPES and (c.is_pk or c.name in columns)
-    ]
+    columns_to_index = get_range_index_columns(table_schema, columns)
 
-    logging.debug("Running range index on columns %s", columns_to_index)
-    query = SQL("SELECT ") + SQL(",").join(
-        SQL(
-            _inject_collation("MIN({0}", column_types[c])
-            + "), "
-            + _inject_collation("MAX({0}", column_types[c])
-            + ")"
-        ).format(Identifier(c))
-        for c in columns_to_index
-    )
-    query += SQL(" FROM {}.{}").format(Identifier(SPLITGRAPH_META_SCHEMA), Identifier(object_id))
-    result = object_engine.run_sql(query, return_shape=ResultShape.ONE_MANY)
+    if min_max is None:
+        logging.debug("Running range index on columns %s", columns_to_index)
+        query = SQL("SELECT ") + SQL(",").join(range_index_aggregates(table_schema, columns))
+        query += SQL(" FROM {}.{}").format(
+            Identifier(SPLITGRAPH_META_SCHEMA), Identifier(object_id)
+        )
+        min_max = object_engine.run_sql(query, return_shape=ResultShape.ONE_MANY)
     index = {
-        col: (cmin, cmax) for col, cmin, cmax in zip(columns_to_index, result[0::2], result[1::2])
+        col: (cmin, cmax) for col, cmin, cmax in zip(columns_to_index, min_max[0::2], min_max[1::2])
     }
     # Also explicitly store the ranges of composite PKs (since they won't be included
     # in the columns list) to be used for faster chunking/querying.
@@ -290,12 +389,148 @@ def generate_range_index(
     return range_index
 
 
+def _to_range_bound(value: Any, range_type: str) -> Optional[str]:
+    """Convert a qualifier value into a bound of a range in the typed range index.
+    Returns None if it can't be compared with the index."""
+    if isinstance(value, str):
+        return value
+    if range_type == "numeric":
+        if isinstance(value, (int, Decimal)) and not isinstance(value, bool):
+            return str(value)
+        if isinstance(value, float) and math.isfinite(value):
+            return repr(value)
+    elif range_type == "timestamp":
+        if isinstance(value, datetime) and value.tzinfo is None:
+            return value.isoformat()
+        if isinstance(value, date) and not isinstance(value, datetime):
+            return value.isoformat()
+    return None
+
+
+def _quals_to_range_store_quals(
+    quals: Any, column_types: Dict[str, str]
+) -> Optional[List[List[List[Any]]]]:
+    """Convert qualifiers in CNF into the format accepted by
+    splitgraph_api.filter_objects_by_range. Returns None if some qualifiers can't be
+    evaluated against the typed range index."""
+    result = []
+    for or_quals in quals:
+        clause = []
+        for column_name, qual_op, value in or_quals:
+            if qual_op not in _RANGE_OPERATORS:
+                # We don't know if any object matches this qualifier, so any object might
+                # match the whole OR-clause.
+                break
+            range_type = _RANGE_STORE_TYPES.get(_strip_type_mod(column_types[column_name]))
+            bound = _to_range_bound(value, range_type) if range_type else None
+            if range_type is None or bound is None:
+                return None
+            lower, upper, bounds = _OPERATOR_RANGES[qual_op](bound)
+            clause.append([column_name, range_type, lower, upper, bounds])
+        else:
+            result.append(clause)
+    return result
+
+
+def _query_range_store(
+    metadata_engine: "PsycopgEngine",
+    function: str,
+    columns: str,
+    arguments: Tuple[Any, ...],
+    return_shape: ResultShape,
+) -> Optional[List[Any]]:
+    """Call a typed range index API function, chunking up the object IDs (first argument).
+    Returns None if the engine doesn't support the typed range index."""
+    if metadata_engine.name in _NO_RANGE_STORE:
+        return None
+    try:
+        with metadata_engine.savepoint("query_range_store"):
+            return cast(
+                List[Any],
+                metadata_engine.run_chunked_sql(
+                    select(
+                        function,
+                        columns,
+                        table_args="(" + ",".join(["%s"] * len(arguments)) + ")",
+                        schema=SPLITGRAPH_API_SCHEMA,
+                    ),
+                    arguments,
+                    return_shape=return_shape,
+                    chunk_position=0,
+                ),
+            )
+    except UndefinedFunction:
+        logging.warning(
+            "Engine %s doesn't have a typed range index, falling back to the JSON index",
+            metadata_engine.name,
+        )
+        _NO_RANGE_STORE.add(metadata_engine.name)
+        return None
+
+
+def get_range_store_bounds(
+    metadata_engine: "PsycopgEngine", object_ids: List[str], column: str, column_type: str
+) -> Optional[Dict[str, Tuple[str, str]]]:
+    """
+    Get the ranges of values of a column in multiple objects from the typed range index.
+
+    :param metadata_engine: Metadata engine
+    :param object_ids: List of object IDs
+    :param column: Column name
+    :param column_type: Column type
+    :return: Dictionary of object ID -> (min, max) as strings (that can be coerced using
+        `adapt`) for objects that have the column in the typed index or None if the column
+        can't be stored in the typed index.
+    """
+    # Dates are stored as timestamps, so we can't get their original values back.
+    column_type = _strip_type_mod(column_type)
+    if column_type not in _RANGE_STORE_TYPES or column_type == "date":
+        return None
+    result = _query_range_store(
+        metadata_engine,
+        "get_object_ranges",
+        "object_id, lower_bound, upper_bound",
+        (object_ids, column),
+        ResultShape.MANY_MANY,
+    )
+    if result is None:
+        return None
+    return {r[0]: (r[1], r[2]) for r in result}
+
+
 def filter_range_index(
     metadata_engine: "PsycopgEngine",
     object_ids: List[str],
     quals: Any,
     column_types: Dict[str, str],
 ) -> List[str]:
+    """
+    Filter objects using their range index, discarding the ones that definitely don't
+    match the qualifiers.
+
+    If all qualifiers can be evaluated using the typed range index (a GiST-indexed table
+    with a typed range for every indexed column), it's used instead of extracting and
+    casting bounds from every object's JSON index.
+
+    :param metadata_engine: Metadata engine
+    :param object_ids: List of object IDs to filter
+    :param quals: Qualifiers in CNF
+    :param column_types: Dictionary of column names and their types
+    :return: List of objects that might match the qualifiers (objects that aren't
+        registered on the metadata engine are discarded).
+    """
+    store_quals = _quals_to_range_store_quals(quals, column_types)
+    if store_quals is not None:
+        result = _query_range_store(
+            metadata_engine,
+            "filter_objects_by_range",
+            "*",
+            (object_ids, Json(store_quals)),
+            ResultShape.MANY_ONE,
+        )
+        if result is not None:
+            return result
+
     clause, args = _quals_to_clause(quals, column_types)
     query = (
         select("get_object_meta", "object_id", table_args="(%s)", schema=SPLITGRAPH_API_SCHEMA)
@@ -309,3 +544,114 @@ def filter_range_index(
             query, [object_ids] + list(args), return_shape=ResultShape.MANY_ONE, chunk_position=0
         ),
     )
+
+
+def adapt_range_bound(value: Any, ctype: str) -> Any:
+    """
+    Coerce a bound stored in the range index into a Python value that can be compared
+    with qualifier values in memory. Unlike `adapt`, this keeps numeric values exact
+    (as Decimals), since that's how they're compared by Postgres.
+
+    :param value: Bound from the range index
+    :param ctype: Type of the column (without type modifiers)
+    """
+    if value is not None and ctype == "numeric":
+        return Decimal(str(value))
+    return adapt(value, ctype)
+
+
+def _round_to_float4(value: Any) -> Any:
+    """Round a number to the nearest single precision (`real`) value, which is how Postgres
+    stores real values and casts numeric literals compared with real columns."""
+    if value is None or isinstance(value, bool) or not isinstance(value, (float, Decimal)):
+        return value
+    try:
+        return struct.unpack("f", struct.pack("f", float(value)))[0]
+    except OverflowError:
+        return float(value)
+
+
+def _qual_matches_range(
+    qual: Tuple[str, str, Any], ctype: str, range_index: Dict[str, Tuple[Any, Any]]
+) -> bool:
+    """In-memory equivalent of `_qual_to_index_clause`."""
+    column_name, qual_op, value = qual
+    if column_name not in range_index or qual_op not in _RANGE_OPERATORS:
+        return True
+    min_value, max_value = range_index[column_name]
+    if isinstance(value, str):
+        value = adapt_range_bound(value, ctype)
+
+    # Mimic the casts that Postgres does when comparing numbers of different types:
+    # numeric literals are cast to floating point when compared with real/double precision
+    # columns (rounding them to single precision for real columns) and numeric columns are
+    # cast to floating point when compared with floats.
+    if ctype == "real":
+        # The index stores the shortest text representation of real values (e.g. 0.1), which
+        # isn't the same number as the real value itself when read as a double.
+        value = _round_to_float4(value)
+        min_value = _round_to_float4(min_value)
+        max_value = _round_to_float4(max_value)
+    elif ctype == "double precision" and isinstance(value, Decimal):
+        value = float(value)
+    elif ctype == "numeric" and isinstance(value, float):
+        min_value = float(min_value) if min_value is not None else None
+        max_value = float(max_value) if max_value is not None else None
+
+    # Comparisons with NULLs are never true.
+    if value is None:
+        return False
+    if qual_op == ">":
+        return max_value is not None and max_value > value
+    if qual_op == ">=":
+        return max_value is not None and max_value >= value
+    if qual_op == "<":
+        return min_value is not None and min_value < value
+    if qual_op == "<=":
+        return min_value is not None and min_value <= value
+    return min_value is not None and max_value is not None and min_value <= value <= max_value
+
+
+def filter_range_index_in_memory(
+    indexes: Dict[str, "ObjectIndex"],
+    object_ids: List[str],
+    quals: Any,
+    column_types: Dict[str, str],
+) -> Optional[List[str]]:
+    """
+    Same as `filter_range_index`, but uses decoded object indexes (see
+    `splitgraph.core.indexing.cache`) instead of querying the metadata engine.
+
+    :param indexes: Dictionary of object ID -> decoded index. Objects that aren't in
+        this dictionary are discarded (same as objects that aren't registered).
+    :param object_ids: List of object IDs to filter
+    :param quals: Qualifiers in CNF
+    :param column_types: Dictionary of column names and their types
+    :return: List of objects that might match the qualifiers or None if the qualifiers
+        can't be evaluated in memory (e.g. on columns with unsupported types).
+    """
+    stripped_types = {c: _strip_type_mod(t) for c, t in column_types.items()}
+    if any(
+        q[1] in _RANGE_OPERATORS and stripped_types.get(q[0]) not in _IN_MEMORY_RANGE_TYPES
+        for or_quals in quals
+        for q in or_quals
+    ):
+        return None
+
+    try:
+        return [
+            object_id
+            for object_id in object_ids
+            if object_id in indexes
+            and all(
+                any(
+                    _qual_matches_range(q, stripped_types[q[0]], indexes[object_id].range)
+                    for q in or_quals
+                )
+                for or_quals in quals
+            )
+        ]
+    except (TypeError, ValueError):
+        # Values that can't be compared with the index (e.g. timezone-aware timestamps):
+        # let the engine deal with them.
+        return None
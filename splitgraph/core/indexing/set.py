@@ -0,0 +1,316 @@
+"""
+Exact filtering on fragments for equality queries on low-cardinality columns.
+
+The set index stores all distinct (non-NULL) values of a column in a fragment, as long as there
+are at most `max_values` of them. Unlike the bloom filter, it has no false positives, so queries
+like `col = 'a'` or `col IN ('a', 'b')` only touch fragments that actually contain these values.
+Columns with more distinct values than that get a bloom filter instead.
+"""
+import itertools
+import logging
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple, TYPE_CHECKING
+
+from psycopg2.sql import Composable, Composed, SQL, Identifier
+
+from splitgraph.config import SPLITGRAPH_META_SCHEMA
+from splitgraph.core.common import adapt, coerce_val_to_json
+from splitgraph.core.indexing.bloom import bloom_digest_aggregate, generate_bloom_index
+from splitgraph.core.indexing.range import _strip_type_mod
+from splitgraph.core.types import Changeset, TableSchema
+from splitgraph.engine import ResultShape
+from splitgraph.engine.postgres.engine import SG_UD_FLAG
+
+if TYPE_CHECKING:
+    from splitgraph.core.indexing.cache import ObjectIndex
+    from splitgraph.engine.postgres.engine import PsycopgEngine
+
+# Default maximum number of distinct values stored in the set index
+DEFAULT_MAX_VALUES = 100
+
+# Default false positive probability of the bloom filter built for columns with more values
+DEFAULT_BLOOM_PROBABILITY = 0.01
+
+# Types that can be put into the set index and the Python types that their values (as coerced
+# by `adapt`) have. Values of these types are equal in Python iff they're equal in Postgres.
+_SET_INDEX_TYPES: Dict[str, Tuple[type, ...]] = {
+    "bigint": (int, float, Decimal),
+    "character varying": (str,),
+    "date": (date,),
+    "integer": (int, float, Decimal),
+    "smallint": (int, float, Decimal),
+    "text": (str,),
+    "timestamp": (datetime,),
+    "timestamp without time zone": (datetime,),
+}
+
+# Returned by `_adapt_qual_value` for values that can't be looked up in the index
+_UNKNOWN = object()
+
+
+def get_set_index_columns(
+    table_schema: TableSchema, set_index_columns: Dict[str, Dict[str, Any]]
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Validate the set index options.
+
+    :param table_schema: Schema of the table
+    :param set_index_columns: Dictionary of column -> set index options
+    :return: Dictionary of column -> options with the defaults filled in.
+    """
+    column_types = {c.name: _strip_type_mod(c.pg_type) for c in table_schema}
+    result = {}
+    for column, options in set_index_columns.items():
+        if column_types.get(column) not in _SET_INDEX_TYPES:
+            raise ValueError(
+                "Column %s of type %s can't be put into the set index! Supported types: %s"
+                % (column, column_types.get(column), ", ".join(_SET_INDEX_TYPES))
+            )
+        options = dict(options or {})
+        options.setdefault("max_values", DEFAULT_MAX_VALUES)
+        if "probability" not in options and "size" not in options:
+            options["probability"] = DEFAULT_BLOOM_PROBABILITY
+        result[column] = options
+    return result
+
+
+def set_index_aggregates(
+    column: str, options: Dict[str, Any], condition: Optional[Composable] = None
+) -> List[Composed]:
+    """
+    Get the aggregates that the set index on a column is built from, so that they can be
+    computed in the same query as other aggregates on the object's rows.
+
+    :param column: Column name
+    :param options: Set index options (see `get_set_index_columns`)
+    :param condition: Optional, only aggregate rows matching this condition.
+    :return: List of two SQL expressions: an array of distinct non-NULL values in the column
+        (NULL if there are more than `max_values` of them) and the digests that the bloom
+        filter would be built from in that case (see `bloom_digest_aggregate`).
+    """
+    col = Identifier(column)
+    agg_filter = SQL(" FILTER (WHERE ") + condition + SQL(")") if condition else SQL("")
+    values = (
+        SQL("CASE WHEN COUNT(DISTINCT {})").format(col)
+        + agg_filter
+        + SQL(
+            " <= %d THEN COALESCE(array_agg(DISTINCT {0}) FILTER (WHERE {0} IS NOT NULL"
+            % int(options["max_values"])
+        ).format(col)
+        + (SQL(" AND ") + condition if condition else SQL(""))
+        + SQL("), '{}') END")
+    )
+    return [
+        values,
+        bloom_digest_aggregate(column, options.get("hash_function", "sha256")) + agg_filter,
+    ]
+
+
+def generate_set_index(
+    engine: "PsycopgEngine",
+    object_id: str,
+    changeset: Optional[Changeset],
+    column: str,
+    max_values: int = DEFAULT_MAX_VALUES,
+    values: Optional[List[Any]] = None,
+    digests: Optional[List[Any]] = None,
+    **bloom_kwargs: Any
+) -> Tuple[str, Any]:
+    """
+    Generates the set index for a given column and a given fragment: a sorted list of distinct
+    non-NULL values in the column or, if there are more than `max_values` of them, a bloom filter.
+
+    :param engine: Object engine the fragment is cached in.
+    :param object_id: Fragment ID
+    :param changeset: Optional, if specified, the old column values are included in the index.
+    :param column: Column name to generate the index on.
+    :param max_values: Maximum number of distinct values to store.
+    :param values: First result of `set_index_aggregates` if it has already been computed
+        for the object's rows. If not passed, the values are queried from the object.
+    :param digests: Second result of `set_index_aggregates` (see `generate_bloom_index`).
+    :param bloom_kwargs: Options for the bloom filter (probability/size, hash_function).
+    :return: Tuple of the index type ("set" or "bloom") and the index data for the column.
+    """
+    if values is None and digests is None:
+        values = engine.run_sql(
+            SQL("SELECT ")
+            + set_index_aggregates(column, {"max_values": max_values})[0]
+            + SQL(" FROM {}.{} o WHERE o.{} = true").format(
+                Identifier(SPLITGRAPH_META_SCHEMA),
+                Identifier(object_id),
+                Identifier(SG_UD_FLAG),
+            ),
+            return_shape=ResultShape.ONE_ONE,
+        )
+
+    distinct_values = None
+    if values is not None:
+        distinct_values = {coerce_val_to_json(v) for v in values}
+        if changeset:
+            for _, old_row, _ in changeset.values():
+                if old_row.get(column) is not None:
+                    distinct_values.add(coerce_val_to_json(old_row[column]))
+
+    if distinct_values is not None and len(distinct_values) <= max_values:
+        return "set", sorted(distinct_values)
+
+    logging.debug(
+        "Column %s has more than %d distinct values, building a bloom filter", column, max_values
+    )
+    return (
+        "bloom",
+        generate_bloom_index(engine, object_id, changeset, column, digests=digests, **bloom_kwargs),
+    )
+
+
+def decode_set_index(
+    set_index: Dict[str, List[Any]], column_types: Dict[str, str]
+) -> Dict[str, FrozenSet[Any]]:
+    """
+    Decode the set index as it's stored in the object's metadata.
+
+    :param set_index: Dictionary of column -> list of values
+    :param column_types: Dictionary of column names and their types (without type modifiers)
+    :return: Dictionary of column -> set of values, coerced to the column's Python type.
+        Columns with types that can't be in the set index are skipped.
+    """
+    return {
+        column: frozenset(adapt(v, column_types[column]) for v in values)
+        for column, values in set_index.items()
+        if column_types.get(column) in _SET_INDEX_TYPES
+    }
+
+
+def _adapt_qual_value(value: Any, ctype: str) -> Any:
+    """Coerce a value that a column is compared with to the type of the values in the decoded
+    set index, returning _UNKNOWN if it can't be looked up in the index."""
+    if isinstance(value, str) and _SET_INDEX_TYPES[ctype] != (str,):
+        try:
+            value = adapt(value, ctype)
+        except (TypeError, ValueError):
+            return _UNKNOWN
+    if isinstance(value, bool) or not isinstance(value, _SET_INDEX_TYPES[ctype]):
+        return _UNKNOWN
+    if ctype == "date" and isinstance(value, datetime):
+        return _UNKNOWN
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        return _UNKNOWN
+    return value
+
+
+def _prepare_set_quals(quals: Any, column_types: Dict[str, str]) -> List[List[Tuple[str, Any]]]:
+    """
+    Convert a list of qualifiers in CNF into a list of OR-clauses of (column, value) that can be
+    checked against the set index. OR-clauses where any qualifier isn't an equality on
+    a column that can be in the set index are dropped (the index can't discard any
+    fragments based on them). Note that `col IN (a, b)` is passed to us as `col = a OR col = b`.
+
+    :param quals: Quals in CNF
+    :param column_types: Dictionary of column names and their types (without type modifiers)
+    :return: List of OR-clauses
+    """
+    result = []
+    for or_quals in quals:
+        clause = []
+        for column, operator, value in or_quals:
+            if operator != "=" or column_types.get(column) not in _SET_INDEX_TYPES:
+                break
+            if value is not None:
+                value = _adapt_qual_value(value, column_types[column])
+                if value is _UNKNOWN:
+                    break
+            clause.append((column, value))
+        else:
+            result.append(clause)
+    return result
+
+
+def _filter_objects(
+    object_ids: List[str],
+    quals: List[List[Tuple[str, Any]]],
+    set_index: Dict[str, Dict[str, FrozenSet[Any]]],
+) -> List[str]:
+    def _match(column: str, value: Any, object_index: Dict[str, FrozenSet[Any]]) -> bool:
+        if column not in object_index:
+            # No index info for this column -- might match
+            return True
+        # Comparisons with NULLs are never true.
+        return value is not None and value in object_index[column]
+
+    return [
+        o
+        for o in object_ids
+        if o not in set_index
+        or all(
+            any(_match(column, value, set_index[o]) for column, value in or_quals)
+            for or_quals in quals
+        )
+    ]
+
+
+def filter_set_index(
+    engine: "PsycopgEngine", object_ids: List[str], quals: Any, column_types: Dict[str, str]
+) -> List[str]:
+    """
+    Discard objects that can't match the qualifiers using their set indexes.
+
+    :param engine: Metadata engine
+    :param object_ids: Object IDs
+    :param quals: List of qualifiers in CNF
+    :param column_types: Dictionary of column names and their types
+    :return: List of object IDs that might match the qualifiers in `quals` (including
+        IDs that don't have a set index).
+    """
+    if not object_ids:
+        return object_ids
+
+    column_types = {c: _strip_type_mod(t) for c, t in column_types.items()}
+    set_quals = _prepare_set_quals(quals, column_types)
+    if not set_quals:
+        return object_ids
+
+    set_index = engine.run_sql(
+        SQL(
+            "SELECT object_id, index -> 'set' FROM {}.{} WHERE object_id IN ("
+            + ",".join(itertools.repeat("%s", len(object_ids)))
+            + ")"
+        ).format(Identifier(SPLITGRAPH_META_SCHEMA), Identifier("objects")),
+        object_ids,
+    )
+    return _filter_objects(
+        object_ids,
+        set_quals,
+        {o: decode_set_index(index, column_types) for o, index in set_index if index},
+    )
+
+
+def filter_set_index_in_memory(
+    indexes: Dict[str, "ObjectIndex"],
+    object_ids: List[str],
+    quals: Any,
+    column_types: Dict[str, str],
+) -> List[str]:
+    """
+    Same as `filter_set_index`, but uses decoded object indexes (see
+    `splitgraph.core.indexing.cache`) instead of loading them from the engine.
+
+    :param indexes: Dictionary of object ID -> decoded index
+    :param object_ids: Object IDs
+    :param quals: List of qualifiers in CNF
+    :param column_types: Dictionary of column names and their types
+    :return: List of object IDs that might match the qualifiers in `quals` (including
+        IDs that don't have a set index).
+    """
+    if not object_ids:
+        return object_ids
+
+    set_quals = _prepare_set_quals(quals, {c: _strip_type_mod(t) for c, t in column_types.items()})
+    if not set_quals:
+        return object_ids
+
+    return _filter_objects(
+        object_ids,
+        set_quals,
+        {o: indexes[o].set for o in object_ids if o in indexes and indexes[o].set},
+    )
@@ -0,0 +1,335 @@
+"""
+Filtering on fragments for LIKE/ILIKE queries on text columns.
+
+The trigram index is a bloom filter of all 3-character substrings (trigrams) of the values
+of a column in a fragment. A pattern like `%abc%` can only match a value if all trigrams of
+its literal parts are in the value, so fragments whose filter is missing any of them can be
+skipped. Values are padded with markers at the start and the end, so that patterns anchored
+at the start or the end of the value (`abc%`, `%abc`) only match fragments that have values
+beginning or ending with these characters.
+
+To support ILIKE, trigrams are built after converting every character to lowercase.
+"""
+import itertools
+import logging
+from typing import Any, Dict, List, Optional, Set, Tuple, TYPE_CHECKING
+
+from psycopg2.sql import Composable, Composed, SQL, Identifier
+
+from splitgraph.config import SPLITGRAPH_META_SCHEMA
+from splitgraph.core.indexing.bloom import (
+    _hash_value,
+    _hash_value_xxh3,
+    _match,
+    build_bloom_filter,
+    decode_bloom_filter,
+    xxhash,
+)
+from splitgraph.core.indexing.range import _strip_type_mod
+from splitgraph.core.types import Changeset, TableSchema
+from splitgraph.engine import ResultShape
+from splitgraph.engine.postgres.engine import SG_UD_FLAG
+
+if TYPE_CHECKING:
+    from splitgraph.core.indexing.cache import ObjectIndex
+    from splitgraph.engine.postgres.engine import PsycopgEngine
+
+# Default false positive probability of the trigram filter
+DEFAULT_TRIGRAM_PROBABILITY = 0.01
+
+# Types that can be put into the trigram index (char(n) isn't supported since its values
+# are padded with spaces that LIKE ignores)
+_TRIGRAM_INDEX_TYPES = ["text", "character varying"]
+
+# Operators that the trigram index can evaluate: LIKE and ILIKE
+_LIKE_OPERATORS = {"~~": False, "~~*": True}
+
+# Markers that the values are padded with to make trigrams at their start and end distinct
+_START = "\x02"
+_END = "\x03"
+
+
+class _LowercaseTable(dict):
+    """Translation table (see `str.translate`) that maps every character to the first
+    character of its lowercase form. Unlike `str.lower`, this maps each character
+    separately (so that the mapping of a string is the same as the concatenation of
+    the mappings of its parts) and never changes the length of the string."""
+
+    def __missing__(self, key: int) -> str:
+        result = chr(key).lower()[0]
+        self[key] = result
+        return result
+
+
+_LOWERCASE_TABLE = _LowercaseTable()
+
+
+def _lowercase(value: str) -> str:
+    return value.translate(_LOWERCASE_TABLE)
+
+
+def _hash_trigram(trigram: str) -> Tuple[Tuple[int, int], Optional[Tuple[int, int]]]:
+    """Get the hashes of a trigram that are looked up in filters with SHA256 and with XXH3
+    (None if xxhash isn't installed), see `splitgraph.core.indexing.bloom._match`."""
+    hash_1, hash_2 = _hash_value(trigram)
+    return (
+        (int.from_bytes(hash_1, byteorder="big"), int.from_bytes(hash_2, byteorder="big")),
+        _hash_value_xxh3(trigram) if xxhash else None,
+    )
+
+
+def _get_trigrams(value: str) -> Set[str]:
+    """Get all trigrams of a value."""
+    value = _START * 2 + _lowercase(value) + _END
+    return {value[i : i + 3] for i in range(len(value) - 2)}
+
+
+def _get_pattern_trigrams(pattern: str, case_insensitive: bool) -> Set[str]:
+    """
+    Get trigrams that every value matching a LIKE pattern has to contain.
+
+    :param pattern: LIKE pattern (with the default escape character, backslash)
+    :param case_insensitive: If True, this is an ILIKE pattern.
+    :return: Set of trigrams
+    """
+    # Split the pattern into literal parts separated by the wildcards (% or _).
+    parts = []
+    current = _START * 2
+    chars = iter(pattern)
+    for char in chars:
+        if char in ("%", "_"):
+            parts.append(current)
+            current = ""
+            continue
+        if char == "\\":
+            char = next(chars, char)
+        current += char
+    parts.append(current + _END)
+
+    result = set()
+    for part in parts:
+        part = _lowercase(part)
+        for i in range(len(part) - 2):
+            trigram = part[i : i + 3]
+            # ILIKE compares lowercase versions of the pattern and the value, using
+            # the database's locale. Characters outside of ASCII might have a different
+            # lowercase form there, so don't rely on them.
+            if not case_insensitive or all(ord(c) < 128 for c in trigram):
+                result.add(trigram)
+    return result
+
+
+def get_trigram_index_columns(
+    table_schema: TableSchema, trigram_index_columns: Dict[str, Dict[str, Any]]
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Validate the trigram index options.
+
+    :param table_schema: Schema of the table
+    :param trigram_index_columns: Dictionary of column -> trigram index options
+    :return: Dictionary of column -> options with the defaults filled in.
+    """
+    column_types = {c.name: _strip_type_mod(c.pg_type) for c in table_schema}
+    result = {}
+    for column, options in trigram_index_columns.items():
+        if column_types.get(column) not in _TRIGRAM_INDEX_TYPES:
+            raise ValueError(
+                "Column %s of type %s can't be put into the trigram index! Supported types: %s"
+                % (column, column_types.get(column), ", ".join(_TRIGRAM_INDEX_TYPES))
+            )
+        options = dict(options or {})
+        if "probability" not in options and "size" not in options:
+            options["probability"] = DEFAULT_TRIGRAM_PROBABILITY
+        result[column] = options
+    return result
+
+
+def trigram_index_aggregate(column: str, condition: Optional[Composable] = None) -> Composed:
+    """
+    Get an aggregate that collects the distinct values of a column that the trigram index
+    is built from, so that it can be computed in the same query as other aggregates on
+    the object's rows.
+
+    :param column: Column name
+    :param condition: Optional, only aggregate rows matching this condition.
+    :return: SQL expression returning an array of distinct non-NULL values.
+    """
+    return (
+        SQL("array_agg(DISTINCT {0}::text) FILTER (WHERE {0} IS NOT NULL").format(
+            Identifier(column)
+        )
+        + (SQL(" AND ") + condition if condition else SQL(""))
+        + SQL(")")
+    )
+
+
+def generate_trigram_index(
+    engine: "PsycopgEngine",
+    object_id: str,
+    changeset: Optional[Changeset],
+    column: str,
+    values: Optional[List[str]] = None,
+    **bloom_kwargs: Any
+) -> Any:
+    """
+    Generates the trigram index for a given column and a given fragment.
+
+    :param engine: Object engine the fragment is cached in.
+    :param object_id: Fragment ID
+    :param changeset: Optional, if specified, the old column values are included in the index.
+    :param column: Column name to generate the index on.
+    :param values: Result of `trigram_index_aggregate` if it has already been computed
+        for the object's rows. If not passed, the values are queried from the object.
+    :param bloom_kwargs: Options for the filter (probability/size, hash_function), see
+        `generate_bloom_index`.
+    :return: Filter to be inserted into the index.
+    """
+    if values is None:
+        values = engine.run_sql(
+            SQL("SELECT ")
+            + trigram_index_aggregate(column)
+            + SQL(" FROM {}.{} o WHERE o.{} = true").format(
+                Identifier(SPLITGRAPH_META_SCHEMA),
+                Identifier(object_id),
+                Identifier(SG_UD_FLAG),
+            ),
+            return_shape=ResultShape.ONE_ONE,
+        )
+    values = list(values or [])
+    if changeset:
+        values.extend(
+            str(old_row[column])
+            for _, old_row, _ in changeset.values()
+            if old_row.get(column) is not None
+        )
+
+    trigrams: Set[str] = set()
+    for value in values:
+        trigrams.update(_get_trigrams(value))
+    logging.debug("Building trigram index on column %s from %d trigram(s)", column, len(trigrams))
+    return build_bloom_filter(sorted(trigrams), **bloom_kwargs)
+
+
+def _prepare_trigram_quals(
+    quals: Any, column_types: Dict[str, str]
+) -> List[List[Tuple[str, List[Tuple[Tuple[int, int], Optional[Tuple[int, int]]]]]]]:
+    """
+    Convert a list of qualifiers in CNF into a list of OR-clauses of (column, hashes of
+    trigrams that a value has to contain) that can be checked against the trigram index.
+    OR-clauses with any qualifier that the index can't evaluate (not a LIKE/ILIKE on
+    a text column or a pattern without any trigrams, e.g. `%a%`) are dropped.
+
+    :param quals: Quals in CNF
+    :param column_types: Dictionary of column names and their types (without type modifiers)
+    :return: List of OR-clauses
+    """
+    result = []
+    for or_quals in quals:
+        clause = []
+        for column, operator, value in or_quals:
+            if (
+                operator not in _LIKE_OPERATORS
+                or column_types.get(column) not in _TRIGRAM_INDEX_TYPES
+                or not isinstance(value, str)
+            ):
+                break
+            trigrams = _get_pattern_trigrams(value, _LIKE_OPERATORS[operator])
+            if not trigrams:
+                break
+            clause.append((column, [_hash_trigram(t) for t in sorted(trigrams)]))
+        else:
+            result.append(clause)
+    return result
+
+
+def _filter_objects(
+    object_ids: List[str],
+    quals: List[List[Tuple[str, List[Tuple[Tuple[int, int], Optional[Tuple[int, int]]]]]]],
+    trigram_index: Dict[str, Dict[str, Tuple[int, bytes, int]]],
+) -> List[str]:
+    def _match_qual(column, hashes, object_index):
+        return all(_match((column, h[0], h[1]), object_index) for h in hashes)
+
+    return [
+        o
+        for o in object_ids
+        if o not in trigram_index
+        or all(
+            any(_match_qual(column, hashes, trigram_index[o]) for column, hashes in or_quals)
+            for or_quals in quals
+        )
+    ]
+
+
+def filter_trigram_index(
+    engine: "PsycopgEngine", object_ids: List[str], quals: Any, column_types: Dict[str, str]
+) -> List[str]:
+    """
+    Discard objects that can't match LIKE/ILIKE qualifiers using their trigram indexes.
+
+    :param engine: Metadata engine
+    :param object_ids: Object IDs
+    :param quals: List of qualifiers in CNF
+    :param column_types: Dictionary of column names and their types
+    :return: List of object IDs that might match the qualifiers in `quals` (including
+        IDs that don't have a trigram index).
+    """
+    if not object_ids:
+        return object_ids
+
+    trigram_quals = _prepare_trigram_quals(
+        quals, {c: _strip_type_mod(t) for c, t in column_types.items()}
+    )
+    if not trigram_quals:
+        return object_ids
+
+    trigram_index = engine.run_sql(
+        SQL(
+            "SELECT object_id, index -> 'trigram' FROM {}.{} WHERE object_id IN ("
+            + ",".join(itertools.repeat("%s", len(object_ids)))
+            + ")"
+        ).format(Identifier(SPLITGRAPH_META_SCHEMA), Identifier("objects")),
+        object_ids,
+    )
+    return _filter_objects(
+        object_ids,
+        trigram_quals,
+        {
+            o: {col: decode_bloom_filter(i) for col, i in index.items()}
+            for o, index in trigram_index
+            if index
+        },
+    )
+
+
+def filter_trigram_index_in_memory(
+    indexes: Dict[str, "ObjectIndex"],
+    object_ids: List[str],
+    quals: Any,
+    column_types: Dict[str, str],
+) -> List[str]:
+    """
+    Same as `filter_trigram_index`, but uses decoded object indexes (see
+    `splitgraph.core.indexing.cache`) instead of loading them from the engine.
+
+    :param indexes: Dictionary of object ID -> decoded index
+    :param object_ids: Object IDs
+    :param quals: List of qualifiers in CNF
+    :param column_types: Dictionary of column names and their types
+    :return: List of object IDs that might match the qualifiers in `quals` (including
+        IDs that don't have a trigram index).
+    """
+    if not object_ids:
+        return object_ids
+
+    trigram_quals = _prepare_trigram_quals(
+        quals, {c: _strip_type_mod(t) for c, t in column_types.items()}
+    )
+    if not trigram_quals:
+        return object_ids
+
+    return _filter_objects(
+        object_ids,
+        trigram_quals,
+        {o: indexes[o].trigram for o in object_ids if o in indexes and indexes[o].trigram},
+    )
@@ -9,6 +9,7 @@ from psycopg2.extras import Json
 from psycopg2.sql import SQL, Identifier
 
 from splitgraph.config import SPLITGRAPH_API_SCHEMA, SPLITGRAPH_META_SCHEMA
+from splitgraph.core.indexing.cache import invalidate_index_cache
 from splitgraph.core.types import TableSchema
 from splitgraph.engine import ResultShape
 from splitgraph.engine.postgres.engine import API_MAX_VARIADIC_ARGS, chunk
@@ -80,6 +81,8 @@ class MetadataManager:
             ).format(Identifier(SPLITGRAPH_API_SCHEMA)),
             object_meta,
         )
+        # Objects might have been reindexed: make sure we don't use their old index.
+        invalidate_index_cache([o.object_id for o in objects])
 
     def register_tables(
         self, repository: "Repository", table_meta: List[Tuple[str, str, TableSchema, List[str]]]
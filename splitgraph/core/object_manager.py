@@ -3,10 +3,12 @@ import itertools
 import logging
 import math
 from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
 from contextlib import contextmanager
 from datetime import datetime as dt
 from typing import (
     Any,
+    Callable,
     Dict,
     Iterator,
     List,
@@ -17,6 +19,7 @@ from typing import (
     cast,
     DefaultDict,
     Sequence,
+    Set,
 )
 
 from psycopg2.sql import SQL, Identifier
@@ -25,6 +28,7 @@ from splitgraph.config import SPLITGRAPH_META_SCHEMA, CONFIG, get_singleton
 from splitgraph.core.fragment_manager import FragmentManager
 from splitgraph.core.types import Quals
 from splitgraph.engine import ResultShape, switch_engine
+from splitgraph.engine.postgres.engine import PostgresEngine
 from splitgraph.exceptions import (
     SplitGraphError,
     ObjectCacheError,
@@ -38,7 +42,21 @@ from .sql import select, insert
 
 if TYPE_CHECKING:
     from splitgraph.core.table import Table
-    from splitgraph.engine.postgres.engine import PsycopgEngine, PostgresEngine
+    from splitgraph.engine.postgres.engine import PsycopgEngine
+
+
+class ObjectReleaseCallback(CallbackList):
+    """
+    Callback returned by `ObjectManager.ensure_objects` that releases the claimed objects.
+    Some objects can be released early with `release_objects`, so that they can be
+    evicted before the caller is done with the rest of them.
+    """
+
+    def __init__(
+        self, callbacks: List[Callable[..., None]], release_objects: Callable[[List[str]], None]
+    ) -> None:
+        super().__init__(callbacks)
+        self.release_objects = release_objects
 
 
 class ObjectManager(FragmentManager):
@@ -146,7 +164,7 @@ class ObjectManager(FragmentManager):
         defer_release: bool = False,
         tracer: Optional[Tracer] = None,
         upstream_manager: Optional["ObjectManager"] = None,
-    ) -> Iterator[Union[List[str], Tuple[List[str], CallbackList]]]:
+    ) -> Iterator[Union[List[str], Tuple[List[str], ObjectReleaseCallback]]]:
         """
         Resolves the objects needed to materialize a given table and makes sure they are in the local
         splitgraph_meta schema.
@@ -273,6 +291,108 @@ class ObjectManager(FragmentManager):
             if not defer_release:
                 release_callback()
 
+    def ensure_objects_lazily(
+        self,
+        table: "Table",
+        batches: List[List[str]],
+        prefetch: int,
+        tracer: Optional[Tracer] = None,
+    ) -> Tuple[Iterator[Callable[..., None]], CallbackList]:
+        """
+        Lazy version of `ensure_objects` for callers that go through the objects in a known order
+        (like layered querying scans). Batches of objects are claimed and downloaded in a
+        background thread when the caller reaches them, with up to `prefetch` objects being
+        downloaded ahead of the batch that the caller is using.
+
+        :param table: Table the objects belong to.
+        :param batches: Batches of objects in the order that the caller will use them in.
+        :param prefetch: Maximum number of objects to download ahead of the current batch.
+        :param tracer: Tracer to log the timings to.
+        :return: A generator of callbacks, one per batch, that returns once the batch's objects
+            are ready. The caller calls the batch's callback when it doesn't need the objects
+            any more. The second returned callback has to be called when the caller is done:
+            it releases all objects that have been claimed and not released yet (including
+            objects in batches that the caller hasn't reached).
+        """
+        tracer = tracer or Tracer()
+
+        # Download the objects using a separate engine: downloads run close_others() on the
+        # object engine when they finish, which would close the caller's connection.
+        manager = self._get_prefetch_manager()
+        upstream_manager = None
+        if self.metadata_engine == self.object_engine and table.repository.upstream:
+            upstream_manager = table.repository.upstream.objects
+
+        executor = ThreadPoolExecutor(max_workers=1)
+        futures: List["Future[ObjectReleaseCallback]"] = []
+
+        def _claim(batch: List[str]) -> ObjectReleaseCallback:
+            with manager.ensure_objects(
+                table,
+                objects=batch,
+                defer_release=True,
+                tracer=tracer,
+                upstream_manager=upstream_manager,
+            ) as eo_result:
+                return cast(Tuple[List[str], ObjectReleaseCallback], eo_result)[1]
+
+        def _batch_callbacks() -> Iterator[Callable[..., None]]:
+            submitted = 0
+            # Number of objects in batches after the current one that have been submitted
+            ahead = 0
+            for batch_no, batch in enumerate(batches):
+                if batch_no < submitted:
+                    ahead -= len(batch)
+                while submitted < len(batches) and (
+                    submitted <= batch_no or ahead + len(batches[submitted]) <= prefetch
+                ):
+                    if submitted > batch_no:
+                        ahead += len(batches[submitted])
+                    futures.append(executor.submit(_claim, batches[submitted]))
+                    submitted += 1
+                yield futures[batch_no].result()
+
+        def _release_all(**kwargs) -> None:
+            for future in futures:
+                try:
+                    release_callback = future.result()
+                except Exception:
+                    # ensure_objects cleans up after batches that failed to download.
+                    logging.debug("Failed to prefetch objects", exc_info=True)
+                    continue
+                release_callback()
+            futures.clear()
+            executor.shutdown()
+            if manager is self:
+                manager.object_engine.close_others()
+            else:
+                # The prefetch engine is only used by this scan: close its connection pool.
+                manager.object_engine.close_all()
+
+        return _batch_callbacks(), CallbackList([_release_all])
+
+    def _get_prefetch_manager(self) -> "ObjectManager":
+        """Get an object manager with a copy of the object engine that has its own connection
+        pool. The caller has to close it (`PsycopgEngine.close_all`) when it's done with it."""
+        engine = self.object_engine
+        if not isinstance(engine, PostgresEngine) or not hasattr(engine, "conn_params"):
+            # Can't make a copy of an engine with a custom connection pool.
+            return self
+
+        object_engine = PostgresEngine(
+            name=engine.name,
+            conn_params=engine.conn_params,
+            registry=engine.registry,
+            in_fdw=engine.in_fdw,
+            check_version=False,
+        )
+        metadata_engine = (
+            object_engine
+            if self.metadata_engine == self.object_engine
+            else cast(PostgresEngine, self.metadata_engine)
+        )
+        return type(self)(object_engine, metadata_engine)
+
     def _generate_download_error(self, table, difference, cause=None):
         if table:
             error = "Not all objects required for %s:%s:%s have been fetched. Missing %s (%s)" % (
@@ -295,8 +415,20 @@ class ObjectManager(FragmentManager):
 
     def _make_release_callback(
         self, required_objects: List[str], table: Optional["Table"], tracer: Tracer
-    ) -> CallbackList:
+    ) -> ObjectReleaseCallback:
         called = False
+        released: Set[str] = set()
+
+        def _release_early(objects: List[str]) -> None:
+            to_release = [
+                o for o in set(objects).intersection(required_objects) if o not in released
+            ]
+            if called or not to_release:
+                return
+            released.update(to_release)
+            logging.debug("Releasing %s early", pluralise("object", len(to_release)))
+            self._release_objects(to_release)
+            self.object_engine.commit()
 
         def _f(**kwargs):
             nonlocal called
@@ -309,7 +441,7 @@ class ObjectManager(FragmentManager):
             # garbage collected).
             tracer.log("caller")
             self.object_engine.run_sql("SET LOCAL synchronous_commit TO off")
-            self._release_objects(required_objects)
+            self._release_objects([o for o in required_objects if o not in released])
             tracer.log("release_objects")
             logging.debug("Releasing %s", pluralise("object", len(required_objects)))
             if table:
@@ -325,7 +457,7 @@ class ObjectManager(FragmentManager):
             # Release the metadata tables as well
             self.metadata_engine.commit()
 
-        return CallbackList([_f])
+        return ObjectReleaseCallback([_f], _release_early)
 
     def make_objects_external(
         self, objects: List[str], handler: str, handler_params: Dict[Any, Any]
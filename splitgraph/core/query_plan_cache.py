@@ -0,0 +1,153 @@
+"""
+Layered querying plan cache shared between all sessions on an engine.
+"""
+
+import json
+import logging
+from datetime import datetime as dt
+from hashlib import sha256
+from typing import Any, Dict, Optional, Sequence, TYPE_CHECKING, Tuple, cast
+
+from psycopg2.extras import Json
+from psycopg2.sql import SQL, Identifier
+
+from splitgraph.config import SPLITGRAPH_META_SCHEMA, CONFIG, get_singleton
+from splitgraph.core.sql import select, insert
+from splitgraph.core.types import Quals
+from splitgraph.engine import ResultShape
+
+if TYPE_CHECKING:
+    from splitgraph.core.table import Table
+    from splitgraph.engine.postgres.engine import PsycopgEngine
+
+_CACHE_TABLE = "query_plan_cache"
+_HITS_SEQUENCE = "query_plan_cache_hits"
+_MISSES_SEQUENCE = "query_plan_cache_misses"
+
+
+def get_plan_key(table: "Table", quals: Optional[Quals], columns: Sequence[str]) -> str:
+    """
+    Get the key that a query plan is stored under in the cache. Since images are immutable,
+    the plan for the same table, qualifiers and columns never changes.
+    """
+    key = [
+        table.repository.namespace,
+        table.repository.repository,
+        table.image.image_hash,
+        table.table_name,
+        quals,
+        list(columns),
+    ]
+    return sha256(json.dumps(key, default=str).encode("utf-8")).hexdigest()
+
+
+class QueryPlanCache:
+    """
+    Stores query plans (which fragments a query has to scan and how they're grouped) in the
+    metadata engine so that they can be reused by other sessions (e.g. every layered querying
+    foreign table scan runs in a new Python interpreter that doesn't have the plan in memory).
+
+    The cache keeps up to `size` plans, evicting the least recently used ones.
+    """
+
+    def __init__(self, metadata_engine: "PsycopgEngine", size: int) -> None:
+        self.metadata_engine = metadata_engine
+        self.size = size
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Get a plan from the cache, recording a cache hit or a miss.
+
+        :param key: Plan key (see `get_plan_key`)
+        :return: Plan contents or None if the plan isn't in the cache.
+        """
+        plan = self.metadata_engine.run_sql(
+            select(_CACHE_TABLE, "plan", "plan_key = %s"), (key,), return_shape=ResultShape.ONE_ONE
+        )
+        self._increment(_HITS_SEQUENCE if plan is not None else _MISSES_SEQUENCE)
+        if plan is None:
+            return None
+
+        # Bump the plan's last used timestamp, skipping it if another session is already
+        # doing that (we don't care about precise timestamps and don't want to block).
+        self.metadata_engine.run_sql(
+            SQL(
+                "UPDATE {0}.{1} SET hits = hits + 1, last_used = %s WHERE plan_key IN "
+                "(SELECT plan_key FROM {0}.{1} WHERE plan_key = %s FOR UPDATE SKIP LOCKED)"
+            ).format(Identifier(SPLITGRAPH_META_SCHEMA), Identifier(_CACHE_TABLE)),
+            (dt.utcnow(), key),
+        )
+        return cast(Dict[str, Any], plan)
+
+    def put(self, key: str, plan: Dict[str, Any]) -> None:
+        """
+        Store a plan in the cache, evicting the least recently used plans if the cache is full.
+        This commits the metadata engine so that other sessions can see the plan.
+
+        :param key: Plan key (see `get_plan_key`)
+        :param plan: Plan contents (must be JSON-serializable)
+        """
+        self.metadata_engine.run_sql(
+            insert(_CACHE_TABLE, ("plan_key", "plan", "last_used"))
+            + SQL(" ON CONFLICT (plan_key) DO NOTHING"),
+            (key, Json(plan), dt.utcnow()),
+        )
+        evicted = self.metadata_engine.run_sql(
+            SQL(
+                "DELETE FROM {0}.{1} WHERE plan_key IN "
+                "(SELECT plan_key FROM {0}.{1} ORDER BY last_used DESC OFFSET %s "
+                "FOR UPDATE SKIP LOCKED) RETURNING plan_key"
+            ).format(Identifier(SPLITGRAPH_META_SCHEMA), Identifier(_CACHE_TABLE)),
+            (self.size,),
+            return_shape=ResultShape.MANY_ONE,
+        )
+        if evicted:
+            logging.debug("Evicted %d query plan(s) from the cache", len(evicted))
+        self.metadata_engine.commit()
+
+    def get_stats(self) -> Tuple[int, int, int]:
+        """
+        :return: Number of cache hits, cache misses and plans currently in the cache.
+        """
+        hits, misses = (
+            self.metadata_engine.run_sql(
+                SQL("SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM {}.{}").format(
+                    Identifier(SPLITGRAPH_META_SCHEMA), Identifier(sequence)
+                ),
+                return_shape=ResultShape.ONE_ONE,
+            )
+            for sequence in (_HITS_SEQUENCE, _MISSES_SEQUENCE)
+        )
+        entries = self.metadata_engine.run_sql(
+            select(_CACHE_TABLE, "COUNT(1)"), return_shape=ResultShape.ONE_ONE
+        )
+        return int(hits), int(misses), int(entries)
+
+    def clear(self) -> None:
+        """Delete all plans from the cache and reset the hit/miss counters."""
+        self.metadata_engine.run_sql(
+            SQL("DELETE FROM {}.{}").format(
+                Identifier(SPLITGRAPH_META_SCHEMA), Identifier(_CACHE_TABLE)
+            )
+        )
+        for sequence in (_HITS_SEQUENCE, _MISSES_SEQUENCE):
+            self.metadata_engine.run_sql(
+                SQL("SELECT setval(%s, 1, false)"),
+                (SPLITGRAPH_META_SCHEMA + "." + sequence,),
+            )
+
+    def _increment(self, sequence: str) -> None:
+        self.metadata_engine.run_sql(
+            SQL("SELECT nextval(%s)"), (SPLITGRAPH_META_SCHEMA + "." + sequence,)
+        )
+
+
+def get_plan_cache(metadata_engine: "PsycopgEngine") -> Optional[QueryPlanCache]:
+    """
+    :return: Shared query plan cache on the metadata engine or None if it's disabled
+        (SG_LQ_PLAN_CACHE_SIZE isn't set).
+    """
+    size = get_singleton(CONFIG, "SG_LQ_PLAN_CACHE_SIZE")
+    if not size or int(size) <= 0:
+        return None
+    return QueryPlanCache(metadata_engine, int(size))
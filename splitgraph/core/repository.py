@@ -7,9 +7,10 @@ import logging
 import re
 from contextlib import contextmanager
 from datetime import datetime
+from functools import partial
 from io import TextIOWrapper
 from random import getrandbits
-from typing import Any, Dict, Iterator, List, Optional, Tuple, Union, Set, Sequence, cast
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union, Set, Sequence, cast
 
 from psycopg2.sql import Composed
 from psycopg2.sql import SQL, Identifier
@@ -44,6 +45,7 @@ from .common import (
     set_tags_batch,
     get_temporary_table_id,
 )
+from .diff import fragment_diff
 from .output import pluralise
 from .engine import lookup_repository, get_engine
 from .object_manager import ObjectManager
@@ -408,6 +410,8 @@ class Repository:
         extra_indexes: Optional[Dict[str, ExtraIndexInfo]] = None,
         in_fragment_order: Optional[Dict[str, List[str]]] = None,
         overwrite: bool = False,
+        chunk_workers: Optional[int] = None,
+        table_workers: Optional[int] = None,
     ) -> Image:
         """
         Commits all pending changes to a given repository, creating a new image.
@@ -430,6 +434,11 @@ class Repository:
         :param in_fragment_order: Dictionary of {table: list of columns}. If specified, will
         sort the data inside each chunk by this/these key(s) for each table.
         :param overwrite: If an object already exists, will force recreate it.
+        :param chunk_workers: Number of engine connections to use to store the chunks of
+            tables that are stored as snapshots in parallel.
+        :param table_workers: Number of engine connections to use to store different tables
+            in parallel. The new image and its tables are still registered in a single transaction
+            once all tables have been stored.
 
         :return: The newly created Image object.
         """
@@ -454,6 +463,8 @@ class Repository:
             extra_indexes=extra_indexes,
             in_fragment_order=in_fragment_order,
             overwrite=overwrite,
+            chunk_workers=chunk_workers,
+            table_workers=table_workers,
         )
 
         set_head(self, image_hash)
@@ -472,6 +483,8 @@ class Repository:
         extra_indexes: Optional[Dict[str, ExtraIndexInfo]] = None,
         in_fragment_order: Optional[Dict[str, List[str]]] = None,
         overwrite: bool = False,
+        chunk_workers: Optional[int] = None,
+        table_workers: Optional[int] = None,
     ) -> None:
         """
         Reads the recorded pending changes to all tables in a given checked-out image,
@@ -481,6 +494,10 @@ class Repository:
             * If a table hasn't changed since the last revision, no new objects are created and it's linked to the
                 previous objects belonging to the last revision.
             * Otherwise, the table is stored as a conflated (1 change per PK) patch.
+
+        If `table_workers` is specified, tables are stored in parallel on separate connections to
+        the engine (see `FragmentManager.record_tables_parallel`), which requires the schema
+        and the pending changes to be committed.
         """
         schema = schema or self.to_schema()
         extra_indexes: Dict[str, ExtraIndexInfo] = extra_indexes or {}
@@ -490,6 +507,7 @@ class Repository:
         changed_tables = self.object_engine.get_changed_tables(schema)
         tracked_tables = self.object_engine.get_tracked_tables()
 
+        table_tasks: List[Callable[[], Any]] = []
         for table in self.object_engine.get_all_tables(schema):
             if self.object_engine.get_table_type(schema, table) == "VIEW":
                 logging.warning(
@@ -515,29 +533,36 @@ class Repository:
                 or not _schema_compatible(table_info.table_schema, new_schema)
                 or (schema, table) not in tracked_tables
             ):
-                self.objects.record_table_as_base(
-                    self,
-                    table,
-                    image_hash,
-                    chunk_size=chunk_size,
-                    source_schema=schema,
-                    extra_indexes=extra_indexes.get(table),
-                    in_fragment_order=in_fragment_order.get(table),
-                    overwrite=overwrite,
+                table_tasks.append(
+                    partial(
+                        self.objects.record_table_as_base,
+                        self,
+                        table,
+                        image_hash,
+                        chunk_size=chunk_size,
+                        source_schema=schema,
+                        extra_indexes=extra_indexes.get(table),
+                        in_fragment_order=in_fragment_order.get(table),
+                        overwrite=overwrite,
+                        chunk_workers=chunk_workers,
+                    )
                 )
                 continue
 
             # If the table has changed, look at the audit log and store it as a delta.
             if table in changed_tables:
-                self.objects.record_table_as_patch(
-                    table_info,
-                    schema,
-                    image_hash,
-                    new_schema_spec=new_schema,
-                    split_changeset=split_changeset,
-                    extra_indexes=extra_indexes.get(table),
-                    in_fragment_order=in_fragment_order.get(table),
-                    overwrite=overwrite,
+                table_tasks.append(
+                    partial(
+                        self.objects.record_table_as_patch,
+                        table_info,
+                        schema,
+                        image_hash,
+                        new_schema_spec=new_schema,
+                        split_changeset=split_changeset,
+                        extra_indexes=extra_indexes.get(table),
+                        in_fragment_order=in_fragment_order.get(table),
+                        overwrite=overwrite,
+                    )
                 )
                 continue
 
@@ -546,6 +571,12 @@ class Repository:
                 self, [(image_hash, table, new_schema, table_info.objects)]
             )
 
+        if table_workers and table_workers > 1 and len(table_tasks) > 1:
+            self.objects.record_tables_parallel(table_tasks, table_workers)
+        else:
+            for task in table_tasks:
+                task()
+
         # Make sure that all pending changes have been discarded by this point (e.g. if we created just a snapshot for
         # some tables and didn't consume the audit log).
         # NB if we allow partial commits, this will have to be changed (only discard for committed tables).
@@ -1015,8 +1046,10 @@ class Repository:
         aggregate: bool = False,
     ) -> Union[bool, Tuple[int, int, int], List[Tuple[bool, Tuple]], None]:
         """
-        Compares the state of a table in different images by materializing both tables into a temporary space
-        and comparing them row-to-row.
+        Compares the state of a table in different images. If the table has a primary key and the same schema
+        in both images, only the rows in fragments that aren't shared by the two images are compared
+        (see `splitgraph.core.diff.fragment_diff`). Otherwise, both tables are materialized into a temporary
+        space and compared row-to-row.
 
         :param table_name: Name of the table.
         :param image_1: First image hash / object. If None, uses the state of the current staging area.
@@ -1071,8 +1104,15 @@ class Repository:
             ):
                 return [] if not aggregate else (0, 0, 0)
 
+        # Compare only the fragments that differ between the two tables.
+        if image_2 is not None:
+            result = fragment_diff(
+                image_1.get_table(table_name), image_2.get_table(table_name), aggregate
+            )
+            if result is not None:
+                return result
+
         # Materialize both tables and compare them side-by-side.
-        # TODO we can aggregate chunks in a similar way that LQ does it.
         return slow_diff(self, table_name, _hash(image_1), _hash(image_2), aggregate)
 
 
@@ -1,12 +1,17 @@
 """Table metadata-related classes."""
+
 import itertools
 import logging
 import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
 from contextlib import contextmanager
+from decimal import Decimal
+from functools import partial
 from math import ceil
 from typing import (
     Any,
     Callable,
+    Iterable,
     Iterator,
     List,
     Optional,
@@ -17,17 +22,24 @@ from typing import (
     cast,
 )
 
-from psycopg2.sql import SQL, Identifier, Composable
+from psycopg2.sql import SQL, Identifier, Composable, Composed
 from tqdm import tqdm
 
-from splitgraph.config import SPLITGRAPH_META_SCHEMA, SPLITGRAPH_API_SCHEMA, SG_CMD_ASCII
-from splitgraph.core.common import Tracer, get_temporary_table_id
+from splitgraph.config import (
+    SPLITGRAPH_META_SCHEMA,
+    SPLITGRAPH_API_SCHEMA,
+    SG_CMD_ASCII,
+    CONFIG,
+    get_singleton,
+)
+from splitgraph.core.common import CallbackList, Tracer, get_temporary_table_id
 from splitgraph.core.fragment_manager import (
     get_chunk_groups,
     ExtraIndexInfo,
 )
-from splitgraph.core.indexing.range import quals_to_sql
-from splitgraph.core.output import pluralise, truncate_list
+from splitgraph.core.indexing.range import quals_to_sql, _strip_type_mod
+from splitgraph.core.output import pluralise, truncate_list, parse_dt, parse_date
+from splitgraph.core.query_plan_cache import get_plan_cache, get_plan_key
 from splitgraph.core.sql import select
 from splitgraph.core.types import TableSchema, Quals
 from splitgraph.engine import ResultShape
@@ -43,6 +55,23 @@ if TYPE_CHECKING:
 # of initializing a batch of object applications and not reporting anything at all
 _PROGRESS_EVERY = 5 * 1024 * 1024
 
+# Primary key types whose values in the object index sort the same way as they do in Postgres
+# (so that we can order fragments by their PK ranges without querying them).
+_SORTABLE_PK_TYPES = [
+    "bigint",
+    "bigserial",
+    "date",
+    "double precision",
+    "integer",
+    "numeric",
+    "real",
+    "serial",
+    "smallint",
+    "smallserial",
+    "timestamp",
+    "timestamp without time zone",
+]
+
 
 def _generate_select_query(
     engine: "PostgresEngine",
@@ -50,19 +79,140 @@ def _generate_select_query(
     columns: Sequence[str],
     qual_sql: Optional[Composable] = None,
     qual_args: Optional[Tuple] = None,
+    order_by: Optional[List[str]] = None,
 ) -> bytes:
     cur = engine.connection.cursor()
 
+    # The table might be a subquery that's already been mogrified, so we don't pass it through
+    # mogrify again (it could contain % signs).
     query = (
-        SQL("SELECT ")
-        + SQL(",").join(Identifier(c) for c in columns)
-        + SQL(" FROM " + table.decode("utf-8"))
-        + (SQL(" WHERE ") + qual_sql if qual_args else SQL(""))
+        cur.mogrify(SQL("SELECT ") + SQL(",").join(Identifier(c) for c in columns))
+        + b" FROM "
+        + table
     )
-    query = cur.mogrify(query, qual_args)
+    if qual_args:
+        query += cur.mogrify(SQL(" WHERE ") + cast(Composable, qual_sql), qual_args)
+    if order_by:
+        query += cur.mogrify(SQL(" ORDER BY ") + SQL(",").join(Identifier(c) for c in order_by))
 
     cur.close()
-    return cast(bytes, query)
+    return query
+
+
+def _generate_merge_query(
+    engine: "PostgresEngine",
+    objects: List[str],
+    table_schema: TableSchema,
+    qual_sql: Optional[Composable] = None,
+    qual_args: Optional[Tuple] = None,
+) -> bytes:
+    cur = engine.connection.cursor()
+    query = cur.mogrify(
+        SQL("(")
+        + engine.generate_merge_query(
+            [(SPLITGRAPH_META_SCHEMA, o) for o in objects],
+            table_schema,
+            cast(Composed, qual_sql) if qual_args else None,
+        )
+        + SQL(") AS {}").format(Identifier("sg_merged")),
+        qual_args,
+    )
+    cur.close()
+    return query
+
+
+def _run_select_query(engine: "PostgresEngine", query: bytes) -> List[Tuple]:
+    # Run in a worker thread: make sure to release the thread's connection when done.
+    try:
+        result = cast(List[Tuple], engine.run_sql(query))
+        engine.commit()
+        return result
+    except Exception:
+        engine.rollback()
+        raise
+
+
+def scan_tables_parallel(
+    engine: "PostgresEngine",
+    tables: List[bytes],
+    columns: Sequence[str],
+    workers: int,
+    qual_sql: Optional[Composable] = None,
+    qual_args: Optional[Tuple] = None,
+    ordered: bool = True,
+) -> Iterator[List[Tuple]]:
+    """
+    Query multiple tables concurrently, each one on a separate connection to the engine.
+
+    :param engine: Engine the tables live on
+    :param tables: List of (mogrified) table names or subqueries to read from
+    :param columns: Columns to fetch
+    :param workers: Maximum number of tables to query at the same time. Capped by the size
+        of the engine's connection pool (SG_ENGINE_POOL).
+    :param qual_sql: Optional, SQL (Composable) clause to filter the results on
+    :param qual_args: Optional, a tuple of arguments to use with `qual_sql`
+    :param ordered: If True, return the results in the same order as the tables. Otherwise,
+        return results from every table as soon as they're ready.
+    :return: Generator of lists of rows, one for every table.
+    """
+    workers = max(min(workers, int(get_singleton(CONFIG, "SG_ENGINE_POOL")) - 1), 1)
+    queries = iter(
+        [_generate_select_query(engine, t, columns, qual_sql, qual_args) for t in tables]
+    )
+    logging.info("Scanning %s using %d workers", pluralise("table", len(tables)), workers)
+
+    # Only keep a limited number of results in flight so that we don't have to hold all of them
+    # in memory if the caller is slow to consume them.
+    pending: List[Future] = []
+    with ThreadPoolExecutor(max_workers=workers) as tpe:
+        try:
+            while True:
+                for query in itertools.islice(queries, workers * 2 - len(pending)):
+                    pending.append(tpe.submit(_run_select_query, engine, query))
+                if not pending:
+                    return
+                if ordered:
+                    future = pending[0]
+                else:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    future = next(f for f in pending if f in done)
+                pending.remove(future)
+                yield future.result()
+        finally:
+            # The caller might have stopped early: don't run the queries that haven't started yet.
+            for future in pending:
+                future.cancel()
+
+
+def scan_tables(
+    engine: "PostgresEngine",
+    tables: Iterable[bytes],
+    columns: Sequence[str],
+    qual_sql: Optional[Composable] = None,
+    qual_args: Optional[Tuple] = None,
+    order_by: Optional[List[str]] = None,
+) -> Iterator[Tuple]:
+    """
+    Query multiple tables one after another, streaming the rows through a server-side cursor
+    so that whole tables don't have to be loaded into memory.
+
+    :param engine: Engine the tables live on
+    :param tables: Iterable of (mogrified) table names or subqueries to read from
+    :param columns: Columns to fetch
+    :param qual_sql: Optional, SQL (Composable) clause to filter the results on
+    :param qual_args: Optional, a tuple of arguments to use with `qual_sql`
+    :param order_by: Optional, columns to sort the results from every table by
+    :return: Generator of rows
+    """
+    for table in tables:
+        yield from engine.run_sql_stream(
+            _generate_select_query(engine, table, columns, qual_sql, qual_args, order_by)
+        )
+
+
+def _get_scan_workers() -> int:
+    workers = get_singleton(CONFIG, "SG_LQ_PARALLEL_SCANS")
+    return int(workers) if workers else 1
 
 
 def _generate_table_names(engine: "PostgresEngine", schema: str, tables: List[str]) -> List[bytes]:
@@ -100,13 +250,36 @@ def _empty_callback(**kwargs) -> None:
     pass
 
 
+def _merge_on_read_enabled() -> bool:
+    return get_singleton(CONFIG, "SG_MERGE_ON_READ").lower() == "true"
+
+
+def _can_merge_on_read(table_schema: TableSchema) -> bool:
+    # Merging fragments keeps one version of every row with a given PK. Tables without a PK
+    # are keyed on all of their columns, so merging them would also collapse duplicate rows.
+    return any(c.is_pk for c in table_schema)
+
+
 class QueryPlan:
     """
     Represents the initial query plan (fragments to query) for given columns and
     qualifiers.
     """
 
-    def __init__(self, table: "Table", quals: Optional[Quals], columns: Sequence[str]) -> None:
+    def __init__(
+        self,
+        table: "Table",
+        quals: Optional[Quals],
+        columns: Sequence[str],
+        cached: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """
+        :param table: Table to query
+        :param quals: Qualifiers in CNF form
+        :param columns: List of columns
+        :param cached: If set, skip filtering and grouping the fragments and use the results
+            from a plan cached with `to_cache()` instead.
+        """
         self.table = table
         self.quals = quals
         self.columns = columns
@@ -116,32 +289,44 @@ class QueryPlan:
 
         self.required_objects = table.objects
         self.tracer.log("resolve_objects")
-        self.filtered_objects = self.object_manager.filter_fragments(
-            self.required_objects, table, quals
-        )
-        # Estimate the number of rows in the filtered objects
-        self.estimated_rows = sum(
-            [
-                o.rows_inserted - o.rows_deleted
-                for o in self.object_manager.get_object_meta(self.filtered_objects).values()
-            ]
-        )
+        if cached:
+            self.filtered_objects = cached["filtered_objects"]
+            self.estimated_rows = cached["estimated_rows"]
+        else:
+            self.filtered_objects = self.object_manager.filter_fragments(
+                self.required_objects, table, quals
+            )
+            # Estimate the number of rows in the filtered objects
+            self.estimated_rows = sum(
+                [
+                    o.rows_inserted - o.rows_deleted
+                    for o in self.object_manager.get_object_meta(self.filtered_objects).values()
+                ]
+            )
         self.tracer.log("filter_objects")
 
         # Prepare a list of objects to query
 
         # Special fast case: single-chunk groups can all be batched together
         # and queried directly without having to copy them to a staging table.
-        # We also grab all fragments from multiple-fragment groups and batch them together
-        # for future application.
-        #
-        # Technically, we could do multiple batches of application for these groups
-        # (apply first batch to the staging table, extract the result, clean the table,
-        # apply next batch etc): in the middle of it we could also talk back to the object
-        # manager and release the objects that we don't need so that they can be garbage
-        # collected. The tradeoff is that we perform more calls to apply_fragments (hence
-        # more roundtrips).
-        self.non_singletons, self.singletons = self._extract_singleton_fragments()
+        # Fragments from multiple-fragment groups have to be applied to a staging table
+        # first: this is done one group at a time (apply the first group to the staging
+        # table, extract the result, clean the table, apply the next group etc), releasing
+        # each group's objects once the group has been consumed. This way, the staging
+        # table is never larger than the largest group and queries that don't need all
+        # the results can stop early. The tradeoff is that we perform more calls to
+        # apply_fragments (hence more roundtrips).
+        if cached:
+            self.non_singleton_groups = cached["non_singleton_groups"]
+            self.singletons = cached["singletons"]
+            self.ordered_groups = cached["ordered_groups"]
+        else:
+            (
+                self.non_singleton_groups,
+                self.singletons,
+                self.ordered_groups,
+            ) = self._extract_singleton_fragments()
+        self.non_singletons = [o for group in self.non_singleton_groups for o in group]
 
         logging.info(
             "Fragment grouping: %d singletons, %d non-singletons",
@@ -162,7 +347,22 @@ class QueryPlan:
             self.singleton_queries = []
         self.tracer.log("generate_singleton_queries")
 
-    def _extract_singleton_fragments(self) -> Tuple[List[str], List[str]]:
+    def to_cache(self) -> Dict[str, Any]:
+        """
+        :return: Results of fragment filtering and grouping for this plan, to be stored in
+            the shared query plan cache.
+        """
+        return {
+            "filtered_objects": self.filtered_objects,
+            "estimated_rows": self.estimated_rows,
+            "non_singleton_groups": self.non_singleton_groups,
+            "singletons": self.singletons,
+            "ordered_groups": self.ordered_groups,
+        }
+
+    def _extract_singleton_fragments(
+        self,
+    ) -> Tuple[List[List[str]], List[str], List[List[str]]]:
         # Get fragment boundaries (min-max PKs of every fragment).
         table_pk = get_change_key(self.table.table_schema)
         object_pks = self.object_manager.get_min_max_pks(self.filtered_objects, table_pk)
@@ -173,14 +373,128 @@ class QueryPlan:
                 for object_id, min_max in zip(self.filtered_objects, object_pks)
             ]
         )
+        # Groups are returned in the order of their PK ranges, so we also keep them all
+        # to be able to return results sorted by PK.
         singletons: List[str] = []
-        non_singletons: List[str] = []
+        non_singleton_groups: List[List[str]] = []
+        ordered_groups: List[List[str]] = []
         for group in object_groups:
+            ordered_groups.append([object_id for object_id, _, _ in group])
             if len(group) == 1:
                 singletons.append(group[0][0])
             else:
-                non_singletons.extend(object_id for object_id, _, _ in group)
-        return non_singletons, singletons
+                non_singleton_groups.append(ordered_groups[-1])
+        return non_singleton_groups, singletons, ordered_groups
+
+
+def _sort_queries(
+    plan: QueryPlan, singleton_queries: Iterator[bytes], nonsingleton_queries: Iterator[bytes]
+) -> Iterator[bytes]:
+    """
+    Interleave queries to singletons and to groups of overlapping fragments so that they're
+    returned in the order of the PK ranges they cover (both iterators are in that order already).
+    """
+    for group in plan.ordered_groups:
+        yield next(singleton_queries) if len(group) == 1 else next(nonsingleton_queries)
+
+
+# Types whose values in the range index can be converted back into the values Postgres would
+# return from MIN/MAX (text is excluded since the index compares strings in the C collation).
+_METADATA_AGGREGATE_TYPES: Dict[str, Callable[[Any], Any]] = {
+    "bigint": int,
+    "date": parse_date,
+    "double precision": float,
+    "integer": int,
+    "numeric": Decimal,
+    "real": float,
+    "smallint": int,
+    "timestamp": parse_dt,
+    "timestamp without time zone": parse_dt,
+}
+
+_AGGREGATES = ["count", "min", "max"]
+
+
+def _adapt_index_value(value: Any, pg_type: str) -> Any:
+    return None if value is None else _METADATA_AGGREGATE_TYPES[pg_type](value)
+
+
+def _range_matches_all(
+    index_range: Dict[str, Any], quals: Quals, column_types: Dict[str, str]
+) -> bool:
+    """
+    Check if all rows in a fragment are guaranteed to match the qualifiers, judging from
+    its range index. Only qualifiers on non-NULL columns can be checked this way.
+
+    :param index_range: Range index of the fragment
+    :param quals: Qualifiers in CNF
+    :param column_types: Dictionary of non-NULL column names and their types
+    """
+
+    def _qual_matches_all(qual: Tuple[str, str, Any]) -> bool:
+        column, operator, value = qual
+        if column not in column_types or column not in index_range:
+            return False
+        convert = _METADATA_AGGREGATE_TYPES[column_types[column]]
+        try:
+            lower, upper = (convert(v) for v in index_range[column])
+            value = convert(value)
+        except (TypeError, ValueError, ArithmeticError):
+            # Also covers NULLs in the index (fragments with no rows)
+            return False
+        if operator == "=":
+            return bool(lower == upper == value)
+        if operator == ">":
+            return bool(lower > value)
+        if operator == ">=":
+            return bool(lower >= value)
+        if operator == "<":
+            return bool(upper < value)
+        if operator == "<=":
+            return bool(upper <= value)
+        return False
+
+    return all(any(_qual_matches_all(q) for q in clause) for clause in quals)
+
+
+def _generate_aggregate_query(
+    engine: "PostgresEngine",
+    table: bytes,
+    aggregates: List[Tuple[str, Optional[str]]],
+    qual_sql: Optional[Composable] = None,
+    qual_args: Optional[Tuple] = None,
+) -> bytes:
+    cur = engine.connection.cursor()
+    query = (
+        cur.mogrify(
+            SQL("SELECT ")
+            + SQL(",").join(
+                SQL(function + "(") + (Identifier(column) if column else SQL("*")) + SQL(")")
+                for function, column in aggregates
+            )
+        )
+        + b" FROM "
+        + table
+    )
+    if qual_args:
+        query += cur.mogrify(SQL(" WHERE ") + cast(Composable, qual_sql), qual_args)
+    cur.close()
+    return query
+
+
+def _combine_aggregates(
+    aggregates: List[Tuple[str, Optional[str]]], results: List[Sequence[Any]]
+) -> List[Any]:
+    combined: List[Any] = []
+    for i, (function, _) in enumerate(aggregates):
+        values = [r[i] for r in results if r[i] is not None]
+        if function == "count":
+            combined.append(sum(values))
+        elif function == "min":
+            combined.append(min(values) if values else None)
+        else:
+            combined.append(max(values) if values else None)
+    return combined
 
 
 QueryPlanCacheKey = Tuple[Optional[Tuple[Tuple[Tuple[str, str, Any]]]], Tuple[str]]
@@ -261,7 +575,16 @@ class Table:
             plan.tracer.log("generate_singleton_queries")
             return plan
 
-        plan = QueryPlan(self, quals, columns)
+        # Try the plan cache shared with other sessions.
+        shared_cache = get_plan_cache(self.repository.engine) if use_cache else None
+        if shared_cache:
+            plan_key = get_plan_key(self, quals, columns)
+            cached = shared_cache.get(plan_key)
+            plan = QueryPlan(self, quals, columns, cached=cached)
+            if not cached:
+                shared_cache.put(plan_key, plan.to_cache())
+        else:
+            plan = QueryPlan(self, quals, columns)
         self._query_plans[key] = plan
         return plan
 
@@ -271,6 +594,7 @@ class Table:
         destination_schema: Optional[str] = None,
         lq_server: Optional[str] = None,
         temporary: bool = False,
+        merge_on_read: Optional[bool] = None,
     ) -> None:
         """
         Materializes a Splitgraph table in the target schema as a normal Postgres table, potentially downloading all
@@ -279,6 +603,9 @@ class Table:
         :param destination: Name of the destination table.
         :param destination_schema: Name of the destination schema.
         :param lq_server: If set, sets up a layered querying FDW for the table instead using this foreign server.
+        :param merge_on_read: If True, resolve overlapping fragments with a single query instead of
+            applying them to the table one by one. Defaults to the SG_MERGE_ON_READ setting.
+            Ignored for tables without a primary key.
         """
         # Circular import
         from splitgraph.hooks.data_source.fdw import create_foreign_table
@@ -287,6 +614,9 @@ class Table:
         engine = self.repository.object_engine
         object_manager = self.repository.objects
         engine.delete_table(destination_schema, destination)
+        if merge_on_read is None:
+            merge_on_read = _merge_on_read_enabled()
+        merge_on_read = merge_on_read and _can_merge_on_read(self.table_schema)
 
         if not lq_server:
             # Materialize by applying fragments to one another in their dependency order.
@@ -307,7 +637,7 @@ class Table:
                     table_size = self.get_size()
 
                     progress_every: Optional[int]
-                    if table_size > _PROGRESS_EVERY:
+                    if table_size > _PROGRESS_EVERY and not merge_on_read:
                         progress_every = int(
                             ceil(len(required_objects) * _PROGRESS_EVERY / float(table_size))
                         )
@@ -319,6 +649,7 @@ class Table:
                         destination_schema,
                         destination,
                         progress_every=progress_every,
+                        merge=merge_on_read,
                     )
         else:
             query, args = create_foreign_table(
@@ -331,8 +662,131 @@ class Table:
 
             engine.run_sql(query, args)
 
+    def materialize_incremental(
+        self, destination: str, previous: "Table", destination_schema: Optional[str] = None
+    ) -> bool:
+        """
+        Turn a materialized copy of a different version of this table into this version by only
+        applying the fragments that differ between the two versions. The destination table must
+        not have any changes made to it since it was materialized.
+
+        If this version's fragments are the previous version's fragments with some new fragments
+        appended to them, the new fragments are applied to the table. Otherwise, all rows with PKs
+        that appear in fragments unique to either version are replaced with their latest versions
+        from this table.
+
+        :param destination: Name of the destination table.
+        :param previous: Version of the table that's materialized in the destination table.
+        :param destination_schema: Name of the destination schema.
+        :return: True if the table was updated, False if it can't be updated incrementally
+            (e.g. because the schema has changed), in which case it's unchanged.
+        """
+        # Circular import
+        from splitgraph.core.diff import (
+            split_fragments,
+            get_fragment_ranges,
+            get_overlapping_fragments,
+            generate_changed_keys_query,
+        )
+
+        destination_schema = destination_schema or self.repository.to_schema()
+        engine = self.repository.object_engine
+        if (
+            engine.get_table_type(destination_schema, destination) != "BASE TABLE"
+            or previous.table_schema != self.table_schema
+            or engine.get_full_table_schema(destination_schema, destination) != self.table_schema
+        ):
+            return False
+
+        split = split_fragments(previous.objects, self.objects)
+        if split is None:
+            return False
+        unique_previous, unique_new = split
+        if not unique_previous and not unique_new:
+            return True
+
+        object_manager = self.repository.objects
+        if self.objects[: len(previous.objects)] == previous.objects:
+            # Fast path: new fragments applied on top of the old ones.
+            logging.info(
+                "Applying %s to %s",
+                pluralise("new fragment", len(unique_new)),
+                self.table_name,
+            )
+            with object_manager.ensure_objects(table=self, objects=unique_new):
+                engine.apply_fragments(
+                    [(SPLITGRAPH_META_SCHEMA, o) for o in unique_new],
+                    destination_schema,
+                    destination,
+                    schema_spec=self.table_schema,
+                )
+            return True
+
+        # Otherwise, we need to be able to find rows by their PK to replace them.
+        pk_cols = [c.name for c in self.table_schema if c.is_pk]
+        if not pk_cols:
+            return False
+
+        unique = unique_previous + unique_new
+        object_ranges = get_fragment_ranges(self, self.objects + unique_previous)
+        if object_ranges is None:
+            relevant = self.objects
+        else:
+            overlapping = get_overlapping_fragments(object_ranges, unique)
+            relevant = [o for o in self.objects if o in overlapping]
+        logging.info(
+            "Updating %s from %s",
+            self.table_name,
+            pluralise("fragment", len(set(relevant + unique))),
+        )
+
+        # WITH sg_changed_keys AS (SELECT pk FROM unique_1 UNION SELECT pk FROM unique_2...)
+        # DELETE FROM destination WHERE pk IN (SELECT pk FROM sg_changed_keys)
+        #
+        # WITH sg_changed_keys AS (...) INSERT INTO destination (SELECT latest versions of rows
+        # with these PKs from the relevant fragments)
+        pk_list = SQL(",").join(Identifier(c) for c in pk_cols)
+        col_list = SQL(",").join(Identifier(c.name) for c in self.table_schema)
+        keys = (
+            SQL("WITH sg_changed_keys AS (")
+            + generate_changed_keys_query(self.table_schema, unique)
+            + SQL(") ")
+        )
+        key_qual = (
+            SQL("(") + pk_list + SQL(") IN (SELECT ") + pk_list + SQL(" FROM sg_changed_keys)")
+        )
+        with object_manager.ensure_objects(table=self, objects=list(set(relevant + unique))):
+            engine.run_sql(
+                keys
+                + SQL("DELETE FROM {}.{} WHERE ").format(
+                    Identifier(destination_schema), Identifier(destination)
+                )
+                + key_qual
+            )
+            if relevant:
+                engine.run_sql(
+                    keys
+                    + SQL("INSERT INTO {}.{} (").format(
+                        Identifier(destination_schema), Identifier(destination)
+                    )
+                    + col_list
+                    + SQL(") SELECT ")
+                    + col_list
+                    + SQL(" FROM (")
+                    + engine.generate_merge_query(
+                        [(SPLITGRAPH_META_SCHEMA, o) for o in relevant], self.table_schema, key_qual
+                    )
+                    + SQL(") m")
+                )
+        return True
+
     def query_indirect(
-        self, columns: List[str], quals: Optional[Quals]
+        self,
+        columns: List[str],
+        quals: Optional[Quals],
+        prefetch: Optional[int] = None,
+        merge_on_read: Optional[bool] = None,
+        sort: bool = False,
     ) -> Tuple[Iterator[bytes], Callable, QueryPlan]:
         """
         Run a read-only query against this table without materializing it. Instead of
@@ -349,6 +803,16 @@ class Table:
         :param columns: List of columns from this table to fetch
         :param quals: List of qualifiers in conjunctive normal form. See the documentation for
             FragmentManager.filter_fragments for the actual format.
+        :param prefetch: If specified, download the objects lazily, when the caller reaches
+            them, keeping up to this many objects downloaded ahead of the current one.
+            By default, all objects are downloaded before this returns.
+        :param merge_on_read: If True, instead of applying groups of overlapping fragments to a
+            staging table, return a subquery that resolves the overlaps in the group for every group.
+            Defaults to the SG_MERGE_ON_READ setting. Ignored for tables without a primary key.
+        :param sort: If True, return the queries in the order of the primary key ranges that they
+            cover instead of returning direct queries to objects first. Since these ranges don't
+            overlap, sorting the results of every query by the primary key will return the
+            whole result sorted by the primary key (see `get_sort_key`).
         :return: Generator of queries (bytes), a callback and a query plan object (containing stats
             that are fully populated after the callback has been called to end the query).
         """
@@ -362,118 +826,258 @@ class Table:
         if not required_objects:
             return cast(Iterator[bytes], []), cast(Callable, _empty_callback), plan
 
+        if merge_on_read is None:
+            merge_on_read = _merge_on_read_enabled()
+
+        if prefetch is not None:
+            return self._query_indirect_lazy(plan, prefetch, merge_on_read, sort)
+
         object_manager = self.repository.objects
-        if not plan.non_singletons:
-            with object_manager.ensure_objects(
-                self, objects=required_objects, defer_release=True, tracer=plan.tracer
-            ) as eo_result:
-                _, release_callback = cast(Tuple, eo_result)
+        with object_manager.ensure_objects(
+            self, objects=required_objects, defer_release=True, tracer=plan.tracer
+        ) as eo_result:
+            _, release_callback = cast(Tuple, eo_result)
+            if not plan.non_singletons:
                 return iter(plan.singleton_queries), cast(Callable, release_callback), plan
 
-        def _generate_nonsingleton_query():
-            # If we have fragments that need applying to a staging area, we don't want to
-            # do it immediately: the caller might be satisfied with the data they got from
-            # the queries to singleton fragments. So here we have a callback that, when called,
-            # actually materializes the chunks into a temporary table and then changes
-            # the table's release callback to also delete that temporary table.
-
-            # There's a slight issue: we can't use temporary tables if we're returning
-            # pointers to tables since the caller might be in a different session.
-            staging_table = self._create_staging_table()
-            engine = self.repository.object_engine
-
-            def _f(from_fdw=False):
-                # This is very horrible but the way we share responsibilities between ourselves
-                # and Multicorn leaves us no other choice. In LQ, this is supposed to be called
-                # during EndForeignScan (at which point we are done with this staging table).
-                # However, EndForeignScan doesn't actually release locks on tables that Multicorn
-                # was reading (that are acquired outside of our control if the foreign scan happened in a
-                # transaction). In that case we can't delete this table until the transaction actually finishes
-                # -- which can't happen until we've deleted this table.
-
-                # Other options are: generating the materialization query and running it on
-                # Multicorn side (issues with Portals not being able to perform DDL and us having
-                # to rework our interface), adding a DROP table to the end of the query (then
-                # it doesn't return results, Portals still can't do DDL and the query is no longer
-                # idempotent).
-
-                # Instead, we pretend that we've successfully cleaned up but actually spawn
-                # a thread whose single job will be running DROP table and waiting until it actually
-                # returns.
-
-                if from_fdw:
-                    thread = threading.Thread(
-                        target=_delete_temporary_table,
-                        args=(engine, SPLITGRAPH_META_SCHEMA, staging_table),
-                    )
-                    thread.start()
-                else:
-                    engine.delete_table(SPLITGRAPH_META_SCHEMA, staging_table)
+            # Let the object manager evict each group's objects once the group is consumed.
+            groups = (
+                (group, partial(release_callback.release_objects, group))
+                for group in plan.non_singleton_groups
+            )
+            nonsingleton_queries = self._generate_nonsingleton_queries(
+                plan, groups, release_callback, merge_on_read
+            )
+            if sort:
+                queries = _sort_queries(plan, iter(plan.singleton_queries), nonsingleton_queries)
+            else:
+                queries = itertools.chain(plan.singleton_queries, nonsingleton_queries)
+            return queries, cast(Callable, release_callback), plan
+
+    def _query_indirect_lazy(
+        self, plan: QueryPlan, prefetch: int, merge_on_read: bool = False, sort: bool = False
+    ) -> Tuple[Iterator[bytes], Callable, QueryPlan]:
+        # Every singleton and every group of non-singletons gets claimed and downloaded
+        # only when the scan gets to it (in the same order as we return the queries).
+        batch_callbacks, release_callback = self.repository.objects.ensure_objects_lazily(
+            self,
+            (
+                plan.ordered_groups
+                if sort
+                else [[o] for o in plan.singletons] + plan.non_singleton_groups
+            ),
+            prefetch=prefetch,
+            tracer=plan.tracer,
+        )
+
+        def _generate_singleton_queries():
+            for query in plan.singleton_queries:
+                release_singleton = next(batch_callbacks)
+                yield query
+                release_singleton()
+
+        groups = ((group, next(batch_callbacks)) for group in plan.non_singleton_groups)
+        nonsingleton_queries = self._generate_nonsingleton_queries(
+            plan, groups, release_callback, merge_on_read
+        )
+        if sort:
+            queries = _sort_queries(plan, _generate_singleton_queries(), nonsingleton_queries)
+        else:
+            queries = itertools.chain(_generate_singleton_queries(), nonsingleton_queries)
+        return queries, cast(Callable, release_callback), plan
+
+    def _generate_nonsingleton_queries(
+        self,
+        plan: QueryPlan,
+        groups: Iterator[Tuple[List[str], Callable[[], None]]],
+        release_callback: CallbackList,
+        merge_on_read: bool = False,
+    ) -> Iterator[bytes]:
+        """
+        Apply groups of overlapping fragments to a staging table one by one, yielding the staging
+        table after each group.
+
+        :param plan: Query plan
+        :param groups: Iterator of groups of objects and callbacks to call once the group
+            has been consumed.
+        :param release_callback: Release callback for the query, to be extended to also delete
+            the staging table.
+        :param merge_on_read: If True, don't use a staging table and instead yield a subquery
+            for every group that merges its fragments. Ignored for tables without a primary key.
+        """
+        # If we have fragments that need applying to a staging area, we don't want to
+        # do it immediately: the caller might be satisfied with the data they got from
+        # the queries to singleton fragments. So here we have a generator that, when iterated
+        # over, materializes the groups of chunks into a temporary table one by one and
+        # changes the table's release callback to also delete that temporary table.
+
+        # There's a slight issue: we can't use temporary tables if we're returning
+        # pointers to tables since the caller might be in a different session.
+        engine = self.repository.object_engine
+        staging_table: Optional[str] = None
+        table_name = b""
+        merge_on_read = merge_on_read and _can_merge_on_read(self.table_schema)
+
+        def _f(from_fdw=False):
+            # This is very horrible but the way we share responsibilities between ourselves
+            # and Multicorn leaves us no other choice. In LQ, this is supposed to be called
+            # during EndForeignScan (at which point we are done with this staging table).
+            # However, EndForeignScan doesn't actually release locks on tables that Multicorn
+            # was reading (that are acquired outside of our control if the foreign scan happened in a
+            # transaction). In that case we can't delete this table until the transaction actually finishes
+            # -- which can't happen until we've deleted this table.
+
+            # Other options are: generating the materialization query and running it on
+            # Multicorn side (issues with Portals not being able to perform DDL and us having
+            # to rework our interface), adding a DROP table to the end of the query (then
+            # it doesn't return results, Portals still can't do DDL and the query is no longer
+            # idempotent).
+
+            # Instead, we pretend that we've successfully cleaned up but actually spawn
+            # a thread whose single job will be running DROP table and waiting until it actually
+            # returns.
+
+            if from_fdw:
+                thread = threading.Thread(
+                    target=_delete_temporary_table,
+                    args=(engine, SPLITGRAPH_META_SCHEMA, staging_table),
+                )
+                thread.start()
+            else:
+                engine.delete_table(SPLITGRAPH_META_SCHEMA, staging_table)
 
-            nonlocal release_callback
-            release_callback.append(_f)
+        for group, group_done in groups:
+            if merge_on_read:
+                yield _generate_merge_query(
+                    engine, group, self.table_schema, plan.sql_quals, plan.sql_qual_vals
+                )
+                group_done()
+                continue
+
+            if staging_table is None:
+                staging_table = self._create_staging_table()
+                release_callback.append(_f)
+                table_names = _generate_table_names(engine, SPLITGRAPH_META_SCHEMA, [staging_table])
+                table_name = table_names[0]
+            else:
+                # The caller has consumed the previous group: empty the staging table. We
+                # can't TRUNCATE it since in LQ, the scan that read the previous group holds
+                # a lock on the staging table until its transaction finishes.
+                engine.run_sql(
+                    SQL("DELETE FROM {}.{}").format(
+                        Identifier(SPLITGRAPH_META_SCHEMA), Identifier(staging_table)
+                    )
+                )
 
             # Apply the fragments (just the parts that match the qualifiers) to the staging area
-            if quals:
+            if plan.quals:
                 engine.apply_fragments(
-                    [(SPLITGRAPH_META_SCHEMA, o) for o in plan.non_singletons],
+                    [(SPLITGRAPH_META_SCHEMA, o) for o in group],
                     SPLITGRAPH_META_SCHEMA,
                     staging_table,
-                    extra_quals=plan.sql_quals,
+                    extra_quals=cast(Composed, plan.sql_quals),
                     extra_qual_args=plan.sql_qual_vals,
                     schema_spec=self.table_schema,
                 )
             else:
                 engine.apply_fragments(
-                    [(SPLITGRAPH_META_SCHEMA, o) for o in plan.non_singletons],
+                    [(SPLITGRAPH_META_SCHEMA, o) for o in group],
                     SPLITGRAPH_META_SCHEMA,
                     staging_table,
                     schema_spec=self.table_schema,
                 )
             engine.commit()
-            table_name = _generate_table_names(engine, SPLITGRAPH_META_SCHEMA, [staging_table])[0]
             yield table_name
 
-        with object_manager.ensure_objects(
-            self, objects=required_objects, defer_release=True, tracer=plan.tracer
-        ) as eo_result:
-            _, release_callback = cast(Tuple, eo_result)
-            return (
-                itertools.chain(plan.singleton_queries, _generate_nonsingleton_query()),
-                cast(Callable, release_callback),
-                plan,
-            )
+            # Let the object manager evict this group's objects if it needs to.
+            group_done()
+
+    def get_sort_key(self) -> Optional[List[str]]:
+        """
+        Get the columns that layered queries to this table can return sorted results by
+        without sorting the whole table: this is the table's primary key if all of its columns
+        have types that we can compare the fragments' PK ranges for.
+
+        :return: List of columns or None if results can't be sorted.
+        """
+        pks = [c for c in self.table_schema if c.is_pk]
+        if not pks or any(c.pg_type not in _SORTABLE_PK_TYPES for c in pks):
+            return None
+        return [c.name for c in pks]
 
     @contextmanager
-    def query_lazy(self, columns: List[str], quals: Quals) -> Iterator[Iterator[Dict[str, Any]]]:
+    def query_lazy(
+        self,
+        columns: List[str],
+        quals: Quals,
+        workers: Optional[int] = None,
+        ordered: bool = True,
+        sort: bool = False,
+    ) -> Iterator[Iterator[Dict[str, Any]]]:
         """
         Run a read-only query against this table without materializing it.
 
         :param columns: List of columns from this table to fetch
         :param quals: List of qualifiers in conjunctive normal form. See the documentation for
             FragmentManager.filter_fragments for the actual format.
+        :param workers: Number of fragments to scan concurrently (each on a separate connection
+            to the engine). Defaults to the SG_LQ_PARALLEL_SCANS setting (1, no parallelism).
+            Only fragments that can be queried directly (not overlapping with others)
+            are scanned in parallel.
+        :param ordered: If False and `workers` is greater than 1, results from each fragment
+            are returned as soon as they're ready instead of in the fragment order.
+        :param sort: If True, return the results sorted by the primary key (see `get_sort_key`).
+            This disables parallel scans.
         :return: Generator of dictionaries of results.
         """
 
-        table_gen, release_callback, plan = self.query_indirect(columns, quals)
+        order_by: Optional[List[str]] = None
+        if sort:
+            order_by = self.get_sort_key()
+            if not order_by:
+                raise ValueError("Table %s can't be queried in the PK order!" % self.table_name)
+            workers = 1
+        elif workers is None:
+            workers = _get_scan_workers()
+        table_gen, release_callback, plan = self.query_indirect(columns, quals, sort=sort)
+        table_gen = iter(table_gen)
         engine = self.repository.object_engine
 
         def _generate_results():
-            for table in table_gen:
-                result = engine.run_sql(
-                    _generate_select_query(
-                        engine, table, plan.columns, plan.sql_quals, plan.sql_qual_vals
-                    )
-                )
-                for row in result:
-                    yield {c: v for c, v in zip(columns, row)}
+            if workers > 1 and len(plan.singleton_queries) > 1:
+                # Singletons come first and, unlike the staging table, stay valid until
+                # the release callback is called, so we can read from them out of order.
+                singletons = list(itertools.islice(table_gen, len(plan.singleton_queries)))
+                for result in scan_tables_parallel(
+                    engine,
+                    singletons,
+                    plan.columns,
+                    workers,
+                    plan.sql_quals,
+                    plan.sql_qual_vals,
+                    ordered=ordered,
+                ):
+                    for row in result:
+                        yield {c: v for c, v in zip(columns, row)}
+
+            for row in scan_tables(
+                engine, table_gen, plan.columns, plan.sql_quals, plan.sql_qual_vals, order_by
+            ):
+                yield {c: v for c, v in zip(columns, row)}
 
         try:
             yield _generate_results()
         finally:
             release_callback()
 
-    def query(self, columns: List[str], quals: Quals):
+    def query(
+        self,
+        columns: List[str],
+        quals: Quals,
+        workers: Optional[int] = None,
+        ordered: bool = True,
+        sort: bool = False,
+    ):
         """
         Run a read-only query against this table without materializing it.
 
@@ -483,9 +1087,12 @@ class Table:
         :param columns: List of columns from this table to fetch
         :param quals: List of qualifiers in conjunctive normal form. See the documentation for
             FragmentManager.filter_fragments for the actual format.
+        :param workers: Number of fragments to scan concurrently, see `query_lazy`.
+        :param ordered: Whether to preserve the fragment order when scanning in parallel.
+        :param sort: Whether to return the results sorted by the primary key.
         :return: List of dictionaries of results
         """
-        with self.query_lazy(columns, quals) as result:
+        with self.query_lazy(columns, quals, workers=workers, ordered=ordered, sort=sort) as result:
             return list(result)
 
     def get_size(self) -> int:
@@ -538,6 +1145,119 @@ class Table:
             or 0,
         )
 
+    def aggregate(
+        self, aggregates: List[Tuple[str, Optional[str]]], quals: Optional[Quals] = None
+    ) -> List[Any]:
+        """
+        Calculate COUNT(*), MIN and MAX aggregates over this table, using object metadata
+        instead of scanning fragments where possible.
+
+        A fragment is answered from its metadata (the number of rows it inserts and its range index)
+        if it doesn't overlap any other fragment of the table, doesn't delete any rows, all columns
+        that are aggregated on are in its range index and its range index guarantees that
+        all of its rows match the qualifiers (only qualifiers on the primary key are considered).
+        Other fragments are downloaded and scanned as they would be with layered querying.
+
+        :param aggregates: List of (function, column), where function is one of `count`, `min`
+            or `max`. The column is ignored for `count` (which returns the number of rows).
+        :param quals: List of qualifiers in conjunctive normal form. See the documentation for
+            FragmentManager.filter_fragments for the actual format.
+        :return: List of aggregate values.
+        """
+        column_types = {c.name: _strip_type_mod(c.pg_type) for c in self.table_schema}
+        aggregates = [(f.lower(), None if f.lower() == "count" else c) for f, c in aggregates]
+        for function, column in aggregates:
+            if function not in _AGGREGATES:
+                raise ValueError("Unsupported aggregate %s!" % function)
+            if function != "count" and column not in column_types:
+                raise ValueError("Unknown column %s!" % column)
+        columns = [c for _, c in aggregates if c] or [self.table_schema[0].name]
+
+        object_manager = self.repository.objects
+        plan = self.get_query_plan(quals, columns)
+
+        # Fragments that overlap other fragments in the table might overwrite rows in them
+        # and have indexes covering old values, so they can't be answered from the metadata.
+        table_pk = get_change_key(self.table_schema)
+        standalone = {
+            group[0][0]
+            for group in get_chunk_groups(
+                [
+                    (object_id, min_max[0], min_max[1])
+                    for object_id, min_max in zip(
+                        self.objects, object_manager.get_min_max_pks(self.objects, table_pk)
+                    )
+                ]
+            )
+            if len(group) == 1
+        }
+        pk_types = {c.name: column_types[c.name] for c in self.table_schema if c.is_pk}
+        pk_types = {c: t for c, t in pk_types.items() if t in _METADATA_AGGREGATE_TYPES}
+
+        results: List[Sequence[Any]] = []
+        to_scan: List[str] = []
+        for object_id, meta in object_manager.get_object_meta(plan.singletons).items():
+            index_range = meta.object_index.get("range", {})
+            if (
+                object_id in standalone
+                and meta.rows_deleted == 0
+                and all(
+                    column_types[c] in _METADATA_AGGREGATE_TYPES and c in index_range
+                    for _, c in aggregates
+                    if c
+                )
+                and (not quals or _range_matches_all(index_range, quals, pk_types))
+            ):
+                results.append(
+                    [
+                        (
+                            meta.rows_inserted
+                            if function == "count"
+                            else _adapt_index_value(
+                                index_range[column][0 if function == "min" else 1],
+                                column_types[cast(str, column)],
+                            )
+                        )
+                        for function, column in aggregates
+                    ]
+                )
+            else:
+                to_scan.append(object_id)
+
+        logging.info(
+            "Answering aggregates from metadata for %s, scanning %s",
+            pluralise("fragment", len(results)),
+            pluralise("fragment", len(to_scan) + len(plan.non_singletons)),
+        )
+        if not to_scan and not plan.non_singletons:
+            return _combine_aggregates(aggregates, results)
+
+        engine = self.repository.object_engine
+        release_callback = CallbackList()
+        with object_manager.ensure_objects(self, objects=to_scan + plan.non_singletons):
+            tables = itertools.chain(
+                _generate_table_names(engine, SPLITGRAPH_META_SCHEMA, to_scan),
+                self._generate_nonsingleton_queries(
+                    plan,
+                    ((group, _empty_callback) for group in plan.non_singleton_groups),
+                    release_callback,
+                    _merge_on_read_enabled(),
+                ),
+            )
+            try:
+                for table in tables:
+                    results.append(
+                        engine.run_sql(
+                            _generate_aggregate_query(
+                                engine, table, aggregates, plan.sql_quals, plan.sql_qual_vals
+                            ),
+                            return_shape=ResultShape.ONE_MANY,
+                        )
+                    )
+            finally:
+                release_callback()
+        return _combine_aggregates(aggregates, results)
+
     def reindex(self, extra_indexes: ExtraIndexInfo, raise_on_patch_objects=True) -> List[str]:
         """
         Run extra indexes on all objects in this table and update their metadata.
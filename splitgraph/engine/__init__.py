@@ -38,6 +38,7 @@ _ENGINE_SPECIFIC_CONFIG = [
     "SG_NAMESPACE",
     "SG_IS_REGISTRY",
     "SG_CHECK_VERSION",
+    "SG_CHANGE_CAPTURE",
 ]
 
 # Some engine config keys default to values of other keys if unspecified.
@@ -121,6 +122,18 @@ class SQLEngine(ABC):
         tuples when possible."""
         raise NotImplementedError()
 
+    def run_sql_stream(self, statement, arguments=None, itersize=None):
+        """Run a SELECT statement and return an iterator over its rows. Unlike `run_sql`,
+        engines that support it don't have to buffer the whole result in memory.
+
+        The default implementation runs the statement with `run_sql`.
+
+        :param statement: Statement to run (must return rows)
+        :param arguments: Query arguments
+        :param itersize: Number of rows to fetch from the engine at a time
+        """
+        return iter(self.run_sql(statement, arguments) or [])
+
     def commit(self):
         """Commit the engine's backing connection"""
 
@@ -490,6 +503,18 @@ class ChangeEngine(SQLEngine, ABC):
         """
         raise NotImplementedError()
 
+    def conflate_pending_changes(self, schema, table, target_table):
+        """
+        Conflate pending changes for a given tracked table into a temporary table on the
+        engine instead of returning them to the client.
+
+        :param schema: Schema the table belongs to
+        :param table: Table to conflate changes for
+        :param target_table: Name of the temporary table to create
+        :return: Number of rows changed by the pending changes
+        """
+        raise NotImplementedError()
+
     def get_changed_tables(self, schema):
         """
         List tracked tables that have pending changes
@@ -558,6 +583,7 @@ class ObjectEngine:
         extra_qual_args=None,
         schema_spec=None,
         progress_every: Optional[int] = None,
+        merge: bool = False,
     ):
         """
         Apply multiple fragments to a target table as a single-query batch operation.
@@ -572,6 +598,22 @@ class ObjectEngine:
             If not specified, uses the schema of target_table.
         :param progress_every: If set, will report the materialization progress via
             tqdm every `progress_every` objects.
+        :param merge: If True, resolve overlapping rows in all fragments with a single query
+            (see `generate_merge_query`) and insert the result into the target table instead of
+            applying the fragments one by one. The target table must be empty.
+        """
+        raise NotImplementedError()
+
+    def generate_merge_query(self, objects, schema_spec, extra_quals=None):
+        """
+        Generate a query that returns the result of applying multiple fragments to one another
+        without writing them out into a table.
+
+        :param objects: List of tuples `(object_schema, object_table)` that the objects are stored in,
+            in the order in which they would be applied.
+        :param schema_spec: Schema of the objects (list of (ordinal, column_name, column_type, is_pk))
+        :param extra_quals: Optional, extra SQL (Composable) clauses to filter the resulting rows on
+        :return: SELECT query (Composable)
         """
         raise NotImplementedError()
 
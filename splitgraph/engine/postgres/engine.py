@@ -4,13 +4,14 @@ to track changes, as well as the Postgres FDW interface to upload/download objec
 import itertools
 import json
 import logging
+import re
 import sys
 import time
 from contextlib import contextmanager
 from io import BytesIO
 from io import TextIOWrapper
 from pathlib import PurePosixPath
-from threading import get_ident
+from threading import Lock, get_ident
 from typing import (
     Any,
     Dict,
@@ -33,18 +34,30 @@ from psycopg2 import DatabaseError
 from psycopg2.errors import InvalidSchemaName, UndefinedTable
 from psycopg2.extras import execute_batch, Json
 from psycopg2.pool import ThreadedConnectionPool, AbstractConnectionPool
-from psycopg2.sql import Composed, SQL
+from psycopg2.sql import Composable, Composed, Literal, SQL
 from psycopg2.sql import Identifier
 from tqdm import tqdm
 
 from splitgraph.__version__ import __version__
-from splitgraph.config import SPLITGRAPH_META_SCHEMA, CONFIG, SPLITGRAPH_API_SCHEMA, SG_CMD_ASCII
+from splitgraph.config import (
+    SPLITGRAPH_META_SCHEMA,
+    CONFIG,
+    SPLITGRAPH_API_SCHEMA,
+    SG_CMD_ASCII,
+    get_singleton,
+)
 from splitgraph.core import server
-from splitgraph.core.common import ensure_metadata_schema, META_TABLES, get_data_safe
+from splitgraph.core.common import (
+    ensure_metadata_schema,
+    META_TABLES,
+    get_data_safe,
+    get_temporary_table_id,
+)
 from splitgraph.core.sql import select
-from splitgraph.core.types import TableColumn, TableSchema
+from splitgraph.core.types import Changeset, TableColumn, TableSchema
 from splitgraph.engine import ResultShape, ObjectEngine, ChangeEngine, SQLEngine, switch_engine
 from splitgraph.exceptions import (
+    CheckoutError,
     EngineInitializationError,
     ObjectNotFoundError,
     AuthAPIError,
@@ -70,12 +83,18 @@ STM_TRIGGER_NAME = "audit_trigger_stm"
 REMOTE_TMP_SCHEMA = "tmp_remote_data"
 SG_UD_FLAG = "sg_ud_flag"
 
+# Column used to order rows from different fragments when merging them on read
+_SG_FRAGMENT_ORDINAL = "sg_fragment_ordinal"
+
+# Used to give server-side cursors unique names
+_STREAM_CURSOR_IDS = itertools.count()
+
 # Retry policy for connection errors
 RETRY_DELAY = 5
 RETRY_AMOUNT = 12
 
 # Internal API data
-_API_VERSION = "0.0.1"
+_API_VERSION = "0.1.0"
 
 # Limitations for SQL API that the client uses to talk to the registry. Because
 # we let the client run SQL in a controlled environment on the registry, it allows
@@ -296,6 +315,14 @@ class PsycopgEngine(SQLEngine):
             conn.close()
             self._pool.putconn(conn)
 
+    def close_all(self) -> None:
+        """
+        Close all connections in the connection pool, including idle ones. The engine
+        can't be used after this.
+        """
+        if not self._pool.closed:
+            self._pool.closeall()
+
     def rollback(self) -> None:
         if self.connected:
             if self._savepoint_stack.stack:
@@ -565,6 +592,38 @@ class PsycopgEngine(SQLEngine):
                     return [c[0] for c in cur.fetchall()]
                 return cur.fetchall()
 
+    def run_sql_stream(
+        self,
+        statement: Union[bytes, Composed, str, SQL],
+        arguments: Optional[Sequence[Any]] = None,
+        itersize: Optional[int] = None,
+    ) -> Iterator[Tuple[Any, ...]]:
+        """Run a SELECT statement using a server-side (named) cursor, yielding its rows.
+        Rows are fetched from the engine in batches of `itersize` (by default,
+        SG_ENGINE_ITERSIZE) rather than loaded into memory all at once.
+
+        The cursor is closed when the iterator is exhausted or garbage collected.
+
+        :param statement: Statement to run (must return rows)
+        :param arguments: Query arguments
+        :param itersize: Number of rows to fetch from the engine at a time
+        """
+        itersize = itersize or int(get_singleton(CONFIG, "SG_ENGINE_ITERSIZE"))
+        connection = self.connection
+        # Named cursors can't be used outside of a transaction unless they're declared
+        # WITH HOLD (which materializes the result on the server when the transaction commits).
+        with connection.cursor(
+            name="sg_stream_%d" % next(_STREAM_CURSOR_IDS), withhold=self.autocommit
+        ) as cur:
+            cur.itersize = itersize
+            try:
+                self.notices = []
+                cur.execute(statement, _convert_vals(arguments) if arguments else None)
+                yield from cur
+            except Exception:
+                self.rollback()
+                raise
+
     def get_primary_keys(self, schema: str, table: str) -> List[Tuple[str, str]]:
         """Inspects the Postgres information_schema to get the primary keys for a given table."""
         return cast(
@@ -816,6 +875,16 @@ class AuditTriggerChangeEngine(PsycopgEngine, ChangeEngine):
 
     def untrack_tables(self, tables: List[Tuple[str, str]]) -> None:
         """Remove triggers from tables and delete their pending changes"""
+        self._drop_audit_triggers(tables)
+        # Delete the actual logged actions for untracked tables
+        self.run_sql_batch(
+            SQL("DELETE FROM {}.logged_actions WHERE schema_name = %s AND table_name = %s").format(
+                Identifier(_AUDIT_SCHEMA)
+            ),
+            tables,
+        )
+
+    def _drop_audit_triggers(self, tables: List[Tuple[str, str]]) -> None:
         for trigger in (ROW_TRIGGER_NAME, STM_TRIGGER_NAME):
             self.run_sql(
                 SQL(";").join(
@@ -825,13 +894,6 @@ class AuditTriggerChangeEngine(PsycopgEngine, ChangeEngine):
                     for s, t in tables
                 )
             )
-        # Delete the actual logged actions for untracked tables
-        self.run_sql_batch(
-            SQL("DELETE FROM {}.logged_actions WHERE schema_name = %s AND table_name = %s").format(
-                Identifier(_AUDIT_SCHEMA)
-            ),
-            tables,
-        )
 
     def has_pending_changes(self, schema: str) -> bool:
         """
@@ -901,6 +963,135 @@ class AuditTriggerChangeEngine(PsycopgEngine, ChangeEngine):
             result.extend(_convert_audit_change(action, row_data, changed_fields, ri_cols))
         return result
 
+    def conflate_pending_changes(self, schema: str, table: str, target_table: str) -> int:
+        """
+        Conflate pending changes for a given tracked table on the engine instead of loading
+        the audit log into memory. Changes to the same row are merged in the same way as
+        `splitgraph.core.fragment_manager._conflate_changes` does it.
+
+        The changes are stored in a temporary table with columns `sg_ri` (replica identity of the
+        changed row as a JSON object), `sg_upserted`, `sg_old_row` and `sg_new_row`.
+        Use `select_changed_keys` and `select_old_rows` to query them.
+
+        If the engine doesn't have the `splitgraph_api.conflate_changes` aggregate, the changes
+        are conflated on the client instead.
+
+        :param schema: Schema the table belongs to
+        :param table: Table to conflate changes for
+        :param target_table: Name of the temporary table to create
+        :return: Number of rows changed by the pending changes
+        """
+        table_schema = self.get_full_table_schema(schema, table)
+        ri_cols = [c for c, _ in get_change_key(table_schema)]
+        non_ri_cols = [c.name for c in table_schema if c.name not in ri_cols]
+
+        try:
+            with self.savepoint("conflate_pending_changes"):
+                self._conflate_pending_changes_server(
+                    schema, table, target_table, ri_cols, non_ri_cols
+                )
+        except psycopg2.errors.UndefinedFunction:
+            logging.warning(
+                "Engine %s can't conflate changes, falling back to client-side conflation",
+                self.name,
+            )
+            self._conflate_pending_changes_client(schema, table, target_table, ri_cols)
+
+        return cast(
+            int,
+            self.run_sql(
+                SQL("SELECT COUNT(1) FROM pg_temp.{}").format(Identifier(target_table)),
+                return_shape=ResultShape.ONE_ONE,
+            ),
+        )
+
+    def _conflate_pending_changes_server(
+        self,
+        schema: str,
+        table: str,
+        target_table: str,
+        ri_cols: List[str],
+        non_ri_cols: List[str],
+    ) -> None:
+        # Mirrors _convert_audit_change: an update that changes the replica identity
+        # (sg_seq = 1) is turned into a delete of the old row and an insert of the new one.
+        self.run_sql(
+            SQL(
+                "CREATE TEMPORARY TABLE {0} AS "
+                "SELECT sg_ri, (sg_change ->> 0)::boolean AS sg_upserted, "
+                "sg_change -> 1 AS sg_old_row, sg_change -> 2 AS sg_new_row FROM ("
+                "SELECT c.sg_ri, {1}.conflate_changes(c.sg_upserted, c.sg_old_row, c.sg_new_row "
+                "ORDER BY l.event_id, c.sg_seq) AS sg_change "
+                "FROM {2}.logged_actions l, "
+                "LATERAL (SELECT l.row_data || coalesce(l.changed_fields - %s::text[], '{{}}') "
+                "AS new_row, coalesce(l.changed_fields ?| %s::text[], false) AS ri_changed) r, "
+                "LATERAL (VALUES "
+                "(0, l.row_data - %s::text[], l.action IN ('I', 'U') AND NOT r.ri_changed, "
+                "CASE WHEN l.action IN ('U', 'D') THEN l.row_data ELSE '{{}}' END, "
+                "CASE WHEN l.action IN ('I', 'U') THEN r.new_row ELSE '{{}}' END), "
+                "(1, (l.row_data || l.changed_fields) - %s::text[], true, '{{}}', r.new_row)"
+                ") c (sg_seq, sg_ri, sg_upserted, sg_old_row, sg_new_row) "
+                "WHERE l.schema_name = %s AND l.table_name = %s "
+                "AND (c.sg_seq = 0 OR r.ri_changed) "
+                "AND (l.action <> 'U' OR coalesce(l.changed_fields, '{{}}') <> '{{}}') "
+                "GROUP BY c.sg_ri) g "
+                "WHERE sg_change IS NOT NULL"
+            ).format(
+                Identifier(target_table),
+                Identifier(SPLITGRAPH_API_SCHEMA),
+                Identifier(_AUDIT_SCHEMA),
+            ),
+            (ri_cols, ri_cols, non_ri_cols, non_ri_cols, schema, table),
+            return_shape=ResultShape.NONE,
+        )
+
+    def _conflate_pending_changes_client(
+        self, schema: str, table: str, target_table: str, ri_cols: List[str]
+    ) -> None:
+        # Circular import
+        from splitgraph.core.fragment_manager import _conflate_changes
+
+        changeset = _conflate_changes(
+            {},
+            cast(
+                List[Tuple[Tuple, bool, Dict[str, Any], Dict[str, Any]]],
+                self.get_pending_changes(schema, table),
+            ),
+        )
+        self.run_sql(
+            SQL(
+                "CREATE TEMPORARY TABLE {} (sg_ri jsonb, sg_upserted boolean, "
+                "sg_old_row jsonb, sg_new_row jsonb)"
+            ).format(Identifier(target_table)),
+            return_shape=ResultShape.NONE,
+        )
+        self.run_sql_batch(
+            SQL("INSERT INTO pg_temp.{} VALUES (%s, %s, %s, %s)").format(
+                Identifier(target_table)
+            ),
+            [
+                (dict(zip(ri_cols, pk)), upserted, old_row, new_row)
+                for pk, (upserted, old_row, new_row) in changeset.items()
+            ],
+        )
+
+    def get_conflated_changes(self, changes_table: str, ri_cols: Sequence[str]) -> Changeset:
+        """
+        Load changes conflated by `conflate_pending_changes` into a changeset.
+
+        :param changes_table: Temporary table with conflated changes
+        :param ri_cols: Replica identity columns of the changed table
+        :return: Changeset
+        """
+        return {
+            tuple(ri[c] for c in ri_cols): (upserted, old_row, new_row)
+            for ri, upserted, old_row, new_row in self.run_sql(
+                SQL("SELECT sg_ri, sg_upserted, sg_old_row, sg_new_row FROM pg_temp.{}").format(
+                    Identifier(changes_table)
+                )
+            )
+        }
+
     def get_changed_tables(self, schema: str) -> List[str]:
         """Get list of tables that have changed content"""
         return cast(
@@ -916,7 +1107,341 @@ class AuditTriggerChangeEngine(PsycopgEngine, ChangeEngine):
         )
 
 
-class PostgresEngine(AuditTriggerChangeEngine, ObjectEngine):
+class LogicalDecodingChangeEngine(AuditTriggerChangeEngine):
+    """
+    Change tracking based on logical decoding. Instead of having a trigger write every change
+    into the audit log as it happens, changes to tracked tables are decoded from the WAL
+    (using the test_decoding plugin) and moved into the audit log when pending changes are
+    requested, so that writes to tracked tables cost about as much as writes to normal tables.
+
+    Only changes from committed transactions can be decoded, so querying pending changes
+    raises an error if the current transaction has written to tracked tables.
+
+    Used if the engine's SG_CHANGE_CAPTURE setting is "logical" (requires wal_level = logical
+    on the engine), otherwise this falls back to the audit trigger.
+    """
+
+    _decode_lock = Lock()
+
+    @property
+    def logical_change_capture(self) -> bool:
+        return bool(getattr(self, "conn_params", {}).get("SG_CHANGE_CAPTURE") == "logical")
+
+    @property
+    def replication_slot(self) -> str:
+        """Name of the logical replication slot that the changes are decoded from."""
+        return "splitgraph_" + re.sub(
+            r"[^a-z0-9_]", "_", (self.conn_params["SG_ENGINE_DB_NAME"] or "").lower()
+        )
+
+    def initialize(
+        self, skip_object_handling: bool = False, skip_create_database: bool = False
+    ) -> None:
+        super().initialize(
+            skip_object_handling=skip_object_handling, skip_create_database=skip_create_database
+        )
+        if skip_object_handling or not self.logical_change_capture:
+            return
+
+        if self.run_sql("SHOW wal_level", return_shape=ResultShape.ONE_ONE) != "logical":
+            raise EngineInitializationError(
+                "SG_CHANGE_CAPTURE is set to logical but the engine isn't running with "
+                "wal_level = logical. Set it in the engine's postgresql.conf or start "
+                "the engine with -c wal_level=logical."
+            )
+
+        self.run_sql(
+            SQL(
+                "CREATE TABLE IF NOT EXISTS {}.tracked_tables (schema_name text, "
+                "table_name text, tracked_from pg_lsn NOT NULL, PRIMARY KEY (schema_name, table_name))"
+            ).format(Identifier(_AUDIT_SCHEMA)),
+            return_shape=ResultShape.NONE,
+        )
+        # The slot can't be created in a transaction that has written something.
+        self.commit()
+        if not self._replication_slot_exists():
+            logging.info("Creating the logical replication slot %s...", self.replication_slot)
+            self.run_sql(
+                "SELECT pg_create_logical_replication_slot(%s, 'test_decoding')",
+                (self.replication_slot,),
+            )
+            self.commit()
+
+    def _replication_slot_exists(self) -> bool:
+        return (
+            self.run_sql(
+                "SELECT 1 FROM pg_replication_slots WHERE slot_name = %s",
+                (self.replication_slot,),
+                return_shape=ResultShape.ONE_ONE,
+            )
+            is not None
+        )
+
+    def get_tracked_tables(self) -> List[Tuple[str, str]]:
+        if not self.logical_change_capture:
+            return super().get_tracked_tables()
+        if not self.table_exists(_AUDIT_SCHEMA, "tracked_tables"):
+            return []
+
+        # Decoding can stop tracking tables whose changes can't be tracked.
+        self._decode_changes()
+
+        # If a tracked table got recreated, it has to be tracked again.
+        return cast(
+            List[Tuple[str, str]],
+            self.run_sql(
+                SQL(
+                    "SELECT t.schema_name, t.table_name FROM {}.tracked_tables t "
+                    "JOIN pg_namespace n ON n.nspname = t.schema_name "
+                    "JOIN pg_class c ON c.relnamespace = n.oid AND c.relname = t.table_name "
+                    "WHERE c.relreplident = 'f'"
+                ).format(Identifier(_AUDIT_SCHEMA))
+            ),
+        )
+
+    def track_tables(self, tables: List[Tuple[str, str]]) -> None:
+        if not self.logical_change_capture:
+            super().track_tables(tables)
+            return
+
+        if not self._replication_slot_exists():
+            raise EngineInitializationError(
+                "Logical replication slot %s doesn't exist. Run sgr init to create it."
+                % self.replication_slot
+            )
+
+        # Make sure the tables aren't also tracked by the audit trigger.
+        self._drop_audit_triggers(tables)
+
+        # Log the whole old row for updates/deletes and ignore changes made before
+        # the table started being tracked (e.g. by the checkout itself).
+        self.run_sql(
+            SQL(";").join(
+                SQL("ALTER TABLE {}.{} REPLICA IDENTITY FULL").format(Identifier(s), Identifier(t))
+                for s, t in tables
+            ),
+            return_shape=ResultShape.NONE,
+        )
+        self.run_sql_batch(
+            SQL(
+                "INSERT INTO {}.tracked_tables VALUES (%s, %s, pg_current_wal_insert_lsn()) "
+                "ON CONFLICT (schema_name, table_name) "
+                "DO UPDATE SET tracked_from = EXCLUDED.tracked_from"
+            ).format(Identifier(_AUDIT_SCHEMA)),
+            tables,
+        )
+
+    def untrack_tables(self, tables: List[Tuple[str, str]]) -> None:
+        if self.logical_change_capture:
+            for schema, table in tables:
+                if self.table_exists(schema, table):
+                    self.run_sql(
+                        SQL("ALTER TABLE {}.{} REPLICA IDENTITY DEFAULT").format(
+                            Identifier(schema), Identifier(table)
+                        ),
+                        return_shape=ResultShape.NONE,
+                    )
+            if self.table_exists(_AUDIT_SCHEMA, "tracked_tables"):
+                self.run_sql_batch(
+                    SQL(
+                        "DELETE FROM {}.tracked_tables WHERE schema_name = %s AND table_name = %s"
+                    ).format(Identifier(_AUDIT_SCHEMA)),
+                    tables,
+                )
+        super().untrack_tables(tables)
+
+    def has_pending_changes(self, schema: str) -> bool:
+        self._check_uncommitted_changes()
+        self._decode_changes()
+        return super().has_pending_changes(schema)
+
+    def discard_pending_changes(self, schema: str, table: Optional[str] = None) -> None:
+        self._decode_changes()
+        super().discard_pending_changes(schema, table)
+
+    def get_pending_changes(
+        self, schema: str, table: str, aggregate: bool = False
+    ) -> Union[
+        List[Tuple[int, int]], List[Tuple[Tuple[str, ...], bool, Dict[str, Any], Dict[str, Any]]]
+    ]:
+        self._check_uncommitted_changes()
+        self._decode_changes()
+        return super().get_pending_changes(schema, table, aggregate)
+
+    def conflate_pending_changes(self, schema: str, table: str, target_table: str) -> int:
+        self._check_uncommitted_changes()
+        self._decode_changes()
+        return super().conflate_pending_changes(schema, table, target_table)
+
+    def get_changed_tables(self, schema: str) -> List[str]:
+        self._check_uncommitted_changes()
+        self._decode_changes()
+        return super().get_changed_tables(schema)
+
+    def _check_uncommitted_changes(self) -> None:
+        """
+        Raise an error if the current transaction has written to tracked tables, since
+        these changes can't be decoded until the transaction commits and would otherwise
+        be missed by commits and checkouts.
+
+        Tables whose tracking started in the current transaction (e.g. during a checkout)
+        are ignored, since writes to them before that aren't pending changes.
+        """
+        if not self.logical_change_capture or not self.table_exists(
+            _AUDIT_SCHEMA, "tracked_tables"
+        ):
+            return
+
+        if (
+            self.run_sql("SELECT txid_current_if_assigned()", return_shape=ResultShape.ONE_ONE)
+            is None
+        ):
+            return
+
+        # age(xmin) <= 0 means the row was written by the current transaction.
+        uncommitted = self.run_sql(
+            SQL(
+                "SELECT t.schema_name, t.table_name FROM {}.tracked_tables t "
+                "JOIN pg_stat_xact_user_tables s "
+                "ON s.schemaname = t.schema_name AND s.relname = t.table_name "
+                "WHERE s.n_tup_ins + s.n_tup_upd + s.n_tup_del > 0 AND age(t.xmin) > 0"
+            ).format(Identifier(_AUDIT_SCHEMA))
+        )
+        if uncommitted:
+            raise CheckoutError(
+                "Tables %s have uncommitted changes that can't be tracked until "
+                "the transaction commits. Commit it first."
+                % ", ".join("%s.%s" % (s, t) for s, t in uncommitted)
+            )
+
+    def _decode_changes(self, batch_size: int = 10000) -> None:
+        """
+        Move committed changes to tracked tables from the replication slot into the audit log,
+        in the same format as the audit trigger would have written them.
+
+        This is done on a separate connection and committed straight away, since consuming
+        changes from the slot can't be rolled back.
+
+        If a change to a table can't be tracked (e.g. a TRUNCATE), the table stops being
+        tracked and its pending changes are discarded, so that the next commit stores it
+        as a full snapshot, like it does for tables that were dropped and recreated.
+        """
+        if not self.logical_change_capture or not self.table_exists(
+            _AUDIT_SCHEMA, "tracked_tables"
+        ):
+            return
+
+        # Only one connection can consume changes from the slot at a time.
+        with self._decode_lock:
+            key = ("decode_changes", get_ident())
+            conn = self._pool.getconn(key)
+            try:
+                conn.autocommit = False
+                with conn.cursor() as cur:
+                    cur.execute("SELECT pg_current_wal_lsn()")
+                    upto_lsn = cast(Tuple[str], cur.fetchone())[0]
+                    cur.execute(
+                        "CREATE TEMPORARY TABLE sg_decoded_changes (sg_seq bigint, "
+                        "schema_name text, table_name text, action text, old_row json, new_row json) "
+                        "ON COMMIT DROP"
+                    )
+
+                changed_tables = set()
+                untracked_tables = set()
+                with conn.cursor(name="sg_decode_changes") as decoded:
+                    decoded.execute(
+                        # A TRUNCATE of multiple tables is output as
+                        # "table s.t1, s.t2: TRUNCATE: ...", so match those separately.
+                        SQL(
+                            "SELECT c.sg_seq, t.schema_name, t.table_name, "
+                            "CASE WHEN left(c.data, length(t.prefix)) = t.prefix "
+                            "THEN substr(c.data, length(t.prefix) + 1) "
+                            "ELSE substr(c.data, position(': TRUNCATE:' IN c.data) + 2) END "
+                            "FROM pg_logical_slot_peek_changes(%s, %s, NULL, 'include-xids', '0') "
+                            "WITH ORDINALITY c(lsn, xid, data, sg_seq) "
+                            "JOIN (SELECT tt.schema_name, tt.table_name, tt.tracked_from, "
+                            "quote_ident(tt.schema_name) || '.' || quote_ident(tt.table_name) "
+                            "AS name, 'table ' || quote_ident(tt.schema_name) || '.' "
+                            "|| quote_ident(tt.table_name) || ': ' AS prefix "
+                            "FROM {}.tracked_tables tt "
+                            "JOIN pg_namespace n ON n.nspname = tt.schema_name "
+                            "JOIN pg_class r ON r.relnamespace = n.oid AND r.relname = tt.table_name "
+                            "WHERE r.relreplident = 'f') t "
+                            "ON c.lsn >= t.tracked_from AND (left(c.data, length(t.prefix)) = t.prefix "
+                            "OR (c.data LIKE 'table %%: TRUNCATE:%%' AND position(', ' || t.name "
+                            "|| ', ' IN ', ' || substr(c.data, 7, position(': TRUNCATE:' IN c.data) "
+                            "- 7) || ', ') > 0)) "
+                            "ORDER BY c.sg_seq"
+                        ).format(Identifier(_AUDIT_SCHEMA)),
+                        (self.replication_slot, upto_lsn),
+                    )
+                    while True:
+                        batch = decoded.fetchmany(batch_size)
+                        if not batch:
+                            break
+                        rows = []
+                        for seq, schema, table, data in batch:
+                            if (schema, table) in untracked_tables:
+                                continue
+                            change = _parse_decoded_change(data)
+                            if not change:
+                                logging.warning(
+                                    "Can't track change to %s.%s: %s. The table will be "
+                                    "stored as a full snapshot on the next commit.",
+                                    schema,
+                                    table,
+                                    data[:100],
+                                )
+                                untracked_tables.add((schema, table))
+                                changed_tables.discard((schema, table))
+                                continue
+                            action, old_row, new_row = change
+                            changed_tables.add((schema, table))
+                            rows.append(
+                                (
+                                    seq,
+                                    schema,
+                                    table,
+                                    action,
+                                    json.dumps(old_row) if old_row is not None else None,
+                                    json.dumps(new_row) if new_row is not None else None,
+                                )
+                            )
+                        with conn.cursor() as cur:
+                            cur.copy_expert(
+                                "COPY sg_decoded_changes FROM STDIN", cast(Any, _CopyStream(rows))
+                            )
+
+                with conn.cursor() as cur:
+                    for schema, table in changed_tables:
+                        cur.execute(
+                            _audit_log_insert_query(self.get_full_table_schema(schema, table)),
+                            (schema, table),
+                        )
+                    for schema, table in untracked_tables:
+                        for query in (
+                            "DELETE FROM {}.tracked_tables",
+                            "DELETE FROM {}.logged_actions",
+                        ):
+                            cur.execute(
+                                SQL(query + " WHERE schema_name = %s AND table_name = %s").format(
+                                    Identifier(_AUDIT_SCHEMA)
+                                ),
+                                (schema, table),
+                            )
+                    cur.execute(
+                        "SELECT pg_replication_slot_advance(%s, %s)",
+                        (self.replication_slot, upto_lsn),
+                    )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                self._pool.putconn(conn, key)
+
+
+class PostgresEngine(LogicalDecodingChangeEngine, ObjectEngine):
     """An implementation of the Postgres engine for Splitgraph"""
 
     def get_object_schema(self, object_id: str) -> "TableSchema":
@@ -1110,10 +1635,20 @@ class PostgresEngine(AuditTriggerChangeEngine, ObjectEngine):
             temporary=temporary,
         )
 
+        # Lists of PKs are loaded into temporary tables with COPY rather than
+        # inlined into the query.
+        key_tables = []
+        if inserted and not isinstance(inserted, Composable):
+            key_tables.append(self._copy_keys(inserted, schema_spec, ri_cols))
+            inserted = SQL("SELECT * FROM pg_temp.{}").format(Identifier(key_tables[-1]))
+        if deleted and not isinstance(deleted, Composable):
+            key_tables.append(self._copy_keys(deleted, schema_spec, ri_cols))
+            deleted = SQL("SELECT * FROM pg_temp.{}").format(Identifier(key_tables[-1]))
+
         # Store upserts
         # INSERT INTO target_table (sg_ud_flag, col1, col2...)
         #   (SELECT true, t.col1, t.col2, ...
-        #    FROM VALUES ((pk1_1, pk1_2), (pk2_1, pk2_2)...)) v JOIN source_table t
+        #    FROM (SELECT * FROM pk_table) v JOIN source_table t
         #    ON v.pk1 = t.pk1::pk1_type AND v.pk2::pk2_type = t.pk2...
         #    -- the cast is required since the audit trigger gives us strings for values of updated columns
         #    -- and we're intending to join those with the PKs in the original table.
@@ -1125,17 +1660,9 @@ class PostgresEngine(AuditTriggerChangeEngine, ObjectEngine):
                     + SQL(")")
                     + SQL("(SELECT %s, ")
                     + SQL(",").join(SQL("t.") + Identifier(c) for c in all_cols)
-                    + SQL(
-                        " FROM (VALUES "
-                        + ",".join(
-                            itertools.repeat(
-                                "(" + ",".join(itertools.repeat("%s", len(inserted[0]))) + ")",
-                                len(inserted),
-                            )
-                        )
-                        + ")"
-                    )
-                    + SQL(" AS v (")
+                    + SQL(" FROM (")
+                    + inserted
+                    + SQL(") AS v (")
                     + SQL(",").join(Identifier(c) for c in ri_cols)
                     + SQL(")")
                     + SQL("JOIN {}.{} t").format(
@@ -1148,46 +1675,41 @@ class PostgresEngine(AuditTriggerChangeEngine, ObjectEngine):
                     )
                     + SQL(")")
                 )
-                # Flatten the args
-                args = [True] + [p for pk in inserted for p in pk]
+                self.run_sql(query, (True,))
             else:
                 # If the whole tuple is the PK, there's no point joining on the actual source table
-                query = (
-                    SQL("INSERT INTO {}.{} (").format(Identifier(schema), Identifier(table))
-                    + SQL(",").join(Identifier(c) for c in [SG_UD_FLAG] + ri_cols)
-                    + SQL(")")
-                    + SQL(
-                        "VALUES "
-                        + ",".join(
-                            itertools.repeat(
-                                "(" + ",".join(itertools.repeat("%s", len(inserted[0]) + 1)) + ")",
-                                len(inserted),
-                            )
-                        )
-                    )
-                )
-                args = [p for pk in inserted for p in [True] + list(pk)]
-            self.run_sql(query, args)
+                self.run_sql(_insert_keys_query(schema, table, ri_cols, inserted), (True,))
 
         # Store the deletes
         # we don't actually have the old values here so we put NULLs (which should be compressed out).
         if deleted:
-            query = (
-                SQL("INSERT INTO {}.{} (").format(Identifier(schema), Identifier(table))
-                + SQL(",").join(Identifier(c) for c in [SG_UD_FLAG] + ri_cols)
-                + SQL(")")
-                + SQL(
-                    "VALUES "
-                    + ",".join(
-                        itertools.repeat(
-                            "(" + ",".join(itertools.repeat("%s", len(deleted[0]) + 1)) + ")",
-                            len(deleted),
-                        )
-                    )
-                )
+            self.run_sql(_insert_keys_query(schema, table, ri_cols, deleted), (False,))
+
+        for key_table in key_tables:
+            self.delete_table("pg_temp", key_table)
+
+    def _copy_keys(self, keys: Sequence[Any], schema_spec: TableSchema, ri_cols: List[str]) -> str:
+        """
+        Load a list of replica identities into a temporary table using COPY.
+
+        :param keys: List of tuples of replica identity values
+        :param schema_spec: Schema of the table the keys belong to
+        :param ri_cols: Replica identity columns
+        :return: Name of the temporary table
+        """
+        key_table = get_temporary_table_id()
+        key_schema = [c._replace(is_pk=False) for c in schema_spec if c.name in ri_cols]
+        self.create_table(None, key_table, schema_spec=key_schema, temporary=True)
+        with self.copy_cursor() as cur:
+            cur.copy_expert(
+                SQL("COPY pg_temp.{} FROM STDIN").format(Identifier(key_table)),
+                _CopyStream(keys, [c.pg_type for c in key_schema]),
             )
-            args = [p for pk in deleted for p in [False] + list(pk)]
-            self.run_sql(query, args)
+        # Give the planner an idea of how many keys there are for the join
+        self.run_sql(
+            SQL("ANALYZE pg_temp.{}").format(Identifier(key_table)), return_shape=ResultShape.NONE
+        )
+        return key_table
 
     def store_object(
         self,
@@ -1306,6 +1828,59 @@ class PostgresEngine(AuditTriggerChangeEngine, ObjectEngine):
         query += SQL(")")
         return query
 
+    def generate_merge_query(
+        self,
+        objects: List[Tuple[str, str]],
+        schema_spec: "TableSchema",
+        extra_quals: Optional[Composed] = None,
+    ) -> Composed:
+        ri_cols, non_ri_cols = self._schema_spec_to_cols(schema_spec)
+        all_cols = ri_cols + non_ri_cols
+        col_list = SQL(",").join(Identifier(c) for c in all_cols)
+
+        # Instead of applying fragments to a staging table one by one, resolve overlaps
+        # in one go: concatenate all fragments, tagging each row with the position of its
+        # fragment, and keep the latest version of every row, discarding it if that version
+        # is a deletion. Since quals might match an old version of the row but not the new one,
+        # they have to be applied after we've picked the latest version.
+
+        # SELECT col1, col2... FROM (
+        #   SELECT DISTINCT ON (pk1, pk2...) col1, col2, ..., sg_ud_flag FROM (
+        #     SELECT col1, col2, ..., sg_ud_flag, 0 AS sg_fragment_ordinal FROM fragment_1
+        #     UNION ALL
+        #     SELECT col1, col2, ..., sg_ud_flag, 1 AS sg_fragment_ordinal FROM fragment_2 ...
+        #   ) f ORDER BY pk1, pk2, ..., sg_fragment_ordinal DESC
+        # ) m WHERE sg_ud_flag = true (AND optional quals)
+        fragments = SQL(" UNION ALL ").join(
+            SQL("SELECT ")
+            + col_list
+            + SQL(",{},{} AS {} FROM {}.{}").format(
+                Identifier(SG_UD_FLAG),
+                Literal(i),
+                Identifier(_SG_FRAGMENT_ORDINAL),
+                Identifier(source_schema),
+                Identifier(source_table),
+            )
+            for i, (source_schema, source_table) in enumerate(objects)
+        )
+        query = (
+            SQL("SELECT ")
+            + col_list
+            + SQL(" FROM (SELECT DISTINCT ON (")
+            + SQL(",").join(Identifier(c) for c in ri_cols)
+            + SQL(") ")
+            + col_list
+            + SQL(",{} FROM (").format(Identifier(SG_UD_FLAG))
+            + fragments
+            + SQL(") f ORDER BY ")
+            + SQL(",").join(Identifier(c) for c in ri_cols)
+            + SQL(",{} DESC) m").format(Identifier(_SG_FRAGMENT_ORDINAL))
+        )
+        quals = [SQL("{} = true").format(Identifier(SG_UD_FLAG))]
+        if extra_quals:
+            quals.append(SQL("(") + extra_quals + SQL(")"))
+        return query + SQL(" WHERE ") + SQL(" AND ").join(quals)
+
     def apply_fragments(
         self,
         objects: List[Tuple[str, str]],
@@ -1315,10 +1890,28 @@ class PostgresEngine(AuditTriggerChangeEngine, ObjectEngine):
         extra_qual_args: Optional[Tuple[str]] = None,
         schema_spec: Optional["TableSchema"] = None,
         progress_every: Optional[int] = None,
+        merge: bool = False,
     ) -> None:
         if not objects:
             return
         schema_spec = schema_spec or self.get_full_table_schema(target_schema, target_table)
+
+        # Merging keeps one version of every row with a given PK. Tables without a PK are keyed
+        # on all of their columns, so merging would collapse duplicate rows: apply their
+        # fragments one by one instead.
+        if merge and any(c.is_pk for c in schema_spec):
+            ri_cols, non_ri_cols = self._schema_spec_to_cols(schema_spec)
+            self.run_sql(
+                SQL("INSERT INTO {}.{} (").format(
+                    Identifier(target_schema), Identifier(target_table)
+                )
+                + SQL(",").join(Identifier(c) for c in ri_cols + non_ri_cols)
+                + SQL(") ")
+                + self.generate_merge_query(objects, schema_spec, extra_quals),
+                extra_qual_args,
+            )
+            return
+
         # Assume that the target table already has the required schema (including PKs)
         # and use that to generate queries to apply fragments.
         cols = self._schema_spec_to_cols(schema_spec)
@@ -1479,6 +2072,151 @@ def get_change_key(schema_spec: TableSchema) -> List[Tuple[str, str]]:
     return [(c.name, c.pg_type) for c in schema_spec if c.pg_type in PG_INDEXABLE_TYPES]
 
 
+def _insert_keys_query(schema: str, table: str, ri_cols: List[str], keys: Composable) -> Composed:
+    """
+    Build a query inserting replica identities into a fragment. Takes the upserted/deleted
+    flag as its only argument.
+
+    :param keys: Query returning the replica identity values.
+    """
+    return (
+        SQL("INSERT INTO {}.{} (").format(Identifier(schema), Identifier(table))
+        + SQL(",").join(Identifier(c) for c in [SG_UD_FLAG] + ri_cols)
+        + SQL(") SELECT %s, v.* FROM (")
+        + keys
+        + SQL(") v")
+    )
+
+
+def _format_array_element(value: Any) -> str:
+    """Format a value as an element (or, if it's a list, as the whole) of an array literal."""
+    if value is None:
+        return "NULL"
+    if isinstance(value, list):
+        return "{" + ",".join(_format_array_element(v) for v in value) + "}"
+    if isinstance(value, dict):
+        value = json.dumps(value)
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _format_copy_value(value: Any, pg_type: Optional[str] = None) -> str:
+    """
+    Format a value for COPY in the text format.
+
+    :param value: Value to format
+    :param pg_type: Type of the column the value goes into. Values from the audit log are
+        JSON-decoded, so this is needed to tell apart array and JSON values.
+    """
+    if value is None:
+        return "\\N"
+    if pg_type in ("json", "jsonb"):
+        value = json.dumps(value)
+    elif pg_type and pg_type.endswith("[]") and isinstance(value, list):
+        value = _format_array_element(value)
+    elif isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+class _CopyStream:
+    """
+    File-like object producing rows in the COPY text format as they're read, so that
+    `copy_expert` can send them to the engine without building the whole input in memory.
+    """
+
+    def __init__(
+        self, rows: Iterable[Sequence[Any]], pg_types: Optional[Sequence[str]] = None
+    ) -> None:
+        """
+        :param rows: Rows to output
+        :param pg_types: Types of the columns in the rows, used to format arrays and JSON.
+        """
+        types: Iterable[Optional[str]] = pg_types or itertools.repeat(None)
+        self._lines = (
+            "\t".join(_format_copy_value(v, t) for v, t in zip(row, types)) + "\n" for row in rows
+        )
+        self._buffer = ""
+
+    def read(self, size: int = -1) -> str:
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        while size < 0 or length < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            chunks.append(line)
+            length += len(line)
+        data = "".join(chunks)
+        if size < 0:
+            self._buffer = ""
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+
+def _jsonb_field(row: Composable, column: str, pg_type: str) -> Composed:
+    """Extract a value from a row stored in the audit log as JSON and cast it to its column type."""
+    value = SQL("({}) ->> {}").format(row, Literal(column))
+    if not pg_type.endswith("[]"):
+        return SQL("(") + value + SQL(")::" + pg_type)
+    # Arrays from row_to_json() are JSON arrays rather than Postgres array literals
+    # (but changed fields are stored as text).
+    json_value = SQL("({}) -> {}").format(row, Literal(column))
+    return SQL(
+        "CASE WHEN jsonb_typeof({0}) = 'array' "
+        "THEN ARRAY(SELECT jsonb_array_elements_text({0}))::" + pg_type + " "
+        "ELSE ({1})::" + pg_type + " END"
+    ).format(json_value, value)
+
+
+def select_changed_keys(changes_table: str, table_schema: TableSchema, upserted: bool) -> Composed:
+    """
+    Get a query returning the replica identities of rows upserted or deleted by the changes
+    in a table created by `PsycopgEngine.conflate_pending_changes`.
+
+    :param changes_table: Temporary table with conflated changes
+    :param table_schema: Schema of the changed table
+    :param upserted: Whether to return upserted or deleted rows
+    :return: Query returning the replica identity columns, cast to their types.
+    """
+    return (
+        SQL("SELECT ")
+        + SQL(",").join(
+            _jsonb_field(SQL("c.sg_ri"), c, t) + SQL(" AS ") + Identifier(c)
+            for c, t in get_change_key(table_schema)
+        )
+        + SQL(" FROM pg_temp.{} c WHERE ").format(Identifier(changes_table))
+        + SQL("c.sg_upserted" if upserted else "NOT c.sg_upserted")
+    )
+
+
+def select_old_rows(changes_table: str, table_schema: TableSchema) -> Composed:
+    """
+    Get a query returning the old values of rows updated or deleted by the changes
+    in a table created by `PsycopgEngine.conflate_pending_changes`.
+
+    :param changes_table: Temporary table with conflated changes
+    :param table_schema: Schema of the changed table
+    :return: Query returning the table's columns in order, cast to their types.
+    """
+    return (
+        SQL("SELECT ")
+        + SQL(",").join(
+            _jsonb_field(SQL("c.sg_old_row || c.sg_ri"), c.name, c.pg_type)
+            + SQL(" AS ")
+            + Identifier(c.name)
+            for c in table_schema
+        )
+        + SQL(" FROM pg_temp.{} c WHERE c.sg_old_row <> '{{}}'").format(Identifier(changes_table))
+    )
+
+
 def _split_ri_cols(
     action: str,
     row_data: Dict[str, Any],
@@ -1591,6 +2329,134 @@ def _convert_audit_change(
     ]
 
 
+# Marker for values of TOASTed columns that test_decoding doesn't output because they didn't change.
+_UNCHANGED_TOAST = object()
+
+
+def _parse_quoted(data: str, pos: int) -> Tuple[str, int]:
+    """Parse a quoted string (with the quote escaped by doubling it) starting at pos."""
+    quote = data[pos]
+    chunks = []
+    pos += 1
+    while True:
+        end = data.index(quote, pos)
+        chunks.append(data[pos:end])
+        if not data.startswith(quote * 2, end):
+            return "".join(chunks), end + 1
+        chunks.append(quote)
+        pos = end + 2
+
+
+def _parse_decoded_tuple(data: str, pos: int = 0) -> Tuple[Dict[str, Any], int]:
+    """
+    Parse a tuple output by test_decoding (`col[type]:value col2[type]:value...`)
+    into a dictionary of column names and values in their text representation.
+
+    :return: Dictionary and the position in the string where the tuple ends.
+    """
+    values: Dict[str, Any] = {}
+    if data.startswith("(no-tuple-data)", pos):
+        return values, len(data)
+    while pos < len(data) and not data.startswith("new-tuple:", pos):
+        if data[pos] == '"':
+            column, pos = _parse_quoted(data, pos)
+        else:
+            end = data.index("[", pos)
+            column, pos = data[pos:end], end
+        pos = data.index("]:", pos) + 2
+
+        value: Any
+        if data[pos] == "'":
+            value, pos = _parse_quoted(data, pos)
+        elif data.startswith("B'", pos):
+            # Bit strings
+            value, pos = _parse_quoted(data, pos + 1)
+        else:
+            end = data.find(" ", pos)
+            end = len(data) if end == -1 else end
+            value = data[pos:end]
+            pos = end
+            if value == "null":
+                value = None
+            elif value == "unchanged-toast-datum":
+                value = _UNCHANGED_TOAST
+        values[column] = value
+        # Skip the space before the next column
+        pos += 1
+    return values, pos
+
+
+def _parse_decoded_change(
+    data: str,
+) -> Optional[Tuple[str, Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]:
+    """
+    Parse a change output by test_decoding (after the table name).
+
+    :return: Tuple of (action, old row, new row) or None if the change isn't
+        an INSERT/UPDATE/DELETE with the old row logged.
+    """
+    action, _, rest = data.partition(": ")
+    if action == "INSERT":
+        return "I", None, _parse_decoded_tuple(rest)[0]
+    if action == "DELETE" and rest != "(no-tuple-data)":
+        return "D", _parse_decoded_tuple(rest)[0], None
+    if action == "UPDATE" and rest.startswith("old-key: "):
+        old_row, pos = _parse_decoded_tuple(rest, len("old-key: "))
+        new_row, _ = _parse_decoded_tuple(rest, pos + len("new-tuple: "))
+        return (
+            "U",
+            old_row,
+            {c: old_row.get(c) if v is _UNCHANGED_TOAST else v for c, v in new_row.items()},
+        )
+    return None
+
+
+def _audit_log_insert_query(table_schema: TableSchema) -> Composed:
+    """
+    Build a query moving decoded changes to a table from the sg_decoded_changes table into
+    the audit log, in the same format as the audit trigger logs them (see audit_trigger.sql).
+    Takes the schema and the name of the table as arguments.
+    """
+
+    def _to_row(column: str) -> Composed:
+        # Turn the text values back into the column types, so that the JSON is the same
+        # as the one from row_to_json()
+        return (
+            SQL("CASE WHEN s.{0} IS NULL THEN NULL ELSE (SELECT to_jsonb(r) FROM (SELECT ").format(
+                Identifier(column)
+            )
+            + SQL(",").join(
+                SQL("(s.{} ->> {})::" + c.pg_type + " AS {}").format(
+                    Identifier(column), Literal(c.name), Identifier(c.name)
+                )
+                for c in table_schema
+            )
+            + SQL(") r) END")
+        )
+
+    return (
+        SQL(
+            "INSERT INTO {}.logged_actions (schema_name, table_name, action, row_data, changed_fields) "
+            "SELECT s.schema_name, s.table_name, s.action, "
+            "CASE WHEN s.action = 'I' THEN s.new_row ELSE s.old_row END, s.changed_fields "
+            "FROM (SELECT c.*, CASE WHEN c.action = 'U' THEN "
+            "(SELECT jsonb_object_agg(n.key, n.value) FROM jsonb_each_text(c.new_row) n "
+            "JOIN jsonb_each_text(c.old_row) o ON n.key = o.key "
+            "AND n.value IS DISTINCT FROM o.value) END AS changed_fields "
+            "FROM (SELECT s.sg_seq, s.schema_name, s.table_name, s.action, "
+        ).format(Identifier(_AUDIT_SCHEMA))
+        + _to_row("old_row")
+        + SQL(" AS old_row, ")
+        + _to_row("new_row")
+        + SQL(
+            " AS new_row FROM sg_decoded_changes s "
+            "WHERE s.schema_name = %s AND s.table_name = %s) c) s "
+            "WHERE s.action <> 'U' OR s.changed_fields IS NOT NULL "
+            "ORDER BY s.sg_seq"
+        )
+    )
+
+
 _KIND = {"I": 0, "D": 1, "U": 2}
 
 
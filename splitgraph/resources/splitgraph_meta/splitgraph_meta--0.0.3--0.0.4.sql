@@ -0,0 +1,21 @@
+-- Cache of layered querying plans (fragments that a query against a table has to scan and
+-- how they're grouped), shared between all sessions on the engine. Images are immutable,
+-- so cached plans never need to be invalidated, only evicted when the cache is full.
+--
+-- plan_key:  hash of the repository, image, table, qualifiers and columns the plan is for
+-- plan:      plan contents (see splitgraph.core.query_plan_cache)
+-- hits:      number of times the plan has been fetched from the cache
+-- last_used: Timestamp (UTC) this plan was last fetched, used to evict the least recently used plans.
+CREATE TABLE splitgraph_meta.query_plan_cache (
+    plan_key varchar NOT NULL PRIMARY KEY,
+    plan jsonb NOT NULL,
+    hits integer NOT NULL DEFAULT 0,
+    last_used timestamp NOT NULL
+);
+
+CREATE INDEX idx_query_plan_cache_last_used ON splitgraph_meta.query_plan_cache (last_used);
+
+-- Counters for cache hits and misses. These are sequences rather than columns so that
+-- concurrent queries don't have to lock the same row to update them.
+CREATE SEQUENCE splitgraph_meta.query_plan_cache_hits;
+CREATE SEQUENCE splitgraph_meta.query_plan_cache_misses;
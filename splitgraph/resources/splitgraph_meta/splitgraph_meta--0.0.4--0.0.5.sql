@@ -0,0 +1,171 @@
+-- Typed copy of the range index (objects.index -> 'range'), so that fragments can be
+-- filtered using GiST indexes instead of extracting and casting bounds from JSONB for
+-- every object.
+--
+-- Every indexed column with a supported type is stored as a range of one of three
+-- families (the other columns are only filtered using the JSONB index):
+--
+-- numeric_range:   bigint, integer, smallint, numeric, double precision
+-- timestamp_range: timestamp, date
+-- text_range:      text, character varying (ordered with the C collation, same as the indexer)
+--
+-- Real columns aren't stored: their bounds are the shortest text representations of
+-- single precision values and comparing them exactly as numerics would discard objects
+-- that Postgres considers to match (after casting the qualifier value to real).
+--
+-- A NULL range means that the column only has NULLs in the object (so no comparison
+-- with it is true); a missing row means that the object might contain any value.
+--
+-- Rows are maintained by triggers: when a table is registered, its objects' ranges are
+-- typed using the table's schema. When an object is reindexed, its ranges are rebuilt.
+CREATE TYPE splitgraph_meta.textrange AS RANGE (
+    SUBTYPE = text,
+    COLLATION = "C"
+);
+
+CREATE TABLE splitgraph_meta.object_ranges (
+    object_id varchar NOT NULL,
+    column_name varchar NOT NULL,
+    numeric_range numrange,
+    timestamp_range tsrange,
+    text_range splitgraph_meta.textrange,
+    PRIMARY KEY (object_id, column_name),
+    CONSTRAINT or_fk FOREIGN KEY (object_id) REFERENCES splitgraph_meta.objects ON DELETE CASCADE
+);
+
+CREATE INDEX idx_object_ranges_numeric ON splitgraph_meta.object_ranges USING gist (numeric_range);
+
+CREATE INDEX idx_object_ranges_timestamp ON splitgraph_meta.object_ranges USING gist (timestamp_range);
+
+CREATE INDEX idx_object_ranges_text ON splitgraph_meta.object_ranges USING gist (text_range);
+
+-- Used to find the schema of an object when it gets reindexed.
+CREATE INDEX idx_tables_object_ids ON splitgraph_meta.tables USING gin (object_ids);
+
+CREATE OR REPLACE FUNCTION splitgraph_meta.index_object_ranges (
+    _object_ids varchar[],
+    _table_schema jsonb
+)
+    RETURNS void
+    AS $$
+    INSERT INTO splitgraph_meta.object_ranges (object_id, column_name, numeric_range,
+        timestamp_range, text_range)
+    SELECT
+        object_id,
+        column_name,
+        CASE WHEN family = 'numeric'
+            AND lower_bound IS NOT NULL
+            AND upper_bound IS NOT NULL THEN
+            numrange(lower_bound::numeric, upper_bound::numeric, '[]')
+        END,
+        CASE WHEN family = 'timestamp'
+            AND lower_bound IS NOT NULL
+            AND upper_bound IS NOT NULL THEN
+            tsrange(lower_bound::timestamp, upper_bound::timestamp, '[]')
+        END,
+        CASE WHEN family = 'text'
+            AND lower_bound IS NOT NULL
+            AND upper_bound IS NOT NULL THEN
+            splitgraph_meta.textrange (lower_bound, upper_bound, '[]')
+        END
+    FROM (
+        SELECT
+            o.object_id,
+            r.key AS column_name,
+            r.value ->> 0 AS lower_bound,
+            r.value ->> 1 AS upper_bound,
+            CASE regexp_replace(c.value ->> 2, '[\(\[].*$', '')
+            WHEN 'bigint' THEN
+                'numeric'
+            WHEN 'integer' THEN
+                'numeric'
+            WHEN 'smallint' THEN
+                'numeric'
+            WHEN 'numeric' THEN
+                'numeric'
+            WHEN 'double precision' THEN
+                'numeric'
+            WHEN 'timestamp' THEN
+                'timestamp'
+            WHEN 'timestamp without time zone' THEN
+                'timestamp'
+            WHEN 'date' THEN
+                'timestamp'
+            WHEN 'text' THEN
+                'text'
+            WHEN 'character varying' THEN
+                'text'
+            END AS family
+        FROM
+            splitgraph_meta.objects o,
+            jsonb_each(o.index -> 'range') r,
+            jsonb_array_elements(_table_schema) c
+        WHERE
+            o.object_id = ANY (_object_ids)
+            AND jsonb_typeof(o.index -> 'range') = 'object'
+            AND c.value ->> 1 = r.key) b
+WHERE
+    family IS NOT NULL
+ON CONFLICT (object_id,
+    column_name)
+    DO NOTHING;
+$$
+LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION splitgraph_meta.index_table_object_ranges ()
+    RETURNS TRIGGER
+    AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND NEW.table_schema IS NOT DISTINCT FROM OLD.table_schema THEN
+        -- add_table appends objects to existing tables: only index the new ones.
+        PERFORM
+            splitgraph_meta.index_object_ranges (ARRAY (
+                    SELECT
+                        unnest(NEW.object_ids)
+                    EXCEPT
+                    SELECT
+                        unnest(OLD.object_ids)), NEW.table_schema);
+    ELSE
+        PERFORM
+            splitgraph_meta.index_object_ranges (NEW.object_ids, NEW.table_schema);
+    END IF;
+    RETURN NULL;
+END;
+$$
+LANGUAGE plpgsql;
+
+CREATE TRIGGER sg_index_table_object_ranges_trigger
+    AFTER INSERT OR UPDATE ON splitgraph_meta.tables
+    FOR EACH ROW
+    EXECUTE PROCEDURE splitgraph_meta.index_table_object_ranges ();
+
+CREATE OR REPLACE FUNCTION splitgraph_meta.reindex_object_ranges ()
+    RETURNS TRIGGER
+    AS $$
+BEGIN
+    DELETE FROM splitgraph_meta.object_ranges
+    WHERE object_id = NEW.object_id;
+    PERFORM
+        splitgraph_meta.index_object_ranges (ARRAY[NEW.object_id], (
+                SELECT
+                    t.table_schema
+                FROM splitgraph_meta.tables t
+                WHERE
+                    t.object_ids @> ARRAY[NEW.object_id]
+                LIMIT 1));
+    RETURN NULL;
+END;
+$$
+LANGUAGE plpgsql;
+
+CREATE TRIGGER sg_reindex_object_ranges_trigger
+    AFTER UPDATE OF index ON splitgraph_meta.objects
+    FOR EACH ROW
+    WHEN (OLD.index IS DISTINCT FROM NEW.index)
+    EXECUTE PROCEDURE splitgraph_meta.reindex_object_ranges ();
+
+-- Backfill the ranges for existing tables.
+SELECT
+    splitgraph_meta.index_object_ranges (object_ids, table_schema)
+FROM
+    splitgraph_meta.tables;
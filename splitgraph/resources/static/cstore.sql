@@ -116,3 +116,34 @@ CREATE OR REPLACE FUNCTION splitgraph_api.object_exists (
 $BODY$
 LANGUAGE plpython3u
 VOLATILE;
+
+-- Conflation of pending changes from the audit log (see
+-- splitgraph.core.fragment_manager._conflate_changes for the client-side version).
+-- The state is [upserted, old row, new row] or NULL if the changes to the row
+-- have cancelled each other out.
+CREATE OR REPLACE FUNCTION splitgraph_api.conflate_change (
+    state jsonb,
+    upserted boolean,
+    old_row jsonb,
+    new_row jsonb
+)
+    RETURNS jsonb
+    AS $$
+    SELECT
+        CASE WHEN state IS NULL THEN
+            jsonb_build_array(upserted, old_row, new_row)
+        WHEN state -> 1 = new_row THEN
+            NULL
+        ELSE
+            jsonb_build_array(upserted, state -> 1, new_row)
+        END
+$$
+LANGUAGE sql
+IMMUTABLE;
+
+DROP AGGREGATE IF EXISTS splitgraph_api.conflate_changes (boolean, jsonb, jsonb);
+
+CREATE AGGREGATE splitgraph_api.conflate_changes (boolean, jsonb, jsonb) (
+    SFUNC = splitgraph_api.conflate_change,
+    STYPE = jsonb
+);
@@ -16,7 +16,7 @@ BEGIN
     -- warn the user if there are API version incompatibilities.
     -- If you bump this, also bump the client expected version
     -- in splitgraph.engine.postgres.engine.
-    RETURN '0.0.1';
+    RETURN '0.1.0';
 END;
 $$
 LANGUAGE plpgsql
@@ -455,6 +455,117 @@ $$
 LANGUAGE plpgsql
 SECURITY DEFINER SET search_path = splitgraph_meta, pg_temp;
 
+-- filter_objects_by_range(object_ids, quals): return the objects that might match the qualifiers
+-- according to their typed range index (splitgraph_meta.object_ranges). Objects that aren't
+-- registered are discarded.
+--
+-- quals is a list of clauses in conjunctive normal form, each being a list of qualifiers
+-- [column_name, range_type, lower, upper, bounds]. range_type is one of numeric, timestamp or text and
+-- lower, upper and bounds are passed to the range constructor: an object might match the qualifier
+-- if the range of values of the column intersects this range or if the column isn't in its index.
+CREATE OR REPLACE FUNCTION splitgraph_api.filter_objects_by_range (
+    _object_ids varchar[],
+    _quals jsonb
+)
+    RETURNS SETOF varchar
+    AS $$
+DECLARE
+    result varchar[];
+    clause jsonb;
+    qual jsonb;
+    matched varchar[];
+BEGIN
+    result := ARRAY (
+        SELECT o.object_id
+        FROM splitgraph_meta.objects o
+        WHERE o.object_id = ANY (_object_ids));
+    FOR clause IN
+    SELECT *
+    FROM jsonb_array_elements(_quals)
+    LOOP
+        matched := ARRAY[]::varchar[];
+        FOR qual IN
+        SELECT *
+        FROM jsonb_array_elements(clause)
+        LOOP
+            IF qual ->> 1 = 'numeric' THEN
+                matched := matched || ARRAY (
+                    SELECT r.object_id
+                    FROM splitgraph_meta.object_ranges r
+                    WHERE r.object_id = ANY (result)
+                        AND r.column_name = qual ->> 0
+                        AND r.numeric_range && numrange((qual ->> 2)::numeric, (qual ->> 3)::numeric,
+                            qual ->> 4));
+            ELSIF qual ->> 1 = 'timestamp' THEN
+                matched := matched || ARRAY (
+                    SELECT r.object_id
+                    FROM splitgraph_meta.object_ranges r
+                    WHERE r.object_id = ANY (result)
+                        AND r.column_name = qual ->> 0
+                        AND r.timestamp_range && tsrange((qual ->> 2)::timestamp,
+                            (qual ->> 3)::timestamp, qual ->> 4));
+            ELSIF qual ->> 1 = 'text' THEN
+                matched := matched || ARRAY (
+                    SELECT r.object_id
+                    FROM splitgraph_meta.object_ranges r
+                    WHERE r.object_id = ANY (result)
+                        AND r.column_name = qual ->> 0
+                        AND r.text_range && splitgraph_meta.textrange (qual ->> 2, qual ->> 3,
+                            qual ->> 4));
+            ELSE
+                RAISE invalid_parameter_value
+                USING message = 'Unknown range type ' || (qual ->> 1);
+            END IF;
+            -- Objects that don't have this column in the index might match the qualifier.
+            matched := matched || ARRAY (
+                SELECT o
+                FROM unnest(result) AS o
+                WHERE NOT EXISTS (
+                        SELECT 1
+                        FROM splitgraph_meta.object_ranges r
+                        WHERE r.object_id = o
+                            AND r.column_name = qual ->> 0));
+        END LOOP;
+        result := ARRAY (
+            SELECT unnest(result)
+            INTERSECT
+            SELECT unnest(matched));
+    END LOOP;
+    RETURN QUERY
+    SELECT unnest(result);
+END
+$$
+LANGUAGE plpgsql
+SECURITY DEFINER SET search_path = splitgraph_meta, pg_temp;
+
+-- get_object_ranges(object_ids, column_name): get the range of values of a column in multiple
+-- objects from their typed range index. Bounds are returned as text. Objects that don't have
+-- the column in the index aren't returned.
+CREATE OR REPLACE FUNCTION splitgraph_api.get_object_ranges (
+    _object_ids varchar[],
+    _column_name varchar
+)
+    RETURNS TABLE (
+            object_id varchar,
+            lower_bound text,
+            upper_bound text
+        )
+        AS $$
+BEGIN
+    RETURN QUERY
+    SELECT r.object_id,
+        COALESCE(lower(r.numeric_range)::text, to_json(lower(r.timestamp_range)) #>> '{}',
+            lower(r.text_range)),
+        COALESCE(upper(r.numeric_range)::text, to_json(upper(r.timestamp_range)) #>> '{}',
+            upper(r.text_range))
+    FROM splitgraph_meta.object_ranges r
+    WHERE r.object_id = ANY (_object_ids)
+        AND r.column_name = _column_name;
+END
+$$
+LANGUAGE plpgsql
+SECURITY DEFINER SET search_path = splitgraph_meta, pg_temp;
+
 -- get_object_locations(object_ids): get external locations for objects
 CREATE OR REPLACE FUNCTION splitgraph_api.get_object_locations (
     object_ids varchar[]
@@ -54,6 +54,17 @@ def test_commandline_basics(pg_repo_local):
     result = runner.invoke(sql_c, ["--json", 'SELECT * FROM "test/pg_mount".fruits'])
     assert result.output == '[[2, "orange"], [3, "mayonnaise"]]\n'
 
+    # Test results streamed from a server-side cursor in multiple batches
+    result = runner.invoke(
+        sql_c,
+        ["--json", "--show-all", 'SELECT * FROM "test/pg_mount".fruits ORDER BY fruit_id'],
+    )
+    assert result.output == '[[2, "orange"], [3, "mayonnaise"]]\n'
+    result = runner.invoke(sql_c, ["SELECT * FROM generate_series(1, 20)"])
+    assert result.output == "\n".join("%2d" % i for i in range(1, 11)) + "\n...\n"
+    result = runner.invoke(sql_c, ["--show-all", "SELECT * FROM generate_series(1, 20)"])
+    assert result.output == "\n".join("%2d" % i for i in range(1, 21)) + "\n"
+
     # Test schema search_path
     result = runner.invoke(sql_c, ["--schema", "test/pg_mount", "SELECT * FROM fruits"])
     assert "mayonnaise" in result.output
@@ -21,7 +21,7 @@ from splitgraph.commandline import (
     eval_c,
     cli,
 )
-from splitgraph.commandline.common import ImageType, RepositoryType
+from splitgraph.commandline.common import ImageType, RepositoryType, emit_sql_results
 from splitgraph.commandline.example import generate_c, alter_c, splitfile_c
 from splitgraph.commandline.misc import (
     _get_binary_url_for,
@@ -49,6 +49,16 @@ def test_image_spec_parsing():
     )
 
 
+def test_emit_sql_results_batches(capsys):
+    # Columns in later batches line up with the first batch
+    emit_sql_results(
+        iter([(1, "apple"), (22, "orange"), (3, "kumquat"), (4, "fig")]),
+        show_all=True,
+        batch_size=2,
+    )
+    assert capsys.readouterr().out == " 1  apple\n22  orange\n 3  kumquat\n 4  fig\n"
+
+
 def test_image_repo_parsing_errors(pg_repo_local):
     repo = Repository("test", "pg_mount")
     assert ImageType(get_image=True, default="latest")("test/pg_mount")[1] == repo.images["latest"]
@@ -157,6 +157,61 @@ def test_bloom_index_querying(local_engine_empty):
     )
 
 
+def test_bloom_index_xxh3(local_engine_empty):
+    pytest.importorskip("xxhash")
+
+    # Same dataset as in test_bloom_index_querying, but value_2 uses XXH3 instead of SHA256.
+    OUTPUT.init()
+    OUTPUT.run_sql("CREATE TABLE test (key INTEGER PRIMARY KEY, value_1 VARCHAR, value_2 INTEGER)")
+    for i in range(26):
+        OUTPUT.run_sql("INSERT INTO test VALUES (%s, %s, %s)", (i + 1, chr(ord("a") + i), i * 2))
+
+    head = OUTPUT.commit(
+        chunk_size=9,
+        extra_indexes={
+            "test": {
+                "bloom": {
+                    "value_1": {"probability": 0.01},
+                    "value_2": {"probability": 0.01, "hash_function": "xxh3"},
+                }
+            }
+        },
+    )
+
+    objects = head.get_table("test").objects
+    assert len(objects) == 3
+    index = OUTPUT.objects.get_object_meta(objects)[objects[0]].object_index
+
+    # SHA256 filters are stored in the same format as before, XXH3 ones record the
+    # format version.
+    assert index["bloom"]["value_1"] == [7, mock.ANY]
+    assert index["bloom"]["value_2"] == [7, mock.ANY, 2]
+    assert describe(index["bloom"]["value_2"]).endswith("hash xxh3")
+
+    def test_filter(quals, result):
+        assert filter_bloom_index(OUTPUT.engine, objects, quals) == result
+
+    test_filter([[("value_2", "=", "10")]], [objects[0]])
+    test_filter([[("value_2", "=", "20")]], [objects[1]])
+    test_filter([[("value_2", "=", "40")]], [objects[2]])
+    test_filter([[("value_2", "=", "39")]], [])
+    # False positive with this hash function.
+    test_filter([[("value_2", "=", "37")]], [objects[0]])
+
+    test_filter([[("value_1", "=", "b"), ("value_2", "=", "38")]], [objects[0], objects[2]])
+    test_filter([[("value_1", "=", "c")], [("value_2", "=", "40")]], [])
+
+    # Without xxhash, XXH3 filters can't be used and all objects might match.
+    with mock.patch("splitgraph.core.indexing.bloom.xxhash", None):
+        test_filter([[("value_2", "=", "39")]], objects)
+        with pytest.raises(ValueError):
+            OUTPUT.objects.generate_object_index(
+                objects[0],
+                head.get_table("test").table_schema,
+                extra_indexes={"bloom": {"value_2": {"size": 16, "hash_function": "xxh3"}}},
+            )
+
+
 def test_bloom_index_deletions(local_engine_empty):
     # Check the bloom index fingerprint includes both the old and the new values of deleted/added cells.
 
@@ -10,7 +10,7 @@ from psycopg2.sql import SQL, Identifier
 from test.splitgraph.commands.test_layered_querying import _prepare_fully_remote_repo
 from test.splitgraph.conftest import OUTPUT, PG_DATA, SMALL_OBJECT_SIZE
 
-from splitgraph.config import SPLITGRAPH_META_SCHEMA
+from splitgraph.config import CONFIG, SPLITGRAPH_META_SCHEMA
 from splitgraph.core.fragment_manager import Digest
 from splitgraph.core.metadata_manager import OBJECT_COLS
 from splitgraph.core.object_manager import ObjectManager
@@ -231,6 +231,179 @@ def test_commit_chunking_order(local_engine_empty):
         ) == list(range(max_key, min_key - 1, -1))
 
 
+def test_commit_chunking_parallel(local_engine_empty):
+    OUTPUT.init()
+    OUTPUT.run_sql("CREATE TABLE test (key INTEGER PRIMARY KEY, value_1 VARCHAR, value_2 INTEGER)")
+    for i in range(11):
+        OUTPUT.run_sql("INSERT INTO test VALUES (%s, %s, %s)", (i + 1, chr(ord("z") - i), i * 2))
+
+    serial = OUTPUT.commit(chunk_size=5)
+    serial_objects = serial.get_table("test").objects
+
+    # Store the chunks using multiple connections: objects (and their order in the table)
+    # must be the same as when committing with a single connection.
+    parallel = OUTPUT.commit(snap_only=True, chunk_size=5, chunk_workers=3, overwrite=True)
+    parallel_objects = parallel.get_table("test").objects
+    assert parallel_objects == serial_objects
+    assert len(parallel_objects) == 3
+    assert sorted(OUTPUT.objects.get_object_meta(parallel_objects)) == sorted(serial_objects)
+
+    # Check the shared partition table has been cleaned up.
+    assert not [
+        t
+        for t in local_engine_empty.get_all_tables(SPLITGRAPH_META_SCHEMA)
+        if t.startswith("sg_tmp_")
+    ]
+
+    parallel.checkout()
+    assert OUTPUT.run_sql(
+        "SELECT key FROM test ORDER BY key", return_shape=ResultShape.MANY_ONE
+    ) == list(range(1, 12))
+
+
+def test_commit_tables_parallel(local_engine_empty):
+    OUTPUT.init()
+    for table in ["test_1", "test_2", "test_3"]:
+        OUTPUT.run_sql(
+            SQL("CREATE TABLE {} (key INTEGER PRIMARY KEY, value VARCHAR)").format(
+                Identifier(table)
+            )
+        )
+        # test_1 and test_2 have the same contents and so share objects.
+        OUTPUT.run_sql(
+            SQL("INSERT INTO {} SELECT i, 'value_' || i FROM generate_series(1, 10) i").format(
+                Identifier(table)
+            )
+        )
+    OUTPUT.run_sql("DELETE FROM test_3 WHERE key > 5")
+
+    base = OUTPUT.commit(chunk_size=5, table_workers=3)
+    assert base.get_table("test_1").objects == base.get_table("test_2").objects
+    assert len(base.get_table("test_1").objects) == 2
+    assert len(base.get_table("test_3").objects) == 1
+
+    OUTPUT.run_sql("UPDATE test_1 SET value = 'updated' WHERE key = 1")
+    OUTPUT.run_sql("DELETE FROM test_2 WHERE key = 10")
+
+    # If storing one of the tables fails, the image isn't created and the pending changes
+    # are kept.
+    original_record = OUTPUT.objects.record_table_as_patch
+
+    def _record(old_table, *args, **kwargs):
+        if old_table.table_name == "test_2":
+            raise ValueError("Failed to store the table")
+        return original_record(old_table, *args, **kwargs)
+
+    with mock.patch.object(OUTPUT.objects, "record_table_as_patch", side_effect=_record):
+        with pytest.raises(ValueError):
+            OUTPUT.commit(table_workers=3)
+    OUTPUT.rollback_engines()
+    assert len(OUTPUT.images()) == 1
+    assert OUTPUT.has_pending_changes()
+
+    head = OUTPUT.commit(table_workers=3)
+    assert not OUTPUT.has_pending_changes()
+    assert len(head.get_table("test_1").objects) == 3
+    assert len(head.get_table("test_2").objects) == 3
+    assert head.get_table("test_3").objects == base.get_table("test_3").objects
+    assert OUTPUT.diff("test_1", base, head) == [(False, (1, "value_1")), (True, (1, "updated"))]
+    assert OUTPUT.diff("test_2", base, head) == [(False, (10, "value_10"))]
+
+    head.checkout()
+    assert OUTPUT.run_sql("SELECT COUNT(*) FROM test_2", return_shape=ResultShape.ONE_ONE) == 9
+
+
+def test_commit_tables_parallel_worker_budget(local_engine_empty):
+    # Table workers and the workers storing each table's chunks share the connection pool.
+    OUTPUT.init()
+    for table in ["test_1", "test_2"]:
+        OUTPUT.run_sql(
+            SQL("CREATE TABLE {} (key INTEGER PRIMARY KEY, value VARCHAR)").format(
+                Identifier(table)
+            )
+        )
+        OUTPUT.run_sql(
+            SQL("INSERT INTO {} SELECT i, 'value_' || i FROM generate_series(1, 20) i").format(
+                Identifier(table)
+            )
+        )
+
+    original_store_chunks = OUTPUT.objects._store_chunks
+    with mock.patch.dict(CONFIG, {"SG_ENGINE_POOL": "5"}):
+        with mock.patch.object(
+            OUTPUT.objects, "_store_chunks", wraps=original_store_chunks
+        ) as store_chunks:
+            head = OUTPUT.commit(chunk_size=5, table_workers=2, chunk_workers=4)
+
+    # 4 available connections: 2 table workers, each storing its chunks with 2 workers.
+    assert [c[0][2] for c in store_chunks.call_args_list] == [2, 2]
+    assert OUTPUT.objects._chunk_worker_limit is None
+    assert len(head.get_table("test_1").objects) == 4
+    assert head.get_table("test_1").objects == head.get_table("test_2").objects
+
+
+@pytest.mark.parametrize("tolerance", ["0", "0.5"])
+def test_commit_chunking_pk_boundaries(tolerance, local_engine_empty):
+    # Tables with a PK get chunked by ranges of PK values, either exactly or using
+    # boundaries estimated from a sample of the table.
+    OUTPUT.init()
+    OUTPUT.run_sql(
+        "CREATE TABLE test (key_1 INTEGER, key_2 VARCHAR, value INTEGER, PRIMARY KEY (key_1, key_2))"
+    )
+    OUTPUT.run_sql(
+        "INSERT INTO test SELECT i / 10, 'key_' || i % 10, i FROM generate_series(0, 999) i"
+    )
+
+    with mock.patch.dict(
+        "splitgraph.core.fragment_manager.CONFIG", {"SG_COMMIT_CHUNK_TOLERANCE": tolerance}
+    ):
+        head = OUTPUT.commit(chunk_size=100)
+
+    objects = head.get_table("test").objects
+    object_meta = OUTPUT.objects.get_object_meta(objects)
+    rows = [object_meta[o].rows_inserted for o in objects]
+    assert sum(rows) == 1000
+    if tolerance == "0":
+        assert rows == [100] * 10
+    else:
+        assert all(50 <= r <= 150 for r in rows[:-1])
+
+    # Chunks don't overlap and are ordered by PK.
+    pk_ranges = [tuple(object_meta[o].object_index["range"]["$pk"]) for o in objects]
+    assert all(left[1] < right[0] for left, right in zip(pk_ranges, pk_ranges[1:]))
+
+    head.checkout()
+    assert OUTPUT.run_sql("SELECT COUNT(DISTINCT value) FROM test") == [(1000,)]
+
+
+def test_commit_chunking_content_defined(local_engine_empty):
+    OUTPUT.init()
+    OUTPUT.run_sql("CREATE TABLE test (key INTEGER PRIMARY KEY, value VARCHAR)")
+    OUTPUT.run_sql("INSERT INTO test SELECT i, 'value_' || i FROM generate_series(1, 2000) i")
+
+    with mock.patch.dict(
+        "splitgraph.core.fragment_manager.CONFIG", {"SG_COMMIT_CHUNK_MODE": "content"}
+    ):
+        head = OUTPUT.commit(chunk_size=100)
+        old_objects = head.get_table("test").objects
+        object_meta = OUTPUT.objects.get_object_meta(old_objects)
+        assert sum(object_meta[o].rows_inserted for o in old_objects) == 2000
+        assert all(25 <= object_meta[o].rows_inserted <= 400 for o in old_objects[:-1])
+
+        # Change a couple of rows and store the table as a snapshot again: chunk boundaries
+        # only depend on the PKs around them, so most objects should be reused.
+        OUTPUT.run_sql("DELETE FROM test WHERE key = 500")
+        OUTPUT.run_sql("UPDATE test SET value = 'changed' WHERE key = 1500")
+        OUTPUT.run_sql("INSERT INTO test VALUES (2001, 'new')")
+        head = OUTPUT.commit(chunk_size=100, snap_only=True)
+        new_objects = head.get_table("test").objects
+
+    assert len(set(old_objects) - set(new_objects)) <= 4
+
+    head.checkout()
+    assert OUTPUT.run_sql("SELECT COUNT(1) FROM test") == [(2000,)]
+
+
 def test_commit_diff_splitting(local_engine_empty):
     # Similar setup to the chunking test
     OUTPUT.init()
@@ -1104,3 +1277,52 @@ def test_commit_diff_views(pg_repo_local):
     pg_repo_local.images[head.parent_id].checkout()
 
     assert not pg_repo_local.engine.table_exists(pg_repo_local.to_schema(), "test_view")
+
+
+def test_diff_fragments(local_engine_empty):
+    # Test the diff between images that only compares the fragments unique to each image
+    OUTPUT.init()
+    OUTPUT.run_sql("CREATE TABLE test (key INTEGER PRIMARY KEY, value VARCHAR)")
+    OUTPUT.run_sql("INSERT INTO test SELECT i, 'val_' || i FROM generate_series(1, 100) i")
+    base = OUTPUT.commit(chunk_size=10)
+    assert len(base.get_table("test").objects) == 10
+
+    OUTPUT.run_sql("UPDATE test SET value = 'updated' WHERE key = 5")
+    OUTPUT.run_sql("DELETE FROM test WHERE key = 55")
+    OUTPUT.run_sql("INSERT INTO test VALUES (101, 'new')")
+    head = OUTPUT.commit(split_changeset=True)
+
+    expected = [
+        (False, (5, "val_5")),
+        (False, (55, "val_55")),
+        (True, (5, "updated")),
+        (True, (101, "new")),
+    ]
+
+    with mock.patch("splitgraph.core.repository.slow_diff", side_effect=AssertionError):
+        # The patches don't overlap, so the aggregate diff is taken from their metadata.
+        with mock.patch.object(ObjectManager, "ensure_objects") as ensure_objects:
+            assert OUTPUT.diff("test", base, head, aggregate=True) == (2, 2, 0)
+            assert OUTPUT.diff("test", head, base, aggregate=True) == (2, 2, 0)
+        ensure_objects.assert_not_called()
+
+        assert OUTPUT.diff("test", base, head) == expected
+        assert OUTPUT.diff("test", head, base) == [(not a, r) for a, r in expected[2:]] + [
+            (not a, r) for a, r in expected[:2]
+        ]
+
+        # Rewrite the same row in two images: the changes cancel out.
+        OUTPUT.run_sql("UPDATE test SET value = 'val_5' WHERE key = 5")
+        new_head = OUTPUT.commit()
+        assert OUTPUT.diff("test", base, new_head, aggregate=False) == [
+            (False, (55, "val_55")),
+            (True, (101, "new")),
+        ]
+        assert OUTPUT.diff("test", base, new_head, aggregate=True) == (1, 1, 0)
+
+    # Schema changes fall back to the slow diff
+    OUTPUT.run_sql("ALTER TABLE test ADD COLUMN value_2 INTEGER")
+    changed_schema = OUTPUT.commit()
+    with mock.patch("splitgraph.core.repository.slow_diff", return_value=(0, 0, 0)) as slow_diff:
+        OUTPUT.diff("test", base, changed_schema, aggregate=True)
+    slow_diff.assert_called_once()
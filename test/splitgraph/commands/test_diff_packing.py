@@ -1,8 +1,13 @@
+from unittest import mock
+
 import pytest
 
 # Test cases: ops are a list of operations (with commit after each set);
 #             diffs are expected diffs produced by each operation.
+from splitgraph.core.common import manage_audit_triggers
 from splitgraph.core.fragment_manager import _conflate_changes
+from splitgraph.engine import ResultShape
+from splitgraph.exceptions import CheckoutError
 
 CASES = [
     [  # Insert + update changed into a single insert
@@ -138,3 +143,132 @@ def test_diff_conflation_insert_same(pg_repo_local):
     # Check delete + insert same cancel each other out.
     assert _conflate_changes({}, expected_changes) == {}
     assert pg_repo_local.diff("fruits", pg_repo_local.head, None) == []
+
+
+@pytest.mark.parametrize("test_case", CASES)
+@pytest.mark.parametrize("server_side", [True, False])
+def test_conflate_pending_changes_on_engine(pg_repo_local, test_case, server_side):
+    # Check the engine-side conflation gives the same changeset as the client-side one
+    # without committing in between the operations.
+    engine = pg_repo_local.engine
+    for operation, _ in test_case:
+        pg_repo_local.run_sql(operation)
+    pg_repo_local.commit_engines()
+
+    ri_cols = [c for c, _ in engine.get_change_key("test/pg_mount", "fruits")]
+    expected = _conflate_changes({}, engine.get_pending_changes("test/pg_mount", "fruits"))
+
+    if not server_side:
+        # Engines without the conflation aggregate fall back to conflating on the client.
+        engine.run_sql("DROP AGGREGATE splitgraph_api.conflate_changes (boolean, jsonb, jsonb)")
+
+    changed_rows = engine.conflate_pending_changes("test/pg_mount", "fruits", "sg_test_changes")
+    try:
+        assert changed_rows == len(expected)
+        assert engine.get_conflated_changes("sg_test_changes", ri_cols) == expected
+    finally:
+        engine.delete_table("pg_temp", "sg_test_changes")
+        # Bring the aggregate back
+        engine.rollback()
+
+
+@pytest.mark.parametrize("test_case", CASES)
+def test_diff_conflation_logical_decoding(pg_repo_local, test_case):
+    # Same as test_diff_conflation_on_commit, but with changes decoded from the WAL
+    # instead of recorded by the audit trigger.
+    engine = pg_repo_local.engine
+    with mock.patch.dict(engine.conn_params, {"SG_CHANGE_CAPTURE": "logical"}):
+        engine.initialize(skip_create_database=True)
+        try:
+            # Switch the checked out tables over from the audit trigger
+            manage_audit_triggers(engine)
+            engine.commit()
+            assert engine.get_tracked_tables() == [("test/pg_mount", "fruits")]
+            assert (
+                engine.run_sql(
+                    "SELECT COUNT(1) FROM information_schema.triggers "
+                    "WHERE event_object_schema = 'test/pg_mount'",
+                    return_shape=ResultShape.ONE_ONE,
+                )
+                == 0
+            )
+
+            for operation, expected_diff in test_case:
+                print("%r -> %r" % (operation, expected_diff))
+                pg_repo_local.run_sql(operation)
+                pg_repo_local.commit_engines()
+                assert pg_repo_local.diff("fruits", pg_repo_local.head, None) == expected_diff
+                head = pg_repo_local.commit()
+                assert (
+                    pg_repo_local.diff("fruits", pg_repo_local.head.parent_id, head)
+                    == expected_diff
+                )
+                assert not engine.has_pending_changes("test/pg_mount")
+        finally:
+            engine.untrack_tables(engine.get_tracked_tables())
+            engine.run_sql("SELECT pg_drop_replication_slot(%s)", (engine.replication_slot,))
+            engine.commit()
+
+
+def test_logical_decoding_truncate(pg_repo_local):
+    # TRUNCATE can't be replayed from the audit log: the table should stop being tracked
+    # and be stored as a full snapshot instead.
+    engine = pg_repo_local.engine
+    with mock.patch.dict(engine.conn_params, {"SG_CHANGE_CAPTURE": "logical"}):
+        engine.initialize(skip_create_database=True)
+        try:
+            manage_audit_triggers(engine)
+            engine.commit()
+
+            pg_repo_local.run_sql("INSERT INTO fruits VALUES (3, 'mayonnaise')")
+            pg_repo_local.commit_engines()
+            assert engine.get_changed_tables("test/pg_mount") == ["fruits"]
+
+            pg_repo_local.run_sql("TRUNCATE fruits")
+            pg_repo_local.run_sql("INSERT INTO fruits VALUES (4, 'kumquat')")
+            pg_repo_local.commit_engines()
+            assert engine.get_tracked_tables() == []
+            assert not engine.has_pending_changes("test/pg_mount")
+            assert pg_repo_local.has_pending_changes()
+
+            head = pg_repo_local.commit()
+            assert (
+                head.get_table("fruits").objects
+                != pg_repo_local.images[head.parent_id].get_table("fruits").objects
+            )
+            assert pg_repo_local.run_sql("SELECT * FROM fruits") == [(4, "kumquat")]
+            assert engine.get_tracked_tables() == [("test/pg_mount", "fruits")]
+
+            head.checkout(force=True)
+            assert pg_repo_local.run_sql("SELECT * FROM fruits") == [(4, "kumquat")]
+            assert not pg_repo_local.has_pending_changes()
+        finally:
+            engine.untrack_tables(engine.get_tracked_tables())
+            engine.run_sql("SELECT pg_drop_replication_slot(%s)", (engine.replication_slot,))
+            engine.commit()
+
+
+def test_logical_decoding_uncommitted_changes(pg_repo_local):
+    engine = pg_repo_local.engine
+    with mock.patch.dict(engine.conn_params, {"SG_CHANGE_CAPTURE": "logical"}):
+        engine.initialize(skip_create_database=True)
+        try:
+            manage_audit_triggers(engine)
+            engine.commit()
+
+            # Uncommitted changes can't be decoded yet: make sure they don't get missed.
+            pg_repo_local.run_sql("INSERT INTO fruits VALUES (3, 'mayonnaise')")
+            with pytest.raises(CheckoutError):
+                pg_repo_local.has_pending_changes()
+            with pytest.raises(CheckoutError):
+                pg_repo_local.images["latest"].checkout()
+
+            # Commits commit the transaction before looking at the changes.
+            head = pg_repo_local.commit()
+            assert pg_repo_local.diff("fruits", head.parent_id, head) == [(True, (3, "mayonnaise"))]
+            assert not pg_repo_local.has_pending_changes()
+        finally:
+            engine.rollback()
+            engine.untrack_tables(engine.get_tracked_tables())
+            engine.run_sql("SELECT pg_drop_replication_slot(%s)", (engine.replication_slot,))
+            engine.commit()
@@ -13,8 +13,9 @@ from splitgraph.core.common import META_TABLES
 from splitgraph.core.fragment_manager import get_chunk_groups
 from splitgraph.core.indexing.range import extract_min_max_pks
 from splitgraph.core.object_manager import ObjectManager
+from splitgraph.core.query_plan_cache import get_plan_cache
 from splitgraph.core.repository import clone, Repository
-from splitgraph.core.table import _generate_select_query
+from splitgraph.core.table import _generate_select_query, scan_tables_parallel
 from splitgraph.engine import ResultShape, _prepare_engine_config
 from splitgraph.engine.postgres.engine import PostgresEngine
 from splitgraph.exceptions import ObjectNotFoundError
@@ -162,6 +163,46 @@ class TestLayeredQuerying:
         assert len(query_plan.required_objects) == 4
         assert len(query_plan.filtered_objects) == 2
 
+    def test_direct_table_lq_shared_query_plan_cache(self, lq_test_repo):
+        quals = [[("fruit_id", "=", "2")]]
+        columns = ["name", "timestamp"]
+        expected = [{"name": "guitar", "timestamp": _DT}]
+
+        with mock.patch.dict(CONFIG, {"SG_LQ_PLAN_CACHE_SIZE": "2"}):
+            cache = get_plan_cache(lq_test_repo.engine)
+            cache.clear()
+            try:
+                table = lq_test_repo.head.get_table("fruits")
+                assert table.query(columns=columns, quals=quals) == expected
+                assert cache.get_stats() == (0, 1, 1)
+
+                # A different Table instance (e.g. in a different LQ session) reuses
+                # the plan without filtering fragments again.
+                table = lq_test_repo.head.get_table("fruits")
+                with mock.patch.object(
+                    ObjectManager,
+                    "filter_fragments",
+                    wraps=table.repository.objects.filter_fragments,
+                ) as fo:
+                    assert table.query(columns=columns, quals=quals) == expected
+                    assert fo.call_count == 0
+                assert cache.get_stats() == (1, 1, 1)
+
+                plan = table.get_query_plan(quals=quals, columns=columns)
+                assert plan.estimated_rows == 2
+                assert len(plan.filtered_objects) == 2
+
+                # The least recently used plan gets evicted once the cache is full.
+                table.get_query_plan(quals=[[("fruit_id", "=", "3")]], columns=columns)
+                table.get_query_plan(quals=None, columns=columns)
+                assert cache.get_stats() == (1, 3, 2)
+                table = lq_test_repo.head.get_table("fruits")
+                table.get_query_plan(quals=quals, columns=columns)
+                assert cache.get_stats() == (1, 4, 2)
+            finally:
+                cache.clear()
+                lq_test_repo.engine.commit()
+
 
 def test_layered_querying_against_single_fragment(pg_repo_local):
     # Test the case where the query is satisfied by a single fragment.
@@ -543,6 +584,114 @@ def test_disjoint_table_lq_two_singletons(pg_repo_local):
             ]
 
 
+def test_disjoint_table_lq_parallel_scans(pg_repo_local):
+    # Same as above, but scan the two singletons concurrently.
+    prepare_lq_repo(pg_repo_local, commit_after_every=True, include_pk=True)
+    pg_repo_local.run_sql("INSERT INTO fruits VALUES (4, 'fruit_4'), (5, 'fruit_5')")
+    fruits = pg_repo_local.commit().get_table("fruits")
+    quals = [[("fruit_id", ">=", "3")]]
+    expected = [
+        {"fruit_id": 3, "name": "mayonnaise"},
+        {"fruit_id": 4, "name": "fruit_4"},
+        {"fruit_id": 5, "name": "fruit_5"},
+    ]
+
+    with mock.patch(
+        "splitgraph.core.table.scan_tables_parallel", wraps=scan_tables_parallel
+    ) as stp:
+        assert fruits.query(columns=["fruit_id", "name"], quals=quals, workers=2) == expected
+        assert stp.call_count == 1
+        assert len(stp.call_args[0][1]) == 2
+
+        result = fruits.query(columns=["fruit_id", "name"], quals=quals, workers=2, ordered=False)
+        assert sorted(result, key=lambda r: r["fruit_id"]) == expected
+        assert stp.call_count == 2
+
+        # Overlapping fragments still get applied to the staging table and queried after the singletons.
+        assert fruits.query(columns=["fruit_id", "name"], quals=None, workers=2) == [
+            {"fruit_id": 3, "name": "mayonnaise"},
+            {"fruit_id": 4, "name": "fruit_4"},
+            {"fruit_id": 5, "name": "fruit_5"},
+            {"fruit_id": 2, "name": "guitar"},
+        ]
+        assert stp.call_count == 3
+
+
+def test_disjoint_table_lq_sorted(pg_repo_local):
+    prepare_lq_repo(pg_repo_local, commit_after_every=True, include_pk=True)
+    pg_repo_local.run_sql("INSERT INTO fruits VALUES (4, 'fruit_4'), (5, 'fruit_5')")
+    pg_repo_local.commit()
+    pg_repo_local.run_sql("INSERT INTO fruits VALUES (0, 'fruit_0')")
+    fruits = pg_repo_local.commit().get_table("fruits")
+    assert fruits.get_sort_key() == ["fruit_id"]
+
+    # Unsorted queries return the singletons first, sorted queries interleave them with
+    # the group of overlapping fragments covering PKs 1-2.
+    plan = fruits.get_query_plan(quals=None, columns=["fruit_id", "name"])
+    assert [len(g) for g in plan.ordered_groups] == [1, 3, 1, 1]
+    assert fruits.query(columns=["fruit_id", "name"], quals=None) == [
+        {"fruit_id": 0, "name": "fruit_0"},
+        {"fruit_id": 3, "name": "mayonnaise"},
+        {"fruit_id": 4, "name": "fruit_4"},
+        {"fruit_id": 5, "name": "fruit_5"},
+        {"fruit_id": 2, "name": "guitar"},
+    ]
+    assert fruits.query(columns=["name"], quals=None, sort=True) == [
+        {"name": "fruit_0"},
+        {"name": "guitar"},
+        {"name": "mayonnaise"},
+        {"name": "fruit_4"},
+        {"name": "fruit_5"},
+    ]
+
+    # Check the FDW gets asked to sort by the PK.
+    pg_repo_local.images["latest"].checkout(layered=True)
+    assert pg_repo_local.run_sql("SELECT fruit_id FROM fruits ORDER BY fruit_id") == [
+        (0,),
+        (2,),
+        (3,),
+        (4,),
+        (5,),
+    ]
+
+
+def test_table_aggregate(pg_repo_local):
+    prepare_lq_repo(pg_repo_local, commit_after_every=True, include_pk=True)
+    pg_repo_local.run_sql("INSERT INTO fruits VALUES (4, 'fruit_4'), (5, 'fruit_5')")
+    fruits = pg_repo_local.commit().get_table("fruits")
+    object_manager = pg_repo_local.objects
+    group = [o for o, _, _ in _get_chunk_groups(fruits)[0]]
+
+    with mock.patch.object(
+        object_manager, "ensure_objects", wraps=object_manager.ensure_objects
+    ) as ensure_objects:
+        # The two singletons are answered from the metadata, the group of fragments
+        # overlapping PKs 1-2 has to be scanned.
+        assert fruits.aggregate(
+            [("count", None), ("min", "fruit_id"), ("max", "fruit_id"), ("max", "timestamp")]
+        ) == [4, 2, 5, _DT]
+        assert ensure_objects.call_count == 1
+        assert ensure_objects.call_args[1]["objects"] == group
+
+        # Quals on the PK that match all rows in the singletons: nothing to scan.
+        assert fruits.aggregate(
+            [("count", None), ("max", "fruit_id")], quals=[[("fruit_id", ">=", "3")]]
+        ) == [3, 5]
+        assert ensure_objects.call_count == 1
+
+        # Columns that the range index can't answer for and quals on other columns
+        # fall back to scanning the fragments.
+        assert fruits.aggregate([("max", "name")], quals=[[("fruit_id", ">=", "3")]]) == [
+            "mayonnaise"
+        ]
+        assert ensure_objects.call_count == 2
+        assert fruits.aggregate([("count", None)], quals=[[("name", "=", "fruit_4")]]) == [1]
+        assert fruits.aggregate([("count", None)], quals=[[("fruit_id", "=", "42")]]) == [0]
+
+    with pytest.raises(ValueError):
+        fruits.aggregate([("avg", "fruit_id")])
+
+
 def test_disjoint_table_lq_two_singletons_one_overwritten(pg_repo_local):
     # Add another two rows to the table with PKs 4 and 5
     prepare_lq_repo(pg_repo_local, commit_after_every=True, include_pk=True)
@@ -710,6 +859,148 @@ def test_disjoint_table_lq_two_singletons_one_overwritten_indirect(pg_repo_local
     assert not pg_repo_local.engine.table_exists(SPLITGRAPH_META_SCHEMA, tmp_table)
 
 
+def test_disjoint_table_lq_group_at_a_time(pg_repo_local):
+    # Check that two groups of overlapping fragments get applied to the staging table
+    # separately, with the objects in the first group released after it's been consumed.
+    prepare_lq_repo(pg_repo_local, commit_after_every=True, include_pk=True)
+    pg_repo_local.run_sql("INSERT INTO fruits VALUES (4, 'fruit_4'), (5, 'fruit_5')")
+    pg_repo_local.commit()
+    pg_repo_local.run_sql("UPDATE fruits SET name = 'fruit_5_updated' WHERE fruit_id = 5")
+    fruits = pg_repo_local.commit().get_table("fruits")
+    groups = [[o for o, _, _ in group] for group in _get_chunk_groups(fruits)]
+    assert [len(g) for g in groups] == [3, 1, 2]
+
+    object_manager = pg_repo_local.objects
+    tables, callback, plan = fruits.query_indirect(columns=["fruit_id", "name"], quals=None)
+    assert plan.non_singleton_groups == [groups[0], groups[2]]
+
+    def _query(table):
+        return pg_repo_local.engine.run_sql(
+            _generate_select_query(pg_repo_local.engine, table, ["fruit_id", "name"])
+        )
+
+    with mock.patch.object(
+        PostgresEngine, "apply_fragments", wraps=pg_repo_local.engine.apply_fragments
+    ) as apply_fragments:
+        with mock.patch.object(
+            object_manager, "_release_objects", wraps=object_manager._release_objects
+        ) as release_objects:
+            # Singleton first
+            assert _query(next(tables)) == [(3, "mayonnaise")]
+            assert apply_fragments.call_count == 0
+
+            # Then the first group: only it gets applied to the staging table.
+            assert _query(next(tables)) == [(2, "guitar")]
+            assert apply_fragments.call_count == 1
+            assert [o for _, o in apply_fragments.call_args_list[0][0][0]] == groups[0]
+            assert release_objects.call_count == 0
+
+            # Moving on to the second group replaces the contents of the staging table
+            # and releases the first group's objects.
+            assert sorted(_query(next(tables))) == [(4, "fruit_4"), (5, "fruit_5_updated")]
+            assert apply_fragments.call_count == 2
+            assert [o for _, o in apply_fragments.call_args_list[1][0][0]] == groups[2]
+            assert (
+                apply_fragments.call_args_list[1][0][2] == apply_fragments.call_args_list[0][0][2]
+            )
+            assert release_objects.call_count == 1
+            assert sorted(release_objects.call_args_list[0][0][0]) == sorted(groups[0])
+
+            with pytest.raises(StopIteration):
+                next(tables)
+
+            # The rest of the objects only get released once, by the callback.
+            callback()
+            assert release_objects.call_count == 2
+            assert sorted(release_objects.call_args_list[1][0][0]) == sorted(groups[1] + groups[2])
+
+
+def test_disjoint_table_lq_merge_on_read(pg_repo_local):
+    # Check that groups of overlapping fragments can be merged with a single query
+    # instead of being applied to a staging table.
+    prepare_lq_repo(pg_repo_local, commit_after_every=True, include_pk=True)
+    pg_repo_local.run_sql("INSERT INTO fruits VALUES (4, 'fruit_4'), (5, 'fruit_5')")
+    pg_repo_local.commit()
+    pg_repo_local.run_sql("UPDATE fruits SET name = 'fruit_5_updated' WHERE fruit_id = 5")
+    pg_repo_local.run_sql("DELETE FROM fruits WHERE fruit_id = 4")
+    fruits = pg_repo_local.commit().get_table("fruits")
+
+    def _query(table, quals=None, qual_args=None):
+        return sorted(
+            pg_repo_local.engine.run_sql(
+                _generate_select_query(
+                    pg_repo_local.engine, table, ["fruit_id", "name"], quals, qual_args
+                )
+            )
+        )
+
+    with mock.patch.object(
+        PostgresEngine, "apply_fragments", wraps=pg_repo_local.engine.apply_fragments
+    ) as apply_fragments:
+        tables, callback, _ = fruits.query_indirect(
+            columns=["fruit_id", "name"], quals=None, merge_on_read=True
+        )
+        assert [_query(t) for t in tables] == [
+            [(3, "mayonnaise")],
+            [(2, "guitar")],
+            [(5, "fruit_5_updated")],
+        ]
+        callback()
+        assert apply_fragments.call_count == 0
+
+        # Quals are applied after picking the latest version of every row: fruit_5 has been
+        # updated, so it shouldn't be returned even though an older fragment matches.
+        tables, callback, plan = fruits.query_indirect(
+            columns=["fruit_id", "name"], quals=[[("name", "=", "fruit_5")]], merge_on_read=True
+        )
+        assert [r for t in tables for r in _query(t, plan.sql_quals, plan.sql_qual_vals)] == []
+        callback()
+        assert apply_fragments.call_count == 0
+
+    # Materialization gives the same result as applying fragments one by one.
+    fruits.materialize("fruits_merged", merge_on_read=True)
+    fruits.materialize("fruits_staged", merge_on_read=False)
+    assert (
+        pg_repo_local.run_sql("SELECT fruit_id, name FROM fruits_merged ORDER BY fruit_id")
+        == pg_repo_local.run_sql("SELECT fruit_id, name FROM fruits_staged ORDER BY fruit_id")
+        == [(2, "guitar"), (3, "mayonnaise"), (5, "fruit_5_updated")]
+    )
+
+
+def test_disjoint_table_lq_merge_on_read_no_pk(local_engine_empty):
+    # Tables without a PK are keyed on all columns: merging their fragments would collapse
+    # duplicate rows, so they always get applied to a staging table.
+    OUTPUT.init()
+    OUTPUT.run_sql("CREATE TABLE test (key INTEGER, value VARCHAR)")
+    OUTPUT.run_sql("INSERT INTO test VALUES (1, 'a'), (1, 'a'), (3, 'c')")
+    OUTPUT.commit()
+    OUTPUT.run_sql("INSERT INTO test VALUES (2, 'b')")
+    table = OUTPUT.commit().get_table("test")
+    assert len(table.objects) == 2
+
+    expected = [(1, "a"), (1, "a"), (2, "b"), (3, "c")]
+    with mock.patch.dict(CONFIG, {"SG_MERGE_ON_READ": "true"}):
+        tables, callback, _ = table.query_indirect(
+            columns=["key", "value"], quals=None, merge_on_read=True
+        )
+        assert (
+            sorted(
+                r
+                for t in tables
+                for r in OUTPUT.engine.run_sql(
+                    _generate_select_query(OUTPUT.engine, t, ["key", "value"])
+                )
+            )
+            == expected
+        )
+        callback()
+
+        assert table.aggregate([("count", None)]) == [4]
+
+        table.materialize("test_merged", merge_on_read=True)
+        assert OUTPUT.run_sql("SELECT key, value FROM test_merged ORDER BY key") == expected
+
+
 def test_disjoint_table_lq_temp_table_deletion_doesnt_lock_up(pg_repo_local):
     # When Multicorn reads from the temporary table, it does that in the context of the
     # transaction that it's been called from. It hence can hold a read lock on the
@@ -1,6 +1,9 @@
+from unittest import mock
+
 import pytest
 
 from splitgraph.core.repository import Repository
+from splitgraph.core.table import Table
 from splitgraph.engine import ResultShape
 from splitgraph.exceptions import ImageNotFoundError
 
@@ -90,6 +93,47 @@ def test_table_changes(snap_only, pg_repo_local):
     assert not pg_repo_local.engine.table_exists(pg_repo_local.to_schema(), "fruits")
 
 
+def test_checkout_incremental(pg_repo_local):
+    pg_repo_local.run_sql("ALTER TABLE fruits ADD PRIMARY KEY (fruit_id)")
+    base = pg_repo_local.commit()
+    pg_repo_local.run_sql("INSERT INTO fruits VALUES (3, 'mayonnaise')")
+    pg_repo_local.run_sql("UPDATE fruits SET name = 'pineapple' WHERE fruit_id = 1")
+    head_1 = pg_repo_local.commit()
+    pg_repo_local.run_sql("DELETE FROM fruits WHERE fruit_id = 2")
+    head_2 = pg_repo_local.commit()
+
+    def _get_fruits():
+        return sorted(pg_repo_local.run_sql("SELECT * FROM fruits"))
+
+    # Tables that are in both images get updated without being materialized from scratch.
+    with mock.patch.object(Table, "materialize", side_effect=AssertionError):
+        # Going back: rows from fragments that aren't in the target image are replaced.
+        base.checkout()
+        assert _get_fruits() == [(1, "apple"), (2, "orange")]
+        assert not pg_repo_local.has_pending_changes()
+
+        # Going forward: new fragments are applied on top of the table.
+        head_2.checkout()
+        assert _get_fruits() == [(1, "pineapple"), (3, "mayonnaise")]
+        assert not pg_repo_local.has_pending_changes()
+
+        head_1.checkout()
+        assert _get_fruits() == [(1, "pineapple"), (2, "orange"), (3, "mayonnaise")]
+        assert not pg_repo_local.has_pending_changes()
+
+    # Changes made after the checkout are still tracked.
+    pg_repo_local.run_sql("INSERT INTO fruits VALUES (4, 'kumquat')")
+    assert pg_repo_local.diff("fruits", head_1, None, aggregate=True) == (1, 0, 0)
+
+    # If the staging area has pending changes, tables are materialized from scratch.
+    with mock.patch.object(
+        Table, "materialize", autospec=True, side_effect=Table.materialize
+    ) as materialize:
+        base.checkout(force=True)
+    assert materialize.call_count == 2
+    assert _get_fruits() == [(1, "apple"), (2, "orange")]
+
+
 def test_tagging(pg_repo_local):
     head = pg_repo_local.head
     pg_repo_local.run_sql("INSERT INTO fruits VALUES (3, 'mayonnaise')")
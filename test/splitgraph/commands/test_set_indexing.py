@@ -0,0 +1,146 @@
+from datetime import date, datetime as dt, timedelta, timezone
+
+import pytest
+from test.splitgraph.conftest import OUTPUT
+
+from splitgraph.core.indexing.set import _prepare_set_quals, filter_set_index
+
+_COLUMN_TYPES = {"a": "integer", "b": "character varying", "c": "date", "d": "json"}
+
+
+@pytest.mark.parametrize(
+    "test_case",
+    [
+        # Equalities are coerced to the column's type
+        ([[("a", "=", "5")]], [[("a", 5)]]),
+        ([[("c", "=", "2020-01-01")]], [[("c", date(2020, 1, 1))]]),
+        # IN is passed to us as an OR of equalities
+        ([[("b", "=", "x"), ("b", "=", "y")]], [[("b", "x"), ("b", "y")]]),
+        # Other operators or columns that can't be in the set index drop the whole OR-clause
+        ([[("a", "=", 5), ("a", ">", 6)]], []),
+        ([[("a", "=", 5)], [("d", "=", "{}")]], [[("a", 5)]]),
+        # So do values we can't compare with the index exactly
+        ([[("a", "=", "not a number")]], []),
+        ([[("c", "=", dt(2020, 1, 1))]], []),
+        ([[("c", "=", "2020-01-01"), ("a", "=", True)]], []),
+    ],
+)
+def test_set_qual_preprocessing(test_case):
+    case, expected = test_case
+    assert _prepare_set_quals(case, _COLUMN_TYPES) == expected
+
+
+def test_set_index_querying(local_engine_empty):
+    OUTPUT.init()
+    OUTPUT.run_sql(
+        "CREATE TABLE test (key INTEGER PRIMARY KEY, value_1 VARCHAR, value_2 INTEGER, "
+        "value_3 TIMESTAMP)"
+    )
+    for i in range(30):
+        OUTPUT.run_sql(
+            "INSERT INTO test VALUES (%s, %s, %s, %s)",
+            (i + 1, ["red", "green", "blue"][(i + i // 10) % 3], i, dt(2020, 1, 1) + timedelta(i)),
+        )
+
+    # Make 3 chunks: value_1 = (red, green, blue), (green, blue, red), (blue, red, green)
+    # for the first 10 rows and so on.
+    head = OUTPUT.commit(
+        chunk_size=10,
+        extra_indexes={
+            "test": {
+                "set": {
+                    "value_1": {},
+                    "value_2": {"max_values": 5, "probability": 0.01},
+                    "value_3": {},
+                }
+            }
+        },
+    )
+    objects = head.get_table("test").objects
+    assert len(objects) == 3
+    object_meta = OUTPUT.objects.get_object_meta(objects)
+
+    # value_1 only has 3 values in each chunk, which are stored in the index.
+    assert object_meta[objects[0]].object_index["set"]["value_1"] == ["blue", "green", "red"]
+    # value_2 has 10 values per chunk and gets a bloom filter instead.
+    assert "value_2" not in object_meta[objects[0]].object_index["set"]
+    assert "value_2" in object_meta[objects[0]].object_index["bloom"]
+    assert object_meta[objects[1]].object_index["set"]["value_3"][0] == "2020-01-11 00:00:00"
+
+    column_types = {c.name: c.pg_type for c in head.get_table("test").table_schema}
+
+    def test_filter(quals, result):
+        assert filter_set_index(OUTPUT.engine, objects, quals, column_types) == result
+
+    # Every chunk has all colours
+    test_filter([[("value_1", "=", "red")]], objects)
+    test_filter([[("value_1", "=", "purple")]], [])
+    # IN: purple or red
+    test_filter([[("value_1", "=", "purple"), ("value_1", "=", "red")]], objects)
+
+    # Timestamps (passed as strings or datetimes)
+    test_filter([[("value_3", "=", "2020-01-15 00:00:00")]], [objects[1]])
+    test_filter([[("value_3", "=", dt(2020, 1, 25))]], [objects[2]])
+    test_filter([[("value_3", "=", dt(2020, 1, 25, 12))]], [])
+    test_filter(
+        [[("value_3", "=", dt(2020, 1, 2)), ("value_3", "=", dt(2020, 1, 30))]],
+        [objects[0], objects[2]],
+    )
+    # Timezone-aware timestamps can't be checked exactly
+    test_filter([[("value_3", "=", dt(2020, 1, 25, 12, tzinfo=timezone.utc))]], objects)
+
+    # AND
+    test_filter([[("value_1", "=", "red")], [("value_3", "=", dt(2020, 1, 2))]], [objects[0]])
+    test_filter([[("value_1", "=", "purple")], [("value_3", "=", dt(2020, 1, 2))]], [])
+
+    # value_2 doesn't have a set index: can't discard anything.
+    test_filter([[("value_2", "=", 100)]], objects)
+
+    # Check the index gets used when querying the table.
+    assert head.get_table("test").query(
+        columns=["key"], quals=[[("value_3", "=", "2020-01-15 00:00:00")]]
+    ) == [{"key": 15}]
+
+
+def test_set_index_changeset(local_engine_empty):
+    OUTPUT.init()
+    OUTPUT.run_sql("CREATE TABLE test (key INTEGER PRIMARY KEY, value_1 VARCHAR)")
+    for i in range(10):
+        OUTPUT.run_sql("INSERT INTO test VALUES (%s, %s)", (i + 1, "a"))
+    OUTPUT.commit(extra_indexes={"test": {"set": {"value_1": {}}}})
+
+    OUTPUT.run_sql("UPDATE test SET value_1 = 'b' WHERE key = 5")
+    OUTPUT.run_sql("DELETE FROM test WHERE key = 6")
+    head = OUTPUT.commit(extra_indexes={"test": {"set": {"value_1": {}}}})
+
+    # The patch includes both the old and the new values of the updated row.
+    patch = head.get_table("test").objects[-1]
+    object_index = OUTPUT.objects.get_object_meta([patch])[patch].object_index
+    assert object_index["set"] == {"value_1": ["a", "b"]}
+
+
+def test_set_index_post_factum(local_engine_empty):
+    OUTPUT.init()
+    OUTPUT.run_sql("CREATE TABLE test (key INTEGER PRIMARY KEY, value_1 DATE)")
+    for i in range(50):
+        OUTPUT.run_sql("INSERT INTO test VALUES (%s, %s)", (i + 1, date(2015, 1, 1 + i % 5)))
+    head = OUTPUT.commit()
+
+    head.get_table("test").reindex(extra_indexes={"set": {"value_1": {}}})
+
+    objects = head.get_table("test").objects
+    object_index = OUTPUT.objects.get_object_meta(objects)[objects[0]].object_index
+    assert object_index["set"]["value_1"] == ["2015-01-0%d" % i for i in range(1, 6)]
+
+    column_types = {"key": "integer", "value_1": "date"}
+    assert (
+        filter_set_index(OUTPUT.engine, objects, [[("value_1", "=", "2015-01-03")]], column_types)
+        == objects
+    )
+    assert (
+        filter_set_index(OUTPUT.engine, objects, [[("value_1", "=", "2015-01-06")]], column_types)
+        == []
+    )
+
+    with pytest.raises(ValueError):
+        head.get_table("test").reindex(extra_indexes={"set": {"key": {}, "value_2": {}}})
@@ -0,0 +1,101 @@
+import pytest
+from test.splitgraph.conftest import OUTPUT
+
+from splitgraph.core.indexing.trigram import (
+    _get_pattern_trigrams,
+    _get_trigrams,
+    _prepare_trigram_quals,
+    filter_trigram_index,
+)
+
+
+@pytest.mark.parametrize(
+    "test_case",
+    [
+        # Prefix: anchored at the start of the value
+        ("abc%", False, {"\x02\x02a", "\x02ab", "abc"}),
+        # Substring
+        ("%abcd%", False, {"abc", "bcd"}),
+        # Suffix: anchored at the end
+        ("%abc", False, {"abc", "bc\x03"}),
+        # Wildcards split the pattern and escaped wildcards are literals
+        ("%ab_cd\\%e%", False, {"cd%", "d%e"}),
+        # Parts that are too short can't be used
+        ("%ab%", False, set()),
+        # Everything is lowercase
+        ("%ABC%", False, {"abc"}),
+        # ILIKE doesn't use trigrams with non-ASCII characters
+        ("%Straße%", True, {"str", "tra"}),
+        ("%Straße%", False, {"str", "tra", "raß", "aße"}),
+    ],
+)
+def test_trigram_pattern(test_case):
+    pattern, case_insensitive, expected = test_case
+    assert _get_pattern_trigrams(pattern, case_insensitive) == expected
+
+
+def test_trigram_pattern_matches_value():
+    value = "2020-01-01 ERROR: Connection to Server Lost"
+    trigrams = _get_trigrams(value)
+    for pattern in ["2020-01%", "%ERROR%", "%lost", "%connection to server%", "%to_Server%"]:
+        assert _get_pattern_trigrams(pattern, True).issubset(trigrams)
+    assert not _get_pattern_trigrams("%WARNING%", False).issubset(trigrams)
+    assert not _get_pattern_trigrams("ERROR%", False).issubset(trigrams)
+
+
+def test_trigram_qual_preprocessing():
+    column_types = {"a": "text", "b": "integer"}
+    # Only LIKE/ILIKE on text columns with patterns that have trigrams can be used
+    assert len(_prepare_trigram_quals([[("a", "~~", "%abc%")]], column_types)) == 1
+    assert len(_prepare_trigram_quals([[("a", "~~*", "%abc%")]], column_types)) == 1
+    assert _prepare_trigram_quals([[("a", "!~~", "%abc%")]], column_types) == []
+    assert _prepare_trigram_quals([[("a", "~~", "%ab%")]], column_types) == []
+    assert _prepare_trigram_quals([[("b", "~~", "%123%")]], column_types) == []
+    assert _prepare_trigram_quals([[("a", "~~", "%abc%"), ("a", "=", "b")]], column_types) == []
+
+
+def test_trigram_index_querying(local_engine_empty):
+    OUTPUT.init()
+    OUTPUT.run_sql("CREATE TABLE test (key INTEGER PRIMARY KEY, message TEXT)")
+    levels = ["INFO", "WARNING", "ERROR"]
+    for i in range(30):
+        OUTPUT.run_sql(
+            "INSERT INTO test VALUES (%s, %s)",
+            (i + 1, "%s: request %d from host-%d" % (levels[i // 10], i, i // 10)),
+        )
+
+    # 3 chunks, one for each log level
+    head = OUTPUT.commit(
+        chunk_size=10, extra_indexes={"test": {"trigram": {"message": {"probability": 0.01}}}}
+    )
+    objects = head.get_table("test").objects
+    assert len(objects) == 3
+    object_meta = OUTPUT.objects.get_object_meta(objects)
+    assert "message" in object_meta[objects[0]].object_index["trigram"]
+
+    column_types = {"key": "integer", "message": "text"}
+
+    def test_filter(quals, result):
+        assert filter_trigram_index(OUTPUT.engine, objects, quals, column_types) == result
+
+    test_filter([[("message", "~~", "ERROR%")]], [objects[2]])
+    test_filter([[("message", "~~", "%WARN%")]], [objects[1]])
+    test_filter([[("message", "~~*", "%warning: request%")]], [objects[1]])
+    test_filter([[("message", "~~", "%host-0")]], [objects[0]])
+    test_filter(
+        [[("message", "~~", "%host-0"), ("message", "~~", "%host-2")]], [objects[0], objects[2]]
+    )
+    test_filter([[("message", "~~", "%CRITICAL%")]], [])
+    # Can't make a judgement about these
+    test_filter([[("message", "~~", "%a%")]], objects)
+    test_filter([[("message", "~~", "%CRITICAL%"), ("key", ">", 5)]], objects)
+
+    assert head.get_table("test").query(
+        columns=["key"], quals=[[("message", "~~*", "warning%request 15 %")]]
+    ) == [{"key": 16}]
+
+    # Reindexing with the trigram index works too
+    head.get_table("test").reindex(extra_indexes={"trigram": {"message": {"size": 64}}})
+    object_meta = OUTPUT.objects.get_object_meta(objects)
+    assert object_meta[objects[0]].object_index["trigram"]["message"][0] > 0
+    test_filter([[("message", "~~", "INFO%")]], [objects[0]])
@@ -4,6 +4,8 @@ from unittest.mock import Mock, MagicMock, call
 
 import docker
 import psycopg2
+from psycopg2.sql import SQL, Identifier
+from psycopg2.extras import Json
 import pytest
 from packaging.version import Version
 from test.splitgraph.conftest import SPLITGRAPH_ENGINE_CONTAINER
@@ -122,6 +124,47 @@ def test_run_sql_namedtuple(local_engine_empty):
     assert one_many_result[1] == 2
 
 
+def test_run_sql_stream(local_engine_empty):
+    query = "SELECT i, i * 2 FROM generate_series(1, %s) AS i"
+
+    # Rows are fetched through a server-side cursor in batches of itersize.
+    result = local_engine_empty.run_sql_stream(query, (25,), itersize=10)
+    assert next(result) == (1, 2)
+    assert (
+        local_engine_empty.run_sql(
+            "SELECT COUNT(*) FROM pg_cursors WHERE name LIKE 'sg_stream_%%'",
+            return_shape=ResultShape.ONE_ONE,
+        )
+        == 1
+    )
+    assert list(result) == [(i, i * 2) for i in range(2, 26)]
+
+    # Abandoning the iterator closes the cursor and leaves the transaction usable.
+    result = local_engine_empty.run_sql_stream(query, (100,), itersize=10)
+    assert next(result) == (1, 2)
+    del result
+    assert local_engine_empty.run_sql("SELECT 1", return_shape=ResultShape.ONE_ONE) == 1
+
+    # Errors roll back the transaction.
+    with pytest.raises(psycopg2.errors.UndefinedTable):
+        list(local_engine_empty.run_sql_stream("SELECT * FROM nonexistent_table"))
+    assert local_engine_empty.run_sql("SELECT 1", return_shape=ResultShape.ONE_ONE) == 1
+
+
+def test_engine_autocommit_stream(local_engine_empty):
+    conn_params = _prepare_engine_config(CONFIG)
+    engine = PostgresEngine(conn_params=conn_params, name="test_engine", autocommit=True)
+    try:
+        # Cursors need to be declared WITH HOLD outside of transactions.
+        assert list(engine.run_sql_stream("SELECT generate_series(1, 3)", itersize=2)) == [
+            (1,),
+            (2,),
+            (3,),
+        ]
+    finally:
+        engine.close()
+
+
 def test_uninitialized_engine_error(local_engine_empty):
     # Test things like the audit triggers/splitgraph meta schema missing raise
     # uninitialized engine errors rather than generic SQL errors.
@@ -416,3 +459,66 @@ def test_rename_object(pg_repo_local):
         pg_repo_local.engine.run_sql("SELECT * FROM splitgraph_meta." + tested_object)
 
     pg_repo_local.engine.run_sql("SELECT * FROM splitgraph_meta.renamed_object")
+
+
+def test_store_fragment_copy_keys(pg_repo_local):
+    # Check PKs that need escaping in the COPY text format make it into the fragment
+    engine = pg_repo_local.engine
+    schema = pg_repo_local.to_schema()
+    engine.run_sql(
+        SQL("CREATE TABLE {}.keys (key VARCHAR PRIMARY KEY, value INTEGER)").format(
+            Identifier(schema)
+        )
+    )
+    keys = ["tab\there", "newline\nhere", "back\\slash", "\\N"]
+    engine.run_sql_batch(
+        SQL("INSERT INTO {}.keys VALUES (%s, %s)").format(Identifier(schema)),
+        [(k, i) for i, k in enumerate(keys)],
+    )
+
+    engine.store_fragment(
+        [(k,) for k in keys], [("deleted\tkey",)], "pg_temp", "fragment", schema, "keys"
+    )
+    assert sorted(engine.run_sql("SELECT sg_ud_flag, key, value FROM pg_temp.fragment")) == sorted(
+        [(True, k, i) for i, k in enumerate(keys)] + [(False, "deleted\tkey", None)]
+    )
+
+
+def test_store_fragment_copy_keys_arrays_json(pg_repo_local):
+    # Keys come from the audit log as JSON-decoded values: check arrays and JSON
+    # scalars are formatted for their column types.
+    engine = pg_repo_local.engine
+    schema = pg_repo_local.to_schema()
+    engine.run_sql(
+        SQL("CREATE TABLE {}.no_pk (key INTEGER, tags INTEGER[])").format(Identifier(schema))
+    )
+    engine.run_sql(
+        SQL(
+            "CREATE TABLE {}.array_pk (tags TEXT[], data JSONB, value INTEGER, "
+            "PRIMARY KEY (tags, data))"
+        ).format(Identifier(schema))
+    )
+    no_pk_rows = [(1, [1, 2, None]), (2, [])]
+    engine.run_sql_batch(
+        SQL("INSERT INTO {}.no_pk VALUES (%s, %s)").format(Identifier(schema)), no_pk_rows
+    )
+    keys = [(['quote"d', "comma,", "back\\slash", None], "string"), ([], {"key": [1, 2]})]
+    engine.run_sql_batch(
+        SQL("INSERT INTO {}.array_pk VALUES (%s, %s, %s)").format(Identifier(schema)),
+        [(t, Json(d), i) for i, (t, d) in enumerate(keys)],
+    )
+
+    engine.store_fragment([(1,), (2,)], [(3,)], "pg_temp", "no_pk_fragment", schema, "no_pk")
+    assert sorted(
+        engine.run_sql("SELECT sg_ud_flag, key, tags FROM pg_temp.no_pk_fragment")
+    ) == sorted([(True,) + r for r in no_pk_rows] + [(False, 3, None)])
+
+    engine.store_fragment(
+        keys, [([["1", "2"], ["3", "4"]], 42)], "pg_temp", "array_pk_fragment", schema, "array_pk"
+    )
+    assert sorted(
+        engine.run_sql("SELECT sg_ud_flag, value, tags, data FROM pg_temp.array_pk_fragment")
+    ) == sorted(
+        [(True, i, t, d) for i, (t, d) in enumerate(keys)]
+        + [(False, None, [["1", "2"], ["3", "4"]], 42)]
+    )
@@ -1,5 +1,6 @@
 import itertools
 from datetime import datetime as dt
+from decimal import Decimal
 from unittest import mock
 
 import pytest
@@ -11,8 +12,15 @@ from test.splitgraph.conftest import (
     prepare_lq_repo,
 )
 
-from splitgraph.config import SPLITGRAPH_META_SCHEMA
-from splitgraph.core.indexing.range import _quals_to_clause
+from splitgraph.config import SPLITGRAPH_META_SCHEMA, CONFIG
+from splitgraph.core.indexing.cache import get_index_cache, decode_index
+from splitgraph.core.indexing.range import (
+    _quals_to_clause,
+    _quals_to_range_store_quals,
+    filter_range_index,
+    filter_range_index_in_memory,
+    get_range_store_bounds,
+)
 from splitgraph.core.repository import clone
 from splitgraph.core.sql import select
 from splitgraph.engine import ResultShape
@@ -453,6 +461,74 @@ def test_object_cache_deferred(local_engine_empty, pg_repo_remote, clean_minio):
         pass
 
 
+def test_object_cache_lazy(local_engine_empty, pg_repo_remote, clean_minio):
+    # Test claiming and downloading batches of objects only when the caller reaches them.
+    pg_repo_local = _setup_object_cache_test(pg_repo_remote)
+
+    object_manager = pg_repo_local.objects
+    fruits_v3 = pg_repo_local.images["latest"].get_table("fruits")
+    vegetables_v2 = pg_repo_local.images[pg_repo_local.images["latest"].parent_id].get_table(
+        "vegetables"
+    )
+    batches = [[o] for o in fruits_v3.objects] + [vegetables_v2.objects]
+    assert len(batches) == 3
+
+    prefetch_managers = []
+    get_prefetch_manager = object_manager._get_prefetch_manager
+
+    def _get_prefetch_manager():
+        prefetch_managers.append(get_prefetch_manager())
+        return prefetch_managers[-1]
+
+    with mock.patch.object(object_manager, "_get_prefetch_manager", _get_prefetch_manager):
+        batch_callbacks, callback = object_manager.ensure_objects_lazily(
+            fruits_v3, batches, prefetch=0
+        )
+    prefetch_engine = prefetch_managers[0].object_engine
+    assert prefetch_engine is not object_manager.object_engine
+    assert object_manager.get_downloaded_objects() == []
+
+    # With no prefetching, only the batch that we're at gets downloaded and claimed.
+    first_callback = next(batch_callbacks)
+    assert object_manager.get_downloaded_objects() == batches[0]
+    assert _get_refcount(object_manager, batches[0][0]) == 1
+    first_callback()
+    assert _get_refcount(object_manager, batches[0][0]) == 0
+
+    next(batch_callbacks)
+    assert sorted(object_manager.get_downloaded_objects()) == sorted(batches[0] + batches[1])
+    assert _get_refcount(object_manager, batches[1][0]) == 1
+
+    # Ending the scan releases the current batch and closes the engine used for downloads.
+    callback()
+    for object_id in batches[0] + batches[1]:
+        assert _get_refcount(object_manager, object_id) == 0
+    assert len(object_manager.get_downloaded_objects()) == 2
+    assert prefetch_engine._pool.closed
+
+    # With prefetching, objects ahead of the current batch get claimed in the background
+    # and are released when the scan ends, even if it doesn't reach them.
+    object_manager.run_eviction(keep_objects=[], required_space=None)
+    batch_callbacks, callback = object_manager.ensure_objects_lazily(fruits_v3, batches, prefetch=1)
+    next(batch_callbacks)
+    callback()
+    assert sorted(object_manager.get_downloaded_objects()) == sorted(batches[0] + batches[1])
+    for object_id in batches[0] + batches[1]:
+        assert _get_refcount(object_manager, object_id) == 0
+
+    # Check the same through layered querying: nothing gets downloaded until the scan starts.
+    object_manager.run_eviction(keep_objects=[], required_space=None)
+    tables, callback, _ = fruits_v3.query_indirect(
+        columns=["fruit_id", "name"], quals=None, prefetch=0
+    )
+    assert object_manager.get_downloaded_objects() == []
+    assert list(tables)
+    callback()
+    assert len(object_manager.get_downloaded_objects()) == 2
+    for object_id in fruits_v3.objects:
+        assert _get_refcount(object_manager, object_id) == 0
+
+
 def test_object_cache_make_external(pg_repo_local, clean_minio):
     # Test marking objects as external and uploading them to S3
     all_objects = list(sorted(pg_repo_local.objects.get_all_objects()))
@@ -517,14 +593,12 @@ def test_object_manager_index_clause_generation(pg_repo_local):
 
 def _prepare_object_filtering_dataset(include_bloom=False):
     OUTPUT.init()
-    OUTPUT.run_sql(
-        """CREATE TABLE test
+    OUTPUT.run_sql("""CREATE TABLE test
             (col1 int primary key,
              col2 int,
              col3 varchar,
              col4 timestamp,
-             col5 json)"""
-    )
+             col5 json)""")
 
     bloom_params = (
         {
@@ -702,6 +776,162 @@ def test_object_manager_object_filtering(local_engine_empty, include_bloom):
     )
 
 
+def test_object_manager_object_filtering_index_cache(local_engine_empty):
+    objects = _prepare_object_filtering_dataset()
+    om = OUTPUT.objects
+    table = OUTPUT.head.get_table("test")
+
+    index_cache = get_index_cache()
+    index_cache.clear()
+
+    all_quals = [
+        [[("col1", "=", 3)]],
+        [[("col1", ">", 5)], [("col1", "<", 12)]],
+        [[("col4", ">", "2015-12-31 00:00:00")]],
+        [[("col4", "<=", dt(2016, 1, 1))]],
+        [[("col3", "=", "accc")]],
+        [[("col3", "~~", "eee%"), ("col2", "=", 1)]],
+        [[("col1", ">", 10), ("col4", "=", "2016-01-02 00:00:00")], [("col3", "=", "dddd")]],
+    ]
+
+    with mock.patch.dict(CONFIG, {"SG_INDEX_CACHE_SIZE": "0"}):
+        assert get_index_cache() is None
+        expected = [om.filter_fragments(objects, table, quals) for quals in all_quals]
+    assert index_cache.get_stats().misses == 0
+
+    # Filtering using the in-memory indexes gives the same result and only loads them once.
+    assert [om.filter_fragments(objects, table, quals) for quals in all_quals] == expected
+    stats = index_cache.get_stats()
+    assert stats.misses == 4
+    assert stats.hits == 4 * (len(all_quals) - 1)
+    assert stats.entries == 4
+
+    # Deleting an object drops its index from the cache.
+    om.delete_objects([objects[0]])
+    assert index_cache.get_stats().entries == 3
+
+
+@pytest.mark.parametrize(
+    "quals,matches",
+    [
+        # Multicorn passes numeric literals as Decimals: these have to be compared with
+        # the exact bounds rather than their floating point approximations.
+        ([[("val", "=", Decimal("0.1"))]], True),
+        ([[("val", "<=", Decimal("0.1"))]], True),
+        ([[("val", ">=", Decimal("0.3"))]], True),
+        ([[("val", "<", Decimal("0.1"))]], False),
+        ([[("val", ">", Decimal("0.3"))]], False),
+        ([[("val", "=", "0.3")]], True),
+        ([[("val", "=", 0.1)]], True),
+        ([[("val_float", "=", Decimal("0.1"))]], True),
+        ([[("val_float", ">=", Decimal("0.3"))]], True),
+        # Real values are stored in the index as their shortest text representation and
+        # Postgres rounds values compared with real columns to single precision.
+        ([[("val_real", ">=", 0.1000000001)]], True),
+        ([[("val_real", "=", 0.10000000149011612)]], True),
+        ([[("val_real", "<=", Decimal("0.1"))]], True),
+        ([[("val_real", ">", 0.1)]], False),
+        ([[("val_real", "<", 0.1)]], False),
+    ],
+)
+def test_in_memory_range_index_numeric(quals, matches):
+    indexes = {
+        "o1": decode_index(
+            {"range": {"val": ["0.1", "0.3"], "val_float": [0.1, 0.3], "val_real": [0.1, 0.1]}},
+            {"val": "numeric", "val_float": "double precision", "val_real": "real"},
+        )
+    }
+    column_types = {"val": "numeric(10,2)", "val_float": "double precision", "val_real": "real"}
+    assert filter_range_index_in_memory(indexes, ["o1"], quals, column_types) == (
+        ["o1"] if matches else []
+    )
+
+
+def test_range_store_quals():
+    column_types = {"a": "integer", "b": "real", "c": "double precision"}
+    assert _quals_to_range_store_quals([[("a", ">=", 5)], [("c", "<", 0.5)]], column_types) == [
+        [["a", "numeric", "5", None, "[)"]],
+        [["c", "numeric", None, "0.5", "()"]],
+    ]
+    # Real columns aren't in the typed range index: their values can't be compared exactly,
+    # so the filtering falls back to the JSON index, which casts the bounds to real.
+    assert _quals_to_range_store_quals([[("b", ">=", 0.1000000001)]], column_types) is None
+    assert _quals_to_range_store_quals([[("a", "=", 1)], [("b", "=", 0.1)]], column_types) is None
+
+
+def test_object_manager_typed_range_index(local_engine_empty):
+    objects = _prepare_object_filtering_dataset()
+    obj_1, obj_2, obj_3, obj_4 = objects
+    om = OUTPUT.objects
+    engine = om.metadata_engine
+    table = OUTPUT.head.get_table("test")
+    column_types = {c.name: c.pg_type for c in table.table_schema}
+
+    # Ranges get added to the typed index when the table is registered (col5 is JSON
+    # and so isn't in the range index at all).
+    assert get_range_store_bounds(engine, objects, "col1", "integer") == {
+        obj_1: ("1", "5"),
+        obj_2: ("6", "10"),
+        obj_3: ("11", "11"),
+        obj_4: ("12", "16"),
+    }
+    assert get_range_store_bounds(engine, [obj_2], "col3", "character varying") == {
+        obj_2: ("abbb", "cccc")
+    }
+    assert get_range_store_bounds(engine, [obj_4], "col4", "timestamp without time zone") == {
+        obj_4: ("2015-12-31T00:00:00", "2016-01-04T00:00:00")
+    }
+    assert (
+        engine.run_sql(
+            "SELECT COUNT(*) FROM splitgraph_meta.object_ranges WHERE column_name = 'col5'",
+            return_shape=ResultShape.ONE_ONE,
+        )
+        == 0
+    )
+
+    assert om.get_min_max_pks(objects, [("col1", "integer")]) == [
+        ((1,), (5,)),
+        ((6,), (10,)),
+        ((11,), (11,)),
+        ((12,), (16,)),
+    ]
+
+    # Filtering using the typed index gives the same results as using the JSON index.
+    for quals in [
+        [[("col1", "=", 3)]],
+        [[("col1", ">", 5)], [("col1", "<=", 11)]],
+        [[("col2", ">=", "10"), ("col3", "<", "abbb")]],
+        [[("col3", "=", "dddd")]],
+        [[("col4", ">", "2015-12-31 00:00:00")]],
+        [[("col4", "<=", dt(2016, 1, 1))]],
+        [[("col3", "~~", "eee%")], [("col1", "=", 11)]],
+    ]:
+        with mock.patch.object(engine, "run_chunked_sql", wraps=engine.run_chunked_sql) as rcs:
+            result = filter_range_index(engine, objects, quals, column_types)
+        assert "filter_objects_by_range" in str(rcs.mock_calls[0])
+
+        with mock.patch("splitgraph.core.indexing.range._NO_RANGE_STORE", {engine.name}):
+            assert set(result) == set(filter_range_index(engine, objects, quals, column_types))
+
+    # Reindexing an object rebuilds its ranges
+    engine.run_sql(
+        "UPDATE splitgraph_meta.objects SET index = jsonb_set(index, '{range,col2}', '[100, 200]') "
+        "WHERE object_id = %s",
+        (obj_1,),
+    )
+    assert get_range_store_bounds(engine, [obj_1], "col2", "integer") == {obj_1: ("100", "200")}
+    assert filter_range_index(engine, objects, [[("col2", ">", 20)]], column_types) == [obj_1]
+
+    # The range store survives the object cleanup and new commits still get indexed.
+    om.cleanup()
+    assert "object_ranges" in engine.get_all_tables(SPLITGRAPH_META_SCHEMA)
+    OUTPUT.run_sql("INSERT INTO test VALUES (17, 17, 'eeee', '2016-01-05', '{}')")
+    new_object = OUTPUT.commit().get_table("test").objects[-1]
+    assert get_range_store_bounds(engine, [new_object], "col1", "integer") == {
+        new_object: ("17", "17")
+    }
+
+
 def test_object_manager_object_filtering_end_to_end(local_engine_empty):
     objects = _prepare_object_filtering_dataset()
     obj_1, obj_2, obj_3, obj_4 = objects
@@ -1,12 +1,13 @@
 import operator
 from functools import reduce
 from hashlib import sha256
+from unittest import mock
 
 import pytest
 from test.splitgraph.conftest import OUTPUT, PG_DATA, load_splitfile
 
 from splitgraph.config import SPLITGRAPH_META_SCHEMA
-from splitgraph.core.fragment_manager import Digest
+from splitgraph.core.fragment_manager import Digest, _lthash_from_aggregate
 from splitgraph.core.repository import Repository
 from splitgraph.splitfile import execute_commands
 
@@ -57,6 +58,85 @@ def test_digest_negation():
     assert (Digest.from_hex(HASH_SUM) + neg_dig).hex() == sub_sum.hex()
 
 
+@pytest.mark.parametrize("use_numpy", [True, False])
+def test_digest_batch_sum(use_numpy):
+    if use_numpy:
+        pytest.importorskip("numpy")
+
+    with mock.patch("splitgraph.core.fragment_manager._NUMPY_AVAILABLE", use_numpy):
+        assert Digest.sum_memoryviews(TEST_ROW_HASHES_BYTES).hex() == HASH_SUM
+        assert (
+            Digest.sum_memoryviews([memoryview(d) for d in TEST_ROW_HASHES_BYTES]).hex()
+            == HASH_SUM
+        )
+        assert Digest.sum_memoryviews(TEST_ROW_HASHES_BYTES[:1]).hex() == TEST_ROW_HASHES[0]
+        assert Digest.sum_memoryviews([]).hex() == "0" * 64
+
+        # Check wraparound on every lane
+        assert Digest.sum_memoryviews([b"\xff" * 32] * 3).hex() == (
+            _sum_digests([Digest.from_memoryview(b"\xff" * 32)] * 3).hex()
+        )
+
+        with pytest.raises(ValueError):
+            Digest.sum_memoryviews([b"\x00" * 31])
+
+
+def test_digest_lane_aggregation():
+    # Mimic what the engine-side aggregation returns (row count + untruncated per-lane sums)
+    # and check it's the same as summing up Digests.
+    lane_sums = [
+        sum(int.from_bytes(d[i * 2 : i * 2 + 2], byteorder="big") for d in TEST_ROW_HASHES_BYTES)
+        for i in range(16)
+    ]
+    digest, rows = _lthash_from_aggregate((len(TEST_ROW_HASHES_BYTES), *lane_sums))
+    assert digest.hex() == HASH_SUM
+    assert rows == 10
+
+    # Empty result (SUM returns NULLs)
+    digest, rows = _lthash_from_aggregate((0,) + (None,) * 16)
+    assert digest.hex() == "0" * 64
+    assert rows == 0
+
+
+def test_server_side_hashing_fallback(pg_repo_local):
+    om = pg_repo_local.objects
+    server_side = om.calculate_content_hash(pg_repo_local.to_schema(), "fruits")
+
+    om.server_side_hashing = False
+    assert om.calculate_content_hash(pg_repo_local.to_schema(), "fruits") == server_side
+
+
+def test_base_fragment_single_scan_index(local_engine_empty):
+    # Check the index computed while hashing the source rows is the same as the one
+    # computed by querying the stored object.
+    OUTPUT.init()
+    OUTPUT.run_sql("CREATE TABLE test (key INTEGER PRIMARY KEY, value_1 VARCHAR, value_2 INTEGER)")
+    OUTPUT.run_sql("INSERT INTO test VALUES (1, 'apple', 1), (2, NULL, 5), (3, 'orange', 3)")
+    extra_indexes = {"bloom": {"value_1": {"probability": 0.01}, "value_2": {"size": 16}}}
+    head = OUTPUT.commit(extra_indexes={"test": extra_indexes})
+
+    om = OUTPUT.objects
+    table = head.get_table("test")
+    _, rows, aggregates = om._calculate_content_hash_and_aggregates(
+        OUTPUT.to_schema(),
+        "test",
+        table.table_schema,
+        extra_aggregates=om._get_index_aggregates(table.table_schema, extra_indexes),
+    )
+    assert rows == 3
+
+    single_scan = om.generate_object_index(
+        table.objects[0],
+        table.table_schema,
+        extra_indexes=extra_indexes,
+        index_aggregates=aggregates,
+    )
+    assert single_scan == om.generate_object_index(
+        table.objects[0], table.table_schema, extra_indexes=extra_indexes
+    )
+    assert single_scan["range"]["value_1"] == ("apple", "orange")
+
+
 def test_base_fragment_hashing(pg_repo_local):
     fruits = pg_repo_local.head.get_table("fruits")
 